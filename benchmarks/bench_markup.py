@@ -0,0 +1,55 @@
+"""
+Benchmark of the markup parsing, compare the path going through
+parse and add_texts with the incremental parser emitting rich_text elements
+
+Usage:
+
+    python3 benchmarks/bench_markup.py [number_of_lines]
+"""
+import io
+import re
+import sys
+import tracemalloc
+from timeit import timeit
+from ctb_writer.beautify import parse, iter_richtext
+from ctb_writer.beautify.text_parser import Tokenizer, Token
+from ctb_writer.cherry_tree_node import CherryTreeNode
+
+LINE = "[(bold|fg:sun)]Title[/] some text [(underline|bg:salmon)]underlined[/] [[(escaped)]]\n"
+
+def tokenize_recompile(text):
+    """Tokenizer building its regex on every call"""
+    tok_regex = '|'.join('(?P<%s>%s)' % pair for pair in Tokenizer.token_specification)
+    return [Token(mo.lastgroup, mo.group(), mo.start()) for mo in re.finditer(tok_regex, text)]
+
+def parse_then_add_texts(text):
+    node = CherryTreeNode("bench")
+    node.add_texts(parse(text))
+    return node
+
+def stream_to_elements(text):
+    node = CherryTreeNode("bench")
+    node.add_rich_elements(iter_richtext(io.StringIO(text)))
+    return node
+
+def peak_memory(func, text):
+    tracemalloc.start()
+    func(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+if __name__ == "__main__":
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    text = LINE * lines
+    print(f"Markup of {len(text)} characters ({lines} lines)")
+
+    short = LINE * 5
+    for name, func in (("tokenize (regex rebuilt)", tokenize_recompile),
+                       ("tokenize (regex cached)", lambda t: list(Tokenizer.tokenize(t)))):
+        print(f"{name:<28} {timeit(lambda: func(short), number=20000):.3f}s for 20000 calls")
+
+    for name, func in (("parse + add_texts", parse_then_add_texts),
+                       ("iter_richtext (streaming)", stream_to_elements)):
+        duration = timeit(lambda: func(text), number=3) / 3
+        print(f"{name:<28} {duration:.3f}s, peak memory {peak_memory(func, text) / 1e6:.1f} MB")
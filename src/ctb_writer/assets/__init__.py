@@ -3,12 +3,97 @@ Objects available on Cherry Tree such as: table, codebox and images
 
 https://stackoverflow.com/questions/51575931/class-inheritance-in-python-3-7-dataclasses
 """
+import os
+import codecs
 import xml.etree.ElementTree as ET
+from io import BytesIO
+from os.path import expanduser
+from tempfile import SpooledTemporaryFile
+from xml.sax.saxutils import escape
+from .image_source import image_pool
 from dataclasses import dataclass
 
 __all__ = ["CherryTreeCodebox",
            "CherryTreeTable",
-           "CherryTreeImage"]
+           "CherryTreeImage",
+           "CherryTreeTextFile"]
+
+
+### Cherry Tree text backed by a file
+@dataclass
+class CherryTreeTextFile:
+    """
+    Reference to a text file, its content is only read
+    when the document is saved
+
+    :param path: The path of the file
+    :param size: The size of the file in bytes
+    :param encoding: The encoding of the file
+    """
+    path: str
+    size: int
+    encoding: str = "utf-8"
+
+    chunk_size = 1 << 20
+
+    @classmethod
+    def from_path(cls, path, encoding="utf-8"):
+        """
+        Build a reference to a file
+
+        :raises FileNotFoundError: If the file does not exist
+        :raises LookupError: If the encoding is unknown
+        """
+        path = expanduser(path)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"Cannot find file {path}")
+        encoding = codecs.lookup(encoding).name
+        return cls(path, os.path.getsize(path), encoding)
+
+    @property
+    def is_utf8(self):
+        """Check if the file can be copied as is in the database"""
+        return self.encoding in ("utf-8", "ascii")
+
+    def iter_text(self):
+        """
+        Iter through the text of the file by chunks
+        """
+        with open(self.path, "r", encoding=self.encoding, newline="") as text_file:
+            while chunk := text_file.read(self.chunk_size):
+                yield chunk
+
+    def iter_bytes(self):
+        """
+        Iter through the content of the file encoded as utf-8
+        """
+        if not self.is_utf8:
+            for chunk in self.iter_text():
+                yield chunk.encode("UTF-8")
+            return
+
+        with open(self.path, "rb") as text_file:
+            while chunk := text_file.read(self.chunk_size):
+                yield chunk
+
+    def get_size(self):
+        """
+        Return the size of the content once encoded as utf-8
+
+        :raises ValueError: If the file changed since it was referenced
+        """
+        if os.path.getsize(self.path) != self.size:
+            raise ValueError(f"File {self.path} changed since it was added to the document")
+
+        if self.is_utf8:
+            return self.size
+        return sum(len(chunk) for chunk in self.iter_bytes())
+
+    def read(self):
+        """
+        Read the whole content of the file
+        """
+        return "".join(self.iter_text())
 
 
 ### Cherry Tree default fields for object
@@ -35,7 +120,7 @@ class _CherryTreeCodeboxDefault(_CherryTreeObject):
 
 @dataclass
 class _CherryTreeCodeboxBase():
-    txt: str
+    txt: str # Can also be a CherryTreeTextFile read on save
     syntax: str
 
 @dataclass
@@ -52,6 +137,51 @@ class _CherryTreeTableDefault(_CherryTreeObject):
     col_min: int = 250
     col_max: int = 250
 
+class _TableXmlWriter:
+    """
+    Serialise the rows of a table as xml, the number of columns and
+    the longest line of each column are computed while writing
+
+    Only a window of rows is held in memory before being written
+    """
+    window = 1000
+
+    def __init__(self, output):
+        self.output = output
+        self.longest = []
+        self.row_count = 0
+
+    def write_rows(self, rows):
+        """
+        Write the rows to the output
+
+        :param rows: Any iterable of rows, cells are converted to str
+        :type rows: Iterable[Iterable]
+        """
+        pending = []
+        for row in rows:
+            parts = ["<row>"]
+            for index, cell in enumerate(row):
+                text = "" if cell is None else str(cell)
+                if index == len(self.longest):
+                    self.longest.append(0)
+                if text:
+                    longest = max(len(line) for line in text.split("\n"))
+                    self.longest[index] = max(self.longest[index], longest)
+                    parts.append(f"<cell>{escape(text)}</cell>")
+                else:
+                    parts.append("<cell />")
+            parts.append("</row>")
+            pending.append("".join(parts))
+            self.row_count += 1
+
+            if len(pending) >= self.window:
+                self.output.write("".join(pending).encode("UTF-8"))
+                pending = []
+
+        if pending:
+            self.output.write("".join(pending).encode("UTF-8"))
+
 @dataclass
 class CherryTreeTable(_CherryTreeTableDefault, _CherryTreeTableBase):
     """
@@ -69,42 +199,199 @@ class CherryTreeTable(_CherryTreeTableDefault, _CherryTreeTableBase):
                 <cell>aaa2</cell>
             </row>
         </table>
+
+    The content can be a list of rows, or any iterable of rows such as
+    a generator or a csv reader. In the latter case, the rows are
+    serialised as soon as the table is created in a temporary file
+    and the content is only rebuilt from the xml if accessed.
+
+    Tables loaded from a document keep their raw xml, the content is
+    only decoded when accessed and an untouched table is saved back
+    as it was read. Use iter_rows to read rows without decoding all.
+
+    With auto_width, the width of each column is computed from its
+    longest line and kept between col_min and col_max.
     """
+    auto_width: bool = False
+
+    # Approximate width of a character in pixels
+    char_width = 9
+    spool_size = 1 << 22
+
+    @property
+    def content(self):
+        if self._content is None:
+            # Once accessed, the content may change so the xml is dropped
+            # and the table is saved from its content
+            self._content = list(self.iter_rows())
+            self._raw_xml = None
+            self._close_rows_xml()
+        return self._content
+
+    @content.setter
+    def content(self, content):
+        self._close_rows_xml()
+        self._raw_xml = None
+        self._content = content
+        if content is not None and not isinstance(content, (list, tuple)):
+            self._content = None
+            self._rows_xml = SpooledTemporaryFile(max_size=self.spool_size)
+            self._writer = _TableXmlWriter(self._rows_xml)
+            self._writer.write_rows(content)
+
+    def _close_rows_xml(self):
+        """
+        Close the temporary file of the rows of a streamed table
+        """
+        rows_xml = getattr(self, "_rows_xml", None)
+        self._rows_xml = None
+        if rows_xml is not None:
+            rows_xml.close()
+
+    def __del__(self):
+        self._close_rows_xml()
+
+    @property
+    def is_streamed(self):
+        """Check if the table was built from an iterable of rows"""
+        return self._rows_xml is not None
+
+    @property
+    def is_loaded(self):
+        """Check if the table is still the raw xml loaded from a document"""
+        return self._raw_xml is not None
+
+    def iter_rows(self):
+        """
+        Iter through the rows of the table, the xml is parsed
+        incrementally without decoding the whole table
+
+        :rtype: Iterator[List[str]]
+        """
+        if self._content is not None:
+            yield from self._content
+            return
+
+        parser = ET.XMLPullParser(events=("start", "end"))
+        root = None
+        for chunk in self._iter_xml():
+            parser.feed(chunk)
+            for event, element in parser.read_events():
+                if event == "start":
+                    if root is None:
+                        root = element
+                elif element.tag == "row":
+                    yield [cell.text if cell.text is not None else ""
+                           for cell in element.iter("cell")]
+                    root.remove(element)
+        parser.close()
+
+    def _iter_xml(self):
+        """
+        Yield the raw xml of the table by chunks
+        """
+        if self._raw_xml is not None:
+            for i in range(0, len(self._raw_xml), self.spool_size):
+                yield self._raw_xml[i:i + self.spool_size]
+        else:
+            yield from self.iter_table()
+
+    def get_row_count(self):
+        """
+        Return the number of rows of the table, header included
+        """
+        if self.is_streamed:
+            return self._writer.row_count
+        return sum(1 for _ in self.iter_rows())
+
+    def get_header(self):
+        """
+        Return the header of the table which is the last row
+        """
+        header = None
+        for header in self.iter_rows():
+            pass
+        return header
+
+    def _get_header(self, longest):
+        """
+        Return the opening tag of the table with the col_widths
+        """
+        if self.auto_width:
+            widths = [min(max(length * self.char_width, self.col_min), self.col_max)
+                      for length in longest]
+        else:
+            widths = [0] * len(longest)
+        col_widths = ",".join(str(width) for width in widths)
+        return (f"<?xml version='1.0' encoding='UTF-8'?>\n"
+                f"<table col_widths=\"{col_widths}\">").encode("UTF-8")
+
+    def iter_table(self):
+        """
+        Yield the xml of the table by chunks of bytes
+        """
+        if self._raw_xml is not None:
+            raw_xml = self._raw_xml
+            yield raw_xml.encode("UTF-8") if isinstance(raw_xml, str) else raw_xml
+            return
+
+        if self.is_streamed:
+            writer = self._writer
+            rows_xml = self._rows_xml
+            rows_xml.seek(0)
+        else:
+            rows_xml = BytesIO()
+            writer = _TableXmlWriter(rows_xml)
+            writer.write_rows(self._content)
+            rows_xml.seek(0)
+
+        if not writer.row_count:
+            return
+
+        yield self._get_header(writer.longest)
+        while chunk := rows_xml.read(self.spool_size):
+            yield chunk
+        yield b"</table>"
+
+    def get_table_size(self):
+        """
+        Return the size in bytes of the xml of the table
+        """
+        if self._raw_xml is not None:
+            return len(b"".join(self.iter_table()))
+
+        if not self.is_streamed:
+            return len(self.get_table())
+
+        if not self._writer.row_count:
+            return 0
+        self._rows_xml.seek(0, os.SEEK_END)
+        return len(self._get_header(self._writer.longest)) + self._rows_xml.tell() + len(b"</table>")
+
     def get_table(self):
         """
-        Return the table as xml string
+        Return the table as xml string, a loaded table
+        is returned as it was read
         """
-        if not self.content:
+        if self._raw_xml is not None:
+            return self._raw_xml
+
+        xml = b"".join(self.iter_table())
+        if not xml:
             return ""
-        num_col = len(self.content[0])
-        header_width = "0,"*num_col
-        xml = ET.Element("table", attrib={"col_widths": header_width[:-1]})
-        for row in self.content:
-            new_row = ET.Element("row")
-            for cell in row:
-                new_cell = ET.Element("cell")
-                new_cell.text = cell
-                new_row.append(new_cell)
-            xml.append(new_row)
-        return ET.tostring(xml, encoding="UTF-8", xml_declaration=True)
+        return xml
 
     @classmethod
     def from_xml(cls, xml_string, position, **kwargs):
         """
-        Build a cherry tree table from the xml
+        Build a cherry tree table from the xml, the xml is
+        only decoded when the content is accessed
         """
-        table_xml = ET.fromstring(xml_string)
-        content = []
-        for row_elem in table_xml.iter("row"):
-            row = []
-            for cell in row_elem.iter("cell"):
-                if cell.text is not None:
-                    row.append(cell.text)
-                else:
-                    row.append("")
-
-            content.append(row)
-        return cls(content=content, position=position, **kwargs)
+        table = cls(content=None, position=position, **kwargs)
+        table._raw_xml = xml_string if xml_string else None
+        if table._raw_xml is None:
+            table.content = []
+        return table
 
 ### Cherry Tree image
 @dataclass
@@ -114,5 +401,33 @@ class _CherryTreeImageBase():
 
 @dataclass
 class CherryTreeImage(_CherryTreeObject, _CherryTreeImageBase):
-    """Class holding image information"""
-    pass
+    """
+    Class holding image information
+
+    The data can be given as bytes, a memoryview, an open binary
+    file or a path. It is kept as a reference and only read when
+    accessed or streamed when the document is saved. Images having
+    the same content share the same source.
+    """
+    @property
+    def data(self):
+        return self.source.read()
+
+    @data.setter
+    def data(self, data):
+        self.source = image_pool.get_source(data)
+
+    @property
+    def size(self):
+        """The size of the image in bytes"""
+        return self.source.size
+
+    def iter_data(self):
+        """
+        Yield the data of the image by chunks of bytes
+        """
+        return self.source.iter_chunks()
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}(source={self.source!r}, position={self.position}, "
+                f"justification={self.justification!r})")
@@ -0,0 +1,245 @@
+"""
+Sources of the data of an image, the data is only
+read when the document is saved or when accessed
+
+Identical images share the same source through the image pool, so
+their data is held or read from disk only once
+"""
+import os
+import hashlib
+from abc import ABC, abstractmethod
+from os.path import expanduser
+from weakref import WeakValueDictionary
+
+class ImageSource(ABC):
+    """
+    Base class for the data of an image
+    """
+    chunk_size = 1 << 20
+
+    size = 0
+    _key = None
+
+    # Whether other images can reuse this source
+    is_shareable = True
+
+    def get_key(self):
+        """
+        Return the key identifying the content of the source, the
+        key of a source which is not shareable is computed each time
+        as its content may change until the document is saved
+        """
+        if not self.is_shareable:
+            return ("sha256", self.get_digest())
+        if self._key is None:
+            self._key = ("sha256", self.get_digest())
+        return self._key
+
+    def get_digest(self):
+        """
+        Return the sha256 of the data
+        """
+        digest = hashlib.sha256()
+        for chunk in self.iter_chunks():
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    @abstractmethod
+    def iter_chunks(self):
+        """
+        Yield the data by chunks of bytes
+        """
+
+    def read(self):
+        """
+        Read the whole data
+        """
+        return b"".join(self.iter_chunks())
+
+class BufferImageSource(ImageSource):
+    """
+    Image data given as bytes or a buffer such as a memoryview,
+    the buffer is kept without being copied
+
+    A writable buffer may still be changed before the document is
+    saved, so it is never reused by other images
+    """
+    def __init__(self, buffer):
+        self.buffer = memoryview(buffer).cast("B")
+        self.size = self.buffer.nbytes
+        self.is_shareable = self.buffer.readonly
+
+    def iter_chunks(self):
+        for i in range(0, self.size, self.chunk_size):
+            yield self.buffer[i:i + self.chunk_size]
+
+    def read(self):
+        if isinstance(self.buffer.obj, bytes) and len(self.buffer.obj) == self.size:
+            return self.buffer.obj
+        return self.buffer.tobytes()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(size={self.size})"
+
+class FileImageSource(ImageSource):
+    """
+    Image stored in a file, only the path and the size are kept
+    """
+    def __init__(self, path):
+        self.path = expanduser(os.fspath(path))
+        self.size = os.path.getsize(self.path)
+
+    def get_key(self):
+        """
+        The same file is only read once, as long as it is not modified
+        """
+        if self._key is None:
+            stat = os.stat(self.path)
+            self._key = ("file", os.path.realpath(self.path), stat.st_size, stat.st_mtime_ns)
+        return self._key
+
+    def iter_chunks(self):
+        """
+        :raises ValueError: If the file changed since the image was added
+        """
+        if os.path.getsize(self.path) != self.size:
+            raise ValueError(f"Image {self.path} changed since it was added to the document")
+
+        with open(self.path, "rb") as file_image:
+            while chunk := file_image.read(self.chunk_size):
+                yield chunk
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(path={self.path!r}, size={self.size})"
+
+class StreamImageSource(ImageSource):
+    """
+    Image read from an open binary file, from its current position.
+    The file must stay open until the document is saved, so the
+    source is never reused by other images
+    """
+    is_shareable = False
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.start = stream.tell()
+        self.size = stream.seek(0, os.SEEK_END) - self.start
+        stream.seek(self.start)
+
+    def iter_chunks(self):
+        self.stream.seek(self.start)
+        remaining = self.size
+        while remaining > 0:
+            chunk = self.stream.read(min(self.chunk_size, remaining))
+            if not chunk:
+                raise ValueError(f"Image stream {self.stream!r} is shorter than expected")
+            remaining -= len(chunk)
+            yield chunk
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(stream={self.stream!r}, size={self.size})"
+
+class DatabaseImageSource(ImageSource):
+    """
+    Image stored in the table image of a document, only its
+    rowid is kept and the blob is read incrementally when needed
+    """
+    def __init__(self, con, database, rowid, size):
+        self.con = con
+        self.database = database
+        self.rowid = rowid
+        self.size = size or 0
+        stat = os.stat(database)
+        # A document replaced or saved again is another file, its rows are not the same images
+        self._file_id = (stat.st_ino, stat.st_mtime_ns)
+
+    def get_key(self):
+        return ("database", os.path.abspath(self.database), *self._file_id, self.rowid)
+
+    def _open_blob(self):
+        return self.con.blobopen("image", "png", self.rowid, readonly=True)
+
+    def iter_chunks(self):
+        if not self.size:
+            return
+        if not hasattr(self.con, "blobopen"):
+            yield self.read()
+            return
+
+        with self._open_blob() as blob:
+            while chunk := blob.read(self.chunk_size):
+                yield chunk
+
+    def read(self):
+        if not self.size:
+            return b""
+        if not hasattr(self.con, "blobopen"):
+            row = self.con.execute("SELECT png FROM image WHERE rowid=?", (self.rowid,)).fetchone()
+            return row[0]
+
+        with self._open_blob() as blob:
+            return blob.read()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(database={self.database!r}, rowid={self.rowid}, size={self.size})"
+
+def get_image_source(image):
+    """
+    Return the source of an image
+
+    :param image: The path of the image, an open binary file or the data
+    :type image: Union[str, os.PathLike, BinaryIO, bytes, memoryview]
+
+    :raises FileNotFoundError: If the image is a path that does not exist
+    """
+    if isinstance(image, ImageSource):
+        return image
+
+    if isinstance(image, bytearray):
+        # A bytearray is usually reused by the caller, so its data is copied
+        return BufferImageSource(bytes(image))
+
+    if isinstance(image, (bytes, memoryview)):
+        return BufferImageSource(image)
+
+    if hasattr(image, "read"):
+        return StreamImageSource(image)
+
+    return FileImageSource(image)
+
+class ImagePool:
+    """
+    Pool of the image sources alive, an image whose content is already
+    in the pool reuses the existing source instead of keeping its own
+    buffer or reading the same file again
+
+    Read only buffers are identified by the sha256 of their data, files
+    by their path, size and modification time. Streams and writable
+    buffers are not shared, they are only identified when saved
+    """
+    def __init__(self):
+        self._sources = WeakValueDictionary()
+
+    def get_source(self, image):
+        """
+        Return the source to use for an image
+
+        :param image: The path of the image, an open binary file or the data
+        :type image: Union[str, os.PathLike, BinaryIO, bytes, memoryview]
+        """
+        source = get_image_source(image)
+        if not source.is_shareable:
+            return source
+
+        key = source.get_key()
+        shared = self._sources.get(key)
+        if shared is not None:
+            return shared
+
+        self._sources[key] = source
+        return source
+
+    def __len__(self):
+        return len(self._sources)
+
+image_pool = ImagePool()
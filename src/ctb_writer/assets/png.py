@@ -0,0 +1,138 @@
+"""
+Pure python recompression of the png embedded in a document
+
+The pixels are left untouched: the IDAT chunks are inflated and deflated
+again at a higher level, and the ancillary chunks are stripped except
+the ones changing how the image is drawn (transparency and colors).
+
+https://www.w3.org/TR/png/#5Chunk-layout
+"""
+import os
+import zlib
+import struct
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Ancillary chunks kept, others such as tEXt, tIME or pHYs are stripped
+KEPT_ANCILLARY = {b"tRNS", b"gAMA", b"cHRM", b"sRGB", b"iCCP"}
+
+def _iter_chunks(data):
+    """
+    Yield the (type, data) of each chunk of a png
+
+    :raises ValueError: If the png is truncated or a crc is invalid
+    """
+    position = len(PNG_SIGNATURE)
+    while position < len(data):
+        if position + 8 > len(data):
+            raise ValueError("Truncated png chunk")
+        length, chunk_type = struct.unpack(">I4s", data[position:position + 8])
+        chunk_data = data[position + 8:position + 8 + length]
+        crc = data[position + 8 + length:position + 12 + length]
+        if len(chunk_data) != length or len(crc) != 4:
+            raise ValueError("Truncated png chunk")
+        if zlib.crc32(chunk_type + chunk_data) != struct.unpack(">I", crc)[0]:
+            raise ValueError(f"Invalid crc for png chunk {chunk_type!r}")
+        yield chunk_type, chunk_data
+        position += 12 + length
+        if chunk_type == b"IEND":
+            return
+
+def _chunk(chunk_type, chunk_data):
+    """
+    Build a png chunk
+    """
+    crc = zlib.crc32(chunk_type + chunk_data)
+    return struct.pack(">I4s", len(chunk_data), chunk_type) + chunk_data + struct.pack(">I", crc)
+
+def _deflate(data, level):
+    """
+    Deflate the data with the strategy giving the smallest result
+    """
+    results = []
+    for strategy in (zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 15, 9, strategy)
+        results.append(compressor.compress(data) + compressor.flush())
+    return min(results, key=len)
+
+def recompress_png(data, level=9):
+    """
+    Recompress a png
+
+    :param data: The png to recompress
+    :type data: bytes
+
+    :param level: The zlib level to use
+    :type level: int
+
+    :return: The png recompressed, or None if the data is not a
+             png that can be made smaller
+    :rtype: Optional[bytes]
+    """
+    if not data.startswith(PNG_SIGNATURE):
+        return None
+
+    try:
+        chunks = list(_iter_chunks(data))
+    except ValueError:
+        return None
+
+    chunk_types = [chunk_type for chunk_type, _ in chunks]
+    if b"IDAT" not in chunk_types or b"acTL" in chunk_types:
+        # Animated png store frames in other chunks, keep them as is
+        return None
+
+    try:
+        pixels = zlib.decompress(b"".join(chunk_data for chunk_type, chunk_data in chunks
+                                          if chunk_type == b"IDAT"))
+    except zlib.error:
+        return None
+
+    output = [PNG_SIGNATURE]
+    idat_written = False
+    for chunk_type, chunk_data in chunks:
+        if chunk_type == b"IDAT":
+            if not idat_written:
+                output.append(_chunk(b"IDAT", _deflate(pixels, level)))
+                idat_written = True
+
+        elif chunk_type[0:1].isupper() or chunk_type in KEPT_ANCILLARY:
+            output.append(_chunk(chunk_type, chunk_data))
+
+    recompressed = b"".join(output)
+    if len(recompressed) >= len(data):
+        return None
+    return recompressed
+
+def iter_recompressed(pngs, level=9, workers=None):
+    """
+    Recompress png in a pool of processes, only a window of png is
+    read and sent to the processes at the same time
+
+    :param pngs: The png to recompress, read lazily
+    :type pngs: Iterable[bytes]
+
+    :param workers: The number of processes, 1 recompresses in the current process
+    :type workers: int
+
+    :return: For each png, in order, the png recompressed or None
+             if it cannot be made smaller
+    :rtype: Iterator[Optional[bytes]]
+    """
+    if workers == 1:
+        for data in pngs:
+            yield recompress_png(data, level)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for data in pngs:
+            pending.append(executor.submit(recompress_png, data, level))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
@@ -1 +1,3 @@
-from .text import CherryTreeRichtext, color, parse
+from .text import CherryTreeRichtext, color, parse, iter_parse, iter_richtext, resolve_style
+from .template import MarkupTemplate, compile_markup
+from .plain_text import plain_text, insert_placeholders, iter_runs, iter_plain_texts, OBJECT_REPLACEMENT
@@ -0,0 +1,147 @@
+"""
+Extract the plain text of rich text nodes
+
+The raw xml of the txt column is read with expat, by chunks, without
+building an element tree. The functions are defined at module level
+so they can be sent to a process pool.
+"""
+import os
+from collections import deque
+from xml.parsers import expat
+from concurrent.futures import ProcessPoolExecutor
+
+# Character standing for an entity (codebox, table or image) in a plain text
+OBJECT_REPLACEMENT = "\ufffc"
+
+# Size of the chunks of xml given to the parser
+CHUNK_SIZE = 1 << 16
+
+def iter_runs(txt):
+    """
+    Parse the xml of a rich text and yield its runs
+
+    :param txt: The xml of the node, as stored in the txt column
+    :type txt: Union[str, bytes]
+
+    :return: The attributes and the text of each rich_text
+    :rtype: Iterator[Tuple[Dict[str, str], str]]
+    """
+    if not txt:
+        return
+
+    runs = []
+    current = None
+
+    def start(name, attributes):
+        nonlocal current
+        if name == "rich_text":
+            current = (attributes, [])
+
+    def end(name):
+        nonlocal current
+        if name == "rich_text" and current is not None:
+            runs.append((current[0], "".join(current[1])))
+            current = None
+
+    def data(text):
+        if current is not None:
+            current[1].append(text)
+
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = data
+    for i in range(0, len(txt), CHUNK_SIZE):
+        parser.Parse(txt[i:i + CHUNK_SIZE], False)
+        yield from runs
+        runs.clear()
+    parser.Parse(b"", True)
+    yield from runs
+
+def insert_placeholders(texts, entities, placeholder):
+    """
+    Yield the texts with a placeholder at the offset of each entity,
+    an entity counts for one character in the offsets
+
+    :param texts: The texts of the runs, in order
+    :type texts: Iterable[str]
+
+    :param entities: The offsets of the entities, or (offset, placeholder) pairs
+    :type entities: Iterable[Union[int, Tuple[int, str]]]
+    """
+    pending = deque(sorted((entity, placeholder) if isinstance(entity, int) else tuple(entity)
+                           for entity in entities))
+    position = 0
+    for text in texts:
+        while pending and pending[0][0] <= position + len(text):
+            cut = max(pending[0][0] - position, 0)
+            yield text[:cut]
+            yield pending.popleft()[1]
+            text = text[cut:]
+            position += cut + 1
+        yield text
+        position += len(text)
+    for _, entity_placeholder in pending:
+        yield entity_placeholder
+
+def plain_text(txt, entities=(), placeholder=OBJECT_REPLACEMENT):
+    """
+    Return the plain text of a rich text, with the entities as placeholders
+
+    :param txt: The xml of the node, as stored in the txt column
+    :type txt: Union[str, bytes]
+
+    :param entities: The offsets of the entities of the node, or (offset, text)
+                     pairs to use another placeholder for some entities
+    :type entities: Iterable[Union[int, Tuple[int, str]]]
+
+    :param placeholder: The text standing for an entity
+    :type placeholder: str
+
+    :rtype: str
+    """
+    texts = (text for _, text in iter_runs(txt))
+    return "".join(insert_placeholders(texts, entities, placeholder))
+
+def _plain_texts(rows, placeholder):
+    """
+    Extract the plain text of a batch of rows, in a worker process
+    """
+    return [plain_text(txt, entities, placeholder) for txt, entities in rows]
+
+def iter_plain_texts(rows, workers=None, batch_size=1000, placeholder=OBJECT_REPLACEMENT):
+    """
+    Extract the plain text of many rich texts with a pool of processes,
+    the rows are sent by batches and only a window of batches is
+    pending at the same time
+
+    :param rows: The xml of the nodes and the offsets of their entities
+    :type rows: Iterable[Tuple[Union[str, bytes], Iterable[int]]]
+
+    :param workers: The number of processes, 1 extracts in the current process
+    :type workers: int
+
+    :return: The plain texts, in the order of the rows
+    :rtype: Iterator[str]
+    """
+    if workers == 1:
+        for txt, entities in rows:
+            yield plain_text(txt, entities, placeholder)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                pending.append(executor.submit(_plain_texts, batch, placeholder))
+                batch = []
+            if len(pending) > 2 * workers:
+                yield from pending.popleft().result()
+        if batch:
+            pending.append(executor.submit(_plain_texts, batch, placeholder))
+        while pending:
+            yield from pending.popleft().result()
@@ -0,0 +1,96 @@
+"""
+Markup templates that are tokenized once and rendered many times
+
+Usage:
+
+    >>> template = compile_markup("[(bold|fg:sun)]{title}[/] by {author}\n")
+    >>> template.render(title="Report", author="me")
+"""
+import xml.etree.ElementTree as ET
+from string import Formatter
+from .text import parse, resolve_style
+
+_formatter = Formatter()
+
+class MarkupTemplate:
+    """
+    Markup text whose tokens and styles are resolved once, the text
+    of each run can contain fields such as '{title}' replaced on render
+
+    The values given on render are never parsed as markup
+    """
+    def __init__(self, template):
+        self.template = template
+        self.runs = []
+        for style, text in parse(template):
+            attributes = resolve_style(style)
+            self.runs.append((style, attributes, self._compile_text(text)))
+
+    @staticmethod
+    def _compile_text(text):
+        """
+        Split the text of a run into literals and fields
+
+        :raises ValueError: If a field is positional
+        """
+        pieces = []
+        for literal, field_name, format_spec, conversion in _formatter.parse(text):
+            if field_name is not None and (field_name == "" or field_name[0].isdigit()):
+                raise ValueError(f"Positional field in {text!r} is not supported, name the field")
+            pieces.append((literal, field_name, format_spec, conversion))
+        return pieces
+
+    @staticmethod
+    def _format(pieces, values):
+        """
+        Build the text of a run from its pieces
+        """
+        parts = []
+        for literal, field_name, format_spec, conversion in pieces:
+            parts.append(literal)
+            if field_name is None:
+                continue
+            value, _ = _formatter.get_field(field_name, (), values)
+            value = _formatter.convert_field(value, conversion)
+            if format_spec and "{" in format_spec:
+                format_spec = _formatter.vformat(format_spec, (), values)
+            parts.append(format(value, format_spec))
+        return "".join(parts)
+
+    def render_runs(self, **values):
+        """
+        Render the template as a list of (style, text) as returned by parse
+        """
+        runs = []
+        for style, _, pieces in self.runs:
+            text = self._format(pieces, values)
+            if text:
+                runs.append((style, text))
+        return runs
+
+    def render(self, **values):
+        """
+        Render the template as a list of rich_text elements
+        """
+        elements = []
+        for _, attributes, pieces in self.runs:
+            text = self._format(pieces, values)
+            if text:
+                element = ET.Element("rich_text", **attributes)
+                element.text = text
+                elements.append(element)
+        return elements
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.template!r})"
+
+def compile_markup(template):
+    """
+    Compile a markup text into a reusable template
+
+    :param template: The markup text with fields to replace
+    :type template: str
+
+    :rtype: class:`MarkupTemplate`
+    """
+    return MarkupTemplate(template)
@@ -4,11 +4,18 @@ This file allows to add beautify text to cherrytree
 import re
 import warnings
 import xml.etree.ElementTree as ET
+from functools import lru_cache
+from types import MappingProxyType
 from ctb_writer.styles import styles
-from .text_parser import Tokenizer
+from .text_parser import MarkupParser
 
 COLOR_RE = re.compile(r"#[0-9a-f]{6}", re.I)
+SIZE_RE = re.compile(r"^(h[1-6]|small)$", re.I)
 
+# Number of distinct colors and styles resolved that are kept
+STYLE_CACHE_SIZE = 512
+
+@lru_cache(maxsize=STYLE_CACHE_SIZE)
 def get_color(color):
     """
     Return a color from input hex or name
@@ -50,41 +57,106 @@ def parse(text):
     """
     Parse a given text and return a list of usable tuples
     """
-    tokens = Tokenizer.tokenize(text)
-    result = []
-    current_style = ""
-    current_position = 0
-
-    for token in tokens:
-        # append plain text before this token if non-empty
-        if token.column > current_position:
-            piece = text[current_position:token.column]
-            if piece:
-                result.append((current_style, piece))
-
-        if token.type == "START":
-            current_style = token.value[2:-2].strip()
-            current_position = token.column + len(token.value)
-
-        elif token.type == "END":
-            current_style = ""
-            current_position = token.column + len(token.value)
-
-        elif token.type == "ESCAPE":
-            # treat escape as literal text; '[[(X)]]' -> '[(X)]'
-            unescaped = token.value[1:-1]
-            if unescaped:
-                result.append((current_style, unescaped))
-            current_position = token.column + len(token.value)
-
-    # trailing text
-    if current_position < len(text):
-        tail = text[current_position:]
-        if tail:
-            result.append((current_style, tail))
-
+    parser = MarkupParser()
+    result = parser.feed(text)
+    result.extend(parser.close())
     return result
 
+def iter_parse(source):
+    """
+    Parse a markup text incrementally and yield the (style, text) runs
+
+    :param source: The text, or an iterable of chunks of text such as an open file
+    :type source: Union[str, Iterable[str]]
+    """
+    if isinstance(source, str):
+        yield from parse(source)
+        return
+
+    parser = MarkupParser()
+    for chunk in source:
+        yield from parser.feed(chunk)
+    yield from parser.close()
+
+def iter_richtext(source):
+    """
+    Parse a markup text incrementally and yield rich_text elements
+
+    :param source: The text, or an iterable of chunks of text such as an open file
+    :type source: Union[str, Iterable[str]]
+    """
+    for style, text in iter_parse(source):
+        element = ET.Element("rich_text", **resolve_style(style))
+        element.text = text
+        yield element
+
+@lru_cache(maxsize=STYLE_CACHE_SIZE)
+def parse_style(style):
+    """
+    Parse a style such as 'bold|fg:sun' into the attributes
+    expected by :meth:`CherryTreeRichtext.from_attributes`
+
+    :rtype: Mapping[str, str]
+    """
+    attrib = {}
+    for text_style in style.split("|"):
+        if text_style == "bold":
+            attrib["bold"] = True
+
+        elif text_style == "underline":
+            attrib["underline"] = True
+
+        elif text_style == "italic":
+            attrib["italic"] = True
+
+        elif ":" in text_style:
+            style_name, style_val = text_style.split(":")
+            if style_name == "fg" or style_name == "bg":
+                attrib[style_name] = get_color(style_val)
+            else:
+                attrib[style_name] = style_val
+
+    return MappingProxyType(attrib)
+
+@lru_cache(maxsize=STYLE_CACHE_SIZE)
+def resolve_style(style):
+    """
+    Resolve a style such as 'bold|fg:sun' into the xml attributes
+    of a rich_text, identical styles share the same mapping
+
+    :rtype: Mapping[str, str]
+    """
+    return CherryTreeRichtext.from_style("", style).get_attributes()
+
+@lru_cache(maxsize=STYLE_CACHE_SIZE)
+def _get_xml_attributes(bold, underline, italic, size, fg, bg):
+    """
+    Return the xml attributes of a rich_text for the style given
+    """
+    text_attributes = {}
+    if bold:
+        text_attributes["weight"] = "heavy"
+
+    if fg:
+        text_attributes["foreground"] = fg
+
+    if bg:
+        text_attributes["background"] = bg
+
+    if underline:
+        text_attributes["underline"] = "single"
+
+    if italic:
+        text_attributes["style"] = "italic"
+
+    if size:
+        if not SIZE_RE.match(size):
+            warnings.warn(f"Unknown size: {size}, use h1-6 or small")
+        else:
+            text_attributes["scale"] = size.lower()
+
+    return MappingProxyType(text_attributes)
+
 class CherryTreeRichtext:
     """
     Class allowing some operations on text, such as:
@@ -130,33 +202,19 @@ class CherryTreeRichtext:
         """
         self._bg = color
 
+    def get_attributes(self):
+        """
+        Get the xml attributes of the text, the mapping returned
+        is shared by all the texts having the same style
+        """
+        return _get_xml_attributes(self.bold, self.underline, self.italic,
+                                   self.size, self.fg, self.bg)
+
     def get_xml(self):
         """
         Get the text on cherry tree format
         """
-        text_attributes = {}
-        if self.bold:
-            text_attributes["weight"] = "heavy"
-
-        if self.fg:
-            text_attributes["foreground"] = self.fg
-
-        if self.bg:
-            text_attributes["background"] = self.bg
-
-        if self.underline:
-            text_attributes["underline"] = "single"
-
-        if self.italic:
-            text_attributes["style"] = "italic"
-
-        if self.size:
-            if not re.match(r"^(h[1-6]|small)$", self.size, re.I):
-                warnings.warn(f"Unknown size: {self.size}, use h1-6 or small")
-            else:
-                text_attributes["scale"] = self.size.lower()
-
-        richtext = ET.Element("rich_text", attrib=text_attributes)
+        richtext = ET.Element("rich_text", **self.get_attributes())
         richtext.text = self.text
         return richtext
 
@@ -165,25 +223,7 @@ class CherryTreeRichtext:
         """
         Parse a style and return the text
         """
-        attrib = {}
-        for text_style in style.split("|"):
-            if text_style == "bold":
-                attrib["bold"] = True
-
-            elif text_style == "underline":
-                attrib["underline"] = True
-
-            elif text_style == "italic":
-                attrib["italic"] = True
-
-            elif ":" in text_style:
-                style_name, style_val = text_style.split(":")
-                if style_name == "fg" or style_name == "bg":
-                    attrib[style_name] = get_color(style_val)
-                else:
-                    attrib[style_name] = style_val
-
-        return cls.from_attributes(text, attrib)
+        return cls.from_attributes(text, parse_style(style))
 
     @classmethod
     def from_attributes(cls, text, attributes):
@@ -27,19 +27,97 @@ class Tokenizer:
         ("START", r"\[\(.+?\)\]"), # Start tag like: [(bold|underline)]
         ("END", r"\[/\]"), # End tag such as: [/]
     ]
+    tok_regex = re.compile('|'.join('(?P<%s>%s)' % pair for pair in token_specification))
 
     @classmethod
     def tokenize(cls, text):
         """
         Tokenize the text
         """
-        tok_regex = '|'.join('(?P<%s>%s)' % pair for pair in cls.token_specification)
-        for mo in re.finditer(tok_regex, text):
+        for mo in cls.tok_regex.finditer(text):
             kind = mo.lastgroup
             value = mo.group()
             column = mo.start()
             yield Token(kind, value, column)
 
+class MarkupParser:
+    """
+    Incremental parser for a markup text, the text can be fed by chunks
+    and the (style, text) runs are returned as soon as they are complete
+
+    Tokens never span multiple lines, so only the last incomplete
+    line of the text is kept between two calls to feed
+
+    Usage:
+
+        >>> parser = MarkupParser()
+        >>> parser.feed("[(bold)]bold ")
+        >>> parser.feed("text[/]\n")
+        [('bold', 'bold text')]
+        >>> parser.close()
+    """
+    def __init__(self):
+        self.style = ""
+        self._pending = []
+        self._buffer = ""
+
+    def feed(self, data):
+        """
+        Feed the parser with a chunk of text
+
+        :return: The runs completed by this chunk
+        :rtype: List[Tuple[str, str]]
+        """
+        data = self._buffer + data
+        cut = data.rfind("\n") + 1
+        self._buffer = data[cut:]
+        return self._parse(data[:cut])
+
+    def close(self):
+        """
+        Parse the remaining text and return the last runs
+        """
+        runs = self._parse(self._buffer)
+        self._buffer = ""
+        self._flush(runs)
+        return runs
+
+    def _flush(self, runs):
+        """
+        Add the text pending to the runs
+        """
+        if self._pending:
+            runs.append((self.style, "".join(self._pending)))
+            self._pending = []
+
+    def _parse(self, text):
+        """
+        Parse complete lines of text
+        """
+        runs = []
+        position = 0
+        for mo in Tokenizer.tok_regex.finditer(text):
+            if mo.start() > position:
+                self._pending.append(text[position:mo.start()])
+            self._flush(runs)
+
+            kind = mo.lastgroup
+            if kind == "START":
+                self.style = mo.group()[2:-2].strip()
+
+            elif kind == "END":
+                self.style = ""
+
+            elif kind == "ESCAPE":
+                # treat escape as literal text; '[[(X)]]' -> '[(X)]'
+                unescaped = mo.group()[1:-1]
+                if unescaped:
+                    runs.append((self.style, unescaped))
+            position = mo.end()
+
+        if position < len(text):
+            self._pending.append(text[position:])
+        return runs
 
 
 if __name__ == "__main__":
@@ -2,9 +2,15 @@
 This class allows to create a new CherryTree and manipulate it
 """
 import os
+import sqlite3
 import xml.etree.ElementTree as ET
-from .cherry_tree_node import CherryTreeNode, _CherryTreeNodeBase
+from collections.abc import Mapping
+from .cherry_tree_node import CherryTreeNode, CherryTreeCodeNode, CherryTreePlainNode, _CherryTreeNodeBase
 from .cherry_tree_link import CherryTreeLink
+from .cherry_tree_xml import CherryTreeXmlLink
+from .cherry_tree_search import CherryTreeSearchIndex
+from .cherry_tree_tags import CherryTreeTagIndex
+from .cherry_tree_report import CherryTreeSaveReport
 from .icons import get_icon
 
 class CherryTree:
@@ -89,6 +95,7 @@ class CherryTree:
         if not new_node_id:
             raise ValueError(f"Cannot find a new id")
         node.node_id = new_node_id
+        self._set_children_ids(node, new_node_id + 1)
         if parent_id == 0:
             self.nodes.append(node)
         else:
@@ -97,6 +104,21 @@ class CherryTree:
             node_res.append(node)
         return node.node_id
 
+    @staticmethod
+    def _set_children_ids(node, next_id):
+        """
+        Allocate the ids of the children built with the node, in
+        depth first order and in one block starting from next_id
+        """
+        stack = [(child, node) for child in reversed(node.children)]
+        while stack:
+            child, father = stack.pop()
+            child.node_id = next_id
+            child.father_id = father.node_id
+            next_id += 1
+            stack.extend((grand_child, child) for grand_child in reversed(child.children))
+        return next_id
+
     def add_child(self, node, text="", icon="", is_ro=0, parent_id=0):
         """
         Add a child to the parent
@@ -125,10 +147,160 @@ class CherryTree:
 
         raise ValueError(f"Cannot insert node with type {type(node)}")
 
+    @classmethod
+    def from_records(cls, records):
+        """
+        Create a document from records, see :meth:`extend_tree`
+        """
+        document = cls()
+        document.extend_tree(records)
+        return document
+
+    def extend_tree(self, records, parent_id=0):
+        """
+        Add many nodes at once, the ids are allocated in one block and
+        the children are linked directly without looking for their parent
+
+        A record is either a dict such as:
+            {"name": "Node", "type": "code", "syntax": "python", "text": "...",
+             "icon": "python", "is_ro": 0, "tags": ["tag"], "children": [...]}
+
+        Or a tuple (id, parent, name, type, text, syntax, icon, tags) where only
+        the first three fields are required. The id is only used to link records
+        together, a parent which is not the id of a record is the id of a node
+        already in the document, and 0 or None means under parent_id.
+
+        :param records: The records of the nodes to add
+        :type records: Iterable[Union[Dict, Tuple]]
+
+        :param parent_id: The id of the node under which to add the records
+        :type parent_id: int
+
+        :return: The ids of the nodes added
+        :rtype: List[int]
+
+        :raises ValueError: If a parent cannot be found or records are their
+                            own ancestors, the document is left unchanged
+        """
+        next_id = self.get_new_id()
+        added = []
+        by_record_id = {}
+        tuple_records = []
+        # The nodes to add under parent_id or under a node of the document
+        attachments = []
+
+        for record in records:
+            if isinstance(record, Mapping):
+                stack = [(record, None)]
+                while stack:
+                    current, father = stack.pop()
+                    node = self._node_from_record(current.get("name", ""), current.get("type", "rich"),
+                                                  current.get("text", ""), current.get("syntax"),
+                                                  current.get("icon", 0), current.get("tags"),
+                                                  current.get("is_ro", 0))
+                    node.node_id = next_id
+                    next_id += 1
+                    added.append(node.node_id)
+                    if father is None:
+                        attachments.append((node, parent_id))
+                    else:
+                        node.father_id = father.node_id
+                        father.append(node)
+                    stack.extend((child, node) for child in reversed(current.get("children", [])))
+            else:
+                record_id, parent, name, *fields = record
+                node = self._node_from_record(name, *fields)
+                node.node_id = next_id
+                next_id += 1
+                added.append(node.node_id)
+                by_record_id[record_id] = node
+                tuple_records.append((record_id, node, parent))
+
+        self._check_record_cycles({record_id: parent for record_id, _, parent in tuple_records})
+        for _, node, parent in tuple_records:
+            if parent not in by_record_id or parent in (0, None):
+                attachments.append((node, parent_id if parent in (0, None) else parent))
+
+        # Every parent is checked before the tree is changed
+        father_ids = {father_id for _, father_id in attachments if father_id != 0}
+        node_index = {node.node_id: node for node in self._get_all_nodes()} if father_ids else {}
+        for father_id in father_ids:
+            if father_id not in node_index:
+                raise ValueError(f"Cannot find the parent node {father_id}")
+
+        for _, node, parent in tuple_records:
+            if parent in by_record_id and parent not in (0, None):
+                father = by_record_id[parent]
+                node.father_id = father.node_id
+                father.append(node)
+        for node, father_id in attachments:
+            node.father_id = father_id
+            if father_id == 0:
+                self.nodes.append(node)
+            else:
+                node_index[father_id].append(node)
+        return added
+
+    @staticmethod
+    def _check_record_cycles(parents):
+        """
+        Check that no tuple record is its own ancestor
+
+        :param parents: The parent of each record id
+        :type parents: Dict[Any, Any]
+
+        :raises ValueError: If records form a cycle
+        """
+        checked = set()
+        for record_id in parents:
+            path = []
+            in_path = set()
+            while record_id in parents and record_id not in (0, None) and record_id not in checked:
+                if record_id in in_path:
+                    cycle = path[path.index(record_id):]
+                    raise ValueError(f"The records {cycle} are their own ancestors")
+                path.append(record_id)
+                in_path.add(record_id)
+                record_id = parents[record_id]
+            checked.update(path)
+
+    @staticmethod
+    def _node_from_record(name, type="rich", text="", syntax=None, icon=0, tags=None, is_ro=0):
+        """
+        Build a node from the fields of a record
+        """
+        if type == "rich":
+            node = CherryTreeNode(name, is_ro=is_ro, tags=tags)
+            if text:
+                node.add_text(text)
+        elif type == "plain":
+            node = CherryTreePlainNode(name, txt=text or "", is_ro=is_ro, tags=tags)
+        elif type == "code":
+            if syntax is None:
+                raise ValueError(f"Code node {name!r} cannot be created without a syntax")
+            node = CherryTreeCodeNode(name, syntax, txt=text or "", is_ro=is_ro, tags=tags)
+        else:
+            raise ValueError(f"Unknown node type {type!r}, choose between: 'rich', 'plain' and 'code'")
+
+        if icon:
+            node.icon = get_icon(icon)
+        return node
+
+    @staticmethod
+    def _get_link(name):
+        """
+        Return the link to a document, a .ctd is an xml
+        document and any other name a sqlite one
+        """
+        if os.path.splitext(name)[1] == ".ctd":
+            return CherryTreeXmlLink(name)
+        return CherryTreeLink(name)
+
     @classmethod
     def load(cls, sqlite_ctb):
         """
-        Load the Document from an existing database
+        Load the Document from an existing database, or
+        from an xml document when its extension is .ctd
 
         :param sqlite_ctb: The existing cherry tree to use
         :type sqlite_ctb: str
@@ -137,7 +309,7 @@ class CherryTree:
             raise FileNotFoundError(f"Cannot find file {sqlite_ctb}")
 
         ctb_document = cls()
-        ctb_document.ctb_sql_link = CherryTreeLink(sqlite_ctb)
+        ctb_document.ctb_sql_link = cls._get_link(sqlite_ctb)
         ctb_document._get_nodes_from_db()
         return ctb_document
 
@@ -147,14 +319,257 @@ class CherryTree:
         """
         self.nodes = self.ctb_sql_link.get_nodes()
 
-    def save(self, name):
+    def save(self, name, report=None, optimize_images=False, workers=None, snapshot=None):
         """
-        Save the nodes to a cherrytree file
+        Save the nodes to a cherrytree file, the document
+        is written as xml when the extension is .ctd
+
+        :param report: A callable receiving the report of the save,
+                       such as print
+        :type report: Callable[[class:`CherryTreeSaveReport`], Any]
 
-        :raise ValueError: If the file to save already exists
+        :param optimize_images: Recompress the png of the document while
+                                saving them, an image is only replaced when
+                                its recompressed png is smaller, the nodes
+                                themselves are left unchanged
+        :type optimize_images: bool
+
+        :param workers: The number of processes used to recompress the png
+        :type workers: int
+
+        :param snapshot: A snapshot store in which to record the document saved
+        :type snapshot: class:`SnapshotStore`
+
+        :raise ValueError: If the file to save already exists, or a
+                           snapshot is asked for a .ctd document
         """
         if os.path.exists(name):
             raise ValueError(f"File {name} already exists, cannot overwrite !")
-        self.ctb_sql_link = CherryTreeLink(name)
+        if snapshot is not None and os.path.splitext(name)[1] == ".ctd":
+            raise ValueError(f"Cannot snapshot {name}, only .ctb documents can be kept in a snapshot store")
+
+        save_report = CherryTreeSaveReport()
+        self.ctb_sql_link = self._get_link(name)
         self.ctb_sql_link.init()
-        self.ctb_sql_link.save(self.nodes)
+        self.ctb_sql_link.save(self.nodes, report=save_report,
+                               optimize_images=optimize_images, workers=workers)
+        if snapshot is not None:
+            snapshot.snapshot(self.ctb_sql_link.name)
+        if isinstance(self.ctb_sql_link, CherryTreeLink) and\
+           os.path.exists(CherryTreeSearchIndex.get_index_path(self.ctb_sql_link.name)):
+            # Keep the search index of a document previously saved with this name up to date
+            index = self.search_index()
+            index.update()
+            index.close()
+        if report is not None:
+            report(save_report)
+
+    @classmethod
+    def convert(cls, source, destination):
+        """
+        Convert a document between the .ctb and .ctd formats, the
+        nodes are read and written one at a time so the whole
+        document is never held in memory
+
+        :param source: The document to convert
+        :type source: str
+
+        :param destination: The document to create, its extension gives its format
+        :type destination: str
+
+        :return: The number of nodes converted
+        :rtype: int
+
+        :raise ValueError: If the destination already exists
+        """
+        if not os.path.exists(source):
+            raise FileNotFoundError(f"Cannot find file {source}")
+        if os.path.exists(destination):
+            raise ValueError(f"File {destination} already exists, cannot overwrite !")
+
+        source_link = cls._get_link(source)
+        if isinstance(source_link, CherryTreeXmlLink):
+            nodes = source_link.iter_nodes()
+        else:
+            nodes = ((source_link.recover_node(node_id), father_id)
+                     for node_id, father_id, _, _ in source_link.iter_tree())
+
+        count = 0
+        destination_link = cls._get_link(destination)
+        if isinstance(destination_link, CherryTreeXmlLink):
+            levels = {0: -1}
+            def iter_levels():
+                nonlocal count
+                for node, father_id in nodes:
+                    levels[node.node_id] = levels[father_id] + 1
+                    count += 1
+                    yield node, levels[node.node_id]
+            destination_link.write_nodes(iter_levels())
+        else:
+            with destination_link:
+                destination_link.init()
+                for node, father_id in nodes:
+                    destination_link.append_node(node, father_id, commit=False)
+                    count += 1
+                destination_link.con.commit()
+        return count
+
+    @staticmethod
+    def compact(source, destination=None):
+        """
+        Rewrite a document with sqlite only: the node ids and sequences
+        are renumbered densely, the rows of deleted nodes are dropped and
+        the file is vacuumed. No row is decoded in python, except the
+        rich texts linking to other nodes whose links are renumbered.
+
+        :param source: The document to compact
+        :type source: str
+
+        :param destination: The document to create, the source
+                            is replaced when not given
+        :type destination: str
+
+        :return: The number of nodes kept
+        :rtype: int
+
+        :raise ValueError: If the destination already exists
+
+        The document being written is removed if the compaction fails
+        """
+        if not os.path.exists(source):
+            raise FileNotFoundError(f"Cannot find file {source}")
+
+        target = destination or f"{os.path.splitext(source)[0]}.compacting.ctb"
+        if os.path.exists(target):
+            raise ValueError(f"File {target} already exists, cannot overwrite !")
+
+        link = CherryTreeLink(target)
+        try:
+            link.init()
+            count = link.copy_document(source)
+            link.con.commit()
+            link.con.execute("VACUUM")
+        except BaseException:
+            link.con.close()
+            os.remove(target)
+            raise
+        link.con.close()
+
+        if destination is None:
+            os.replace(target, source)
+        return count
+
+    @staticmethod
+    def merge_files(target, sources, under=0):
+        """
+        Merge documents into a target document with sqlite only, the
+        nodes of each source are given ids following the ones of the
+        target and its root nodes are added under a node of the target
+
+        :param target: The document receiving the nodes, created if it does not exist
+        :type target: str
+
+        :param sources: The documents to merge, in order
+        :type sources: Iterable[str]
+
+        :param under: The id of the node of the target under which
+                      to add the root nodes of the sources
+        :type under: int
+
+        :return: The number of nodes merged
+        :rtype: int
+
+        The sources are merged in a copy of the target which replaces it
+        once all of them are merged, a failure leaves the target unchanged
+        """
+        sources = list(sources)
+        for source in sources:
+            if not os.path.exists(source):
+                raise FileNotFoundError(f"Cannot find file {source}")
+
+        if not os.path.splitext(target)[1]:
+            target = f"{target}.ctb"
+        merging = f"{os.path.splitext(target)[0]}.merging.ctb"
+        if os.path.exists(merging):
+            os.remove(merging)
+        try:
+            with CherryTreeLink(merging) as link:
+                if os.path.exists(target):
+                    with sqlite3.connect(target) as target_con:
+                        target_con.backup(link.con)
+                    target_con.close()
+                else:
+                    link.init()
+                count = 0
+                for source in sources:
+                    count += link.copy_document(source, under=under)
+        except BaseException:
+            if os.path.exists(merging):
+                os.remove(merging)
+            raise
+        os.replace(merging, target)
+        return count
+
+    def search_index(self):
+        """
+        Return the full text index of the document, the index
+        is kept in a sidecar database next to the document
+
+        :rtype: class:`CherryTreeSearchIndex`
+
+        :raise ValueError: If the document is not saved as .ctb
+        """
+        if not isinstance(self.ctb_sql_link, CherryTreeLink):
+            raise ValueError("The document must be saved or loaded as .ctb to be searched")
+        return CherryTreeSearchIndex(self.ctb_sql_link.name)
+
+    def search(self, query, limit=20):
+        """
+        Search the nodes of the document with a full text query, the
+        index is updated with the nodes changed since it was last used
+
+        :param query: The FTS5 query, such as 'nmap AND NOT udp' or 'name:report'
+        :type query: str
+
+        :param limit: The maximum number of results
+        :type limit: int
+
+        :return: The nodes matching, best ranked first
+        :rtype: List[class:`CherryTreeSearchResult`]
+        """
+        index = self.search_index()
+        try:
+            index.update()
+            return index.search(query, limit=limit)
+        finally:
+            index.close()
+
+    def get_tag_index(self):
+        """
+        Build the index of the nodes by tag, keep it to run many queries
+
+        :rtype: class:`CherryTreeTagIndex`
+        """
+        return CherryTreeTagIndex.from_nodes(self.nodes)
+
+    def find_by_tags(self, all=(), any=(), none=()):
+        """
+        Find the nodes having all the tags of all, at least one
+        tag of any and no tag of none
+
+        To search a document without loading it use
+        :meth:`CherryTreeLink.find_by_tags`
+
+        :param all: Tags that the nodes must all have
+        :type all: Iterable[str]
+
+        :param any: Tags of which the nodes must have at least one
+        :type any: Iterable[str]
+
+        :param none: Tags that the nodes must not have
+        :type none: Iterable[str]
+
+        :return: The ids of the nodes
+        :rtype: List[int]
+        """
+        return self.get_tag_index().find(all=all, any=any, none=none)
@@ -0,0 +1,261 @@
+"""
+Hash the nodes of a document from its rows
+
+Each node gets a hash covering its name, text, flags, tags and
+entities, and each subtree a digest combining the hash of its root
+and the digests of its children (a Merkle tree). Two documents, or
+two versions of a document, can then be compared by only walking
+the subtrees whose digests differ.
+
+Each node also has a signature, a checksum of its rows computed by
+sqlite, which tells whether a node changed without hashing it, such
+as for updating the search index. The document is never written.
+"""
+import hashlib
+import zlib
+
+# Columns of a node covered by its hash, by part of the node
+NODE_PARTS = {
+    "name": ("name",),
+    "text": ("txt", "syntax"),
+    "attributes": ("tags", "is_ro", "is_richtxt"),
+}
+
+# Columns of the entities covered by the hash of their node
+ENTITY_COLUMNS = {
+    "codebox": ("offset", "justification", "txt", "syntax", "width", "height",
+                "is_width_pix", "do_highl_bra", "do_show_linenum"),
+    "grid": ("offset", "justification", "txt", "col_min", "col_max"),
+    "image": ("offset", "justification", "anchor", "filename", "link"),
+}
+
+def _update(digest, value):
+    """
+    Add a value to a digest, each value is prefixed with its type
+    and its length so distinct rows never give the same input
+    """
+    if value is None:
+        digest.update(b"N")
+        return
+    if isinstance(value, int):
+        kind, data = b"I", str(value).encode("ascii")
+    elif isinstance(value, str):
+        kind, data = b"S", value.encode("UTF-8", errors="surrogatepass")
+    else:
+        kind, data = b"B", bytes(value)
+    digest.update(kind + len(data).to_bytes(8, "big") + data)
+
+def _checksum(*values):
+    """
+    Checksum of the values of a row, registered as an sql function
+    """
+    checksum = 0
+    for value in values:
+        if value is None:
+            data = b"N"
+        elif isinstance(value, (int, float)):
+            data = b"I" + str(value).encode("ascii")
+        elif isinstance(value, str):
+            data = b"S" + value.encode("UTF-8", errors="surrogatepass")
+        else:
+            data = b"B" + bytes(value)
+        checksum = zlib.crc32(len(data).to_bytes(8, "big") + data, checksum)
+    return checksum
+
+class CherryTreeHasher:
+    """
+    Compute the hash of the nodes and the digest of the subtrees of a document
+
+    :param link: The link to the document
+    :type link: class:`CherryTreeLink`
+    """
+    def __init__(self, link):
+        self.link = link
+        self._node_hashes = None
+        self._tree_hashes = None
+        self.children = None
+        self.fathers = None
+
+    def get_signatures(self):
+        """
+        Return a signature of each node computed by sqlite, a checksum
+        of every column covered by the hash of the node and its entities
+
+        :rtype: Dict[int, str]
+        """
+        return dict(self.iter_signatures())
+
+    def iter_signatures(self):
+        """
+        Yield the id and the signature of each node, one node at a time
+
+        :rtype: Iterator[Tuple[int, str]]
+        """
+        self.link.con.create_function("ctb_writer_checksum", -1, _checksum, deterministic=True)
+        columns = ", ".join(f"node.{column}" for part in NODE_PARTS.values() for column in part)
+        entities = []
+        for table, table_columns in ENTITY_COLUMNS.items():
+            checksum = ", ".join(table_columns + (("png",) if table == "image" else ()))
+            entities.append(f"""LEFT JOIN (SELECT node_id, COUNT(*) || '/' ||
+                                                  SUM(ctb_writer_checksum({checksum})) AS signature
+                                           FROM {table} GROUP BY node_id) AS {table}_signature
+                                ON {table}_signature.node_id=node.node_id""")
+        rows = self.link.con.execute(f"""SELECT node.node_id,
+                                                ctb_writer_checksum({columns}) || ':' ||
+                                                IFNULL(codebox_signature.signature, '') || ':' ||
+                                                IFNULL(grid_signature.signature, '') || ':' ||
+                                                IFNULL(image_signature.signature, '')
+                                         FROM node {" ".join(entities)}""")
+        yield from rows
+
+    def hash_rows(self, node_id):
+        """
+        Hash each part of a node and each of its entities
+
+        :return: The hash of the parts of the node (name, text and attributes),
+                 and for each entity table the offset and hash of its rows
+        :rtype: Dict[str, Union[str, List[Tuple[int, str]]]]
+        """
+        hashes = {}
+        columns = [column for part in NODE_PARTS.values() for column in part]
+        for row in self.link.get_rows("node", node_id, ", ".join(columns)):
+            for part, part_columns in NODE_PARTS.items():
+                hashes[part] = self._hash_values(row, part_columns)
+
+        for table, columns in ENTITY_COLUMNS.items():
+            hashes[table] = []
+            for row in self.link.get_rows(table, node_id, ", ".join(columns)):
+                extra = self.hash_png(row["rowid"]) if table == "image" else None
+                hashes[table].append((row["offset"], self._hash_values(row, columns, extra)))
+        return hashes
+
+    @staticmethod
+    def _hash_values(row, columns, extra=None):
+        digest = hashlib.sha256()
+        for column in columns:
+            value = row[column]
+            if column == "txt" and isinstance(value, bytes):
+                # Texts streamed on save are stored as blobs
+                value = value.decode("UTF-8", errors="surrogateescape")
+            _update(digest, value)
+        if extra is not None:
+            _update(digest, extra)
+        return digest.hexdigest()
+
+    def hash_node(self, node_id):
+        """
+        Compute the hash of a node from its rows
+
+        :rtype: str
+        """
+        digest = hashlib.sha256()
+        for part, hashes in self.hash_rows(node_id).items():
+            _update(digest, part)
+            for row_hash in ([hashes] if isinstance(hashes, str) else [row[1] for row in hashes]):
+                _update(digest, row_hash)
+        return digest.hexdigest()
+
+    def hash_png(self, rowid):
+        """
+        Hash the png of an image, read by chunks when possible
+        """
+        digest = hashlib.sha256()
+        for chunk in self.link.iter_blob("image", "png", rowid):
+            digest.update(chunk)
+        return digest.digest()
+
+    def iter_node_hashes(self):
+        """
+        Yield the id and the hash of every node, one node at a time
+
+        :rtype: Iterator[Tuple[int, str]]
+        """
+        for (node_id,) in self.link.con.execute("SELECT node_id FROM node"):
+            yield node_id, self.hash_node(node_id)
+
+    def get_node_hashes(self):
+        """
+        Return the hash of every node
+
+        :rtype: Dict[int, str]
+        """
+        if self._node_hashes is None:
+            self._node_hashes = dict(self.iter_node_hashes())
+        return self._node_hashes
+
+    @staticmethod
+    def hash_tree(node_hash, children_digests):
+        """
+        Return the digest of a subtree from the hash of its root and
+        the digests of the subtrees of its children, in order
+
+        :rtype: str
+        """
+        digest = hashlib.sha256(b"T")
+        _update(digest, node_hash or "")
+        for child_digest in children_digests:
+            _update(digest, child_digest)
+        return digest.hexdigest()
+
+    def get_tree_hashes(self):
+        """
+        Return the digest of the subtree of every node, the digest of
+        the whole document is given for the node 0
+
+        :rtype: Dict[int, str]
+        """
+        if self._tree_hashes is not None:
+            return self._tree_hashes
+
+        node_hashes = self.get_node_hashes()
+        self.children = {0: []}
+        self.fathers = {}
+        for node_id, father_id, _, _ in self.link.iter_tree():
+            self.children.setdefault(father_id, []).append(node_id)
+            self.fathers[node_id] = father_id
+
+        tree_hashes = {}
+        # Children are always hashed before their father
+        for node_id in reversed([0] + list(self._iter_ids())):
+            tree_hashes[node_id] = self.hash_tree(node_hashes.get(node_id),
+                                                  [tree_hashes[child_id] for child_id in self.children.get(node_id, [])])
+        self._tree_hashes = tree_hashes
+        return tree_hashes
+
+    def _iter_ids(self):
+        """
+        Iter through the ids of the nodes in depth first order
+        """
+        stack = list(reversed(self.children[0]))
+        while stack:
+            node_id = stack.pop()
+            yield node_id
+            stack.extend(reversed(self.children.get(node_id, [])))
+
+def iter_changed_nodes(first, second):
+    """
+    Compare two documents and yield the ids of the nodes added,
+    removed or whose content changed, the subtrees having the same
+    digest in both documents are skipped
+
+    :param first: The hasher of the first document
+    :type first: class:`CherryTreeHasher`
+
+    :param second: The hasher of the second document
+    :type second: class:`CherryTreeHasher`
+
+    :rtype: Iterator[int]
+    """
+    first_trees, second_trees = first.get_tree_hashes(), second.get_tree_hashes()
+    first_nodes, second_nodes = first.get_node_hashes(), second.get_node_hashes()
+    stack = [0]
+    while stack:
+        node_id = stack.pop()
+        if first_trees.get(node_id) == second_trees.get(node_id):
+            continue
+        if node_id and first_nodes.get(node_id) != second_nodes.get(node_id):
+            yield node_id
+        children = first.children.get(node_id, [])
+        known = set(children)
+        children = children + [child for child in second.children.get(node_id, []) if child not in known]
+        stack.extend(reversed(children))
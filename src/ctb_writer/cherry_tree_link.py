@@ -1,12 +1,21 @@
 """
 Link cherry tree instance to the database
 """
+import re
 import sqlite3
 import os
 from time import time
 from .cherry_tree_rows import _NodeRow, _ImageRow, _CodeboxRow, _TableRow
+from .cherry_tree_report import CherryTreeSaveReport
+from .cherry_tree_tags import get_tags_condition
+from .cherry_tree_query import CherryTreeQuery
 from .cherry_tree_node import CherryTreeNode, CherryTreeCodeNode, CherryTreePlainNode
 from ctb_writer.assets import *
+from ctb_writer.assets.image_source import DatabaseImageSource
+from ctb_writer.assets.png import iter_recompressed
+
+# Links of a rich text to another node: link="node ID [ANCHOR]"
+NODE_LINK_RE = re.compile(r'(link="node )(\d+)')
 
 class CherryTreeLink:
     """
@@ -20,6 +29,7 @@ class CherryTreeLink:
         self.name = name
         self.con = sqlite3.connect(self.name)
         self.cursor = self.con.cursor()
+        self._attached = {}
 
     @property
     def name(self):
@@ -44,6 +54,82 @@ class CherryTreeLink:
         else:
             self._name = val
 
+    # Tables holding the entities of the nodes
+    entity_tables = ("codebox", "grid", "image")
+
+    # Documents attached at most to copy images, sqlite allows 10 attached
+    # databases and one is kept for the document copied by copy_document
+    max_image_sources = 8
+
+    def iter_tree(self, root_id=0):
+        """
+        Iter through the tree in depth first order, without loading the nodes
+
+        :param root_id: The node under which to iter, 0 iters through the whole document
+        :type root_id: int
+
+        :return: The node_id, father_id, sequence and level of each node
+        :rtype: Iterator[Tuple[int, int, int, int]]
+        """
+        rows = self.con.execute("""WITH RECURSIVE tree(node_id, father_id, sequence, level, path) AS (
+                                       SELECT node_id, father_id, sequence, 0, printf('%010d', sequence)
+                                       FROM children WHERE father_id=?
+                                       UNION ALL
+                                       SELECT children.node_id, children.father_id, children.sequence,
+                                              tree.level + 1,
+                                              tree.path || printf('/%010d', children.sequence)
+                                       FROM children JOIN tree ON children.father_id=tree.node_id
+                                   )
+                                   SELECT node_id, father_id, sequence, level
+                                   FROM tree ORDER BY path""", (root_id,))
+        yield from rows
+
+    def get_rows(self, table, node_id, columns="*"):
+        """
+        Return the columns of the rows of a table for a node, the
+        rowid is always included
+
+        :param table: The table, either node or one of the entity tables
+        :type table: str
+
+        :param columns: The columns to select
+        :type columns: str
+
+        :rtype: List[class:`sqlite3.Row`]
+        """
+        if table != "node" and table not in self.entity_tables:
+            raise ValueError(f"Unknown table {table!r}")
+
+        order = "" if table == "node" else "ORDER BY offset ASC"
+        cursor = self.con.cursor()
+        cursor.row_factory = sqlite3.Row
+        return cursor.execute(f"SELECT rowid, {columns} FROM {table} WHERE node_id=? {order}",
+                              (node_id,)).fetchall()
+
+    def query(self):
+        """
+        Return a query over the nodes of the document, compiled to sql
+
+        :rtype: class:`CherryTreeQuery`
+        """
+        return CherryTreeQuery(self)
+
+    def find_by_tags(self, all=(), any=(), none=(), nodes=False):
+        """
+        Find the nodes having all the tags of all, at least one tag of
+        any and no tag of none, without loading the document
+
+        :param nodes: Yield the nodes, recovered one at a time, instead of their ids
+        :type nodes: bool
+
+        :rtype: Iterator[Union[int, class:`_CherryTreeNodeBase`]]
+        """
+        condition, params = get_tags_condition(all, any, none)
+        node_ids = [row[0] for row in self.con.execute(
+                        f"SELECT node_id FROM node WHERE {condition} ORDER BY node_id", params)]
+        for node_id in node_ids:
+            yield self.recover_node(node_id) if nodes else node_id
+
     def get_nodes(self):
         """
         Recover nodes from the database
@@ -126,6 +212,8 @@ class CherryTreeLink:
                 node.node_id = row[_NodeRow.NODE_ID]
 
             node.set_text(row[_NodeRow.TXT])
+            if tags:
+                node.tags = tags
 
             _ColumnConvert.from_ro(node, row[_NodeRow.IS_RO])
             _ColumnConvert.from_richtext(node, row[_NodeRow.IS_RICHTEXT])
@@ -154,13 +242,17 @@ class CherryTreeLink:
 
     def _recover_image(self, node):
         """
-        Recover image for a given node
+        Recover image for a given node, the png is not read
+        and is only accessed from the database when needed
         """
-        rows = self.cursor.execute("""SELECT node_id, offset, justification, anchor, png
+        rows = self.cursor.execute("""SELECT node_id, offset, justification, anchor,
+                                             length(png), rowid
                                       FROM image WHERE node_id=?""", (node.node_id, ))
         for row in rows.fetchall():
+            source = DatabaseImageSource(self.con, self.name,
+                                         row[_ImageRow.ROWID], row[_ImageRow.SIZE])
             image = CherryTreeImage(position=row[_ImageRow.OFFSET],
-                                    data=row[_ImageRow.PNG],
+                                    data=source,
                                     justification=row[_ImageRow.JUSTIFICATION])
             node.images.append(image)
 
@@ -179,56 +271,462 @@ class CherryTreeLink:
                                                     col_max=row[_TableRow.COL_MAX])
             node.tables.append(table_to_add)
 
-    def save(self, nodes):
+    def save(self, nodes, report=None, commit=True, optimize_images=False, workers=None):
         """
         Save a node to the database
 
         :param node: The node to save
         :type node: class:`CherryTreeNode`
+
+        :param report: The report to fill, a new one is created by default
+        :type report: class:`CherryTreeSaveReport`
+
+        :param commit: Commit the transaction, the transaction is always
+                       committed when images are copied from other documents
+        :type commit: bool
+
+        :param optimize_images: Recompress the png written, the nodes are not changed
+        :type optimize_images: bool
+
+        :param workers: The number of processes used to recompress the png
+        :type workers: int
+
+        :return: The report of the save
+        :rtype: class:`CherryTreeSaveReport`
         """
+        self.report = CherryTreeSaveReport() if report is None else report
+        self._saved_images = {}
+        # Rows of the images written, only kept when they are recompressed
+        self._image_rows = {} if optimize_images else None
+        self._attach_image_sources(nodes)
         self._save_children_recurse(nodes)
         self._save_node_recurse(nodes)
+        if self._image_rows:
+            self._recompress_images(workers)
+        self._image_rows = None
+        self._detach_all(commit)
+        self._saved_images = {}
+        return self.report
+
+    def get_next_sequence(self, father_id):
+        """
+        Return the sequence of a node appended under a father
+        """
+        row = self.cursor.execute("SELECT MAX(sequence) FROM children WHERE father_id=?",
+                                  (father_id,)).fetchone()
+        return (row[0] or 0) + 1
+
+    def get_next_id(self):
+        """
+        Return the id of a node added to the document
+        """
+        return (self.cursor.execute("SELECT MAX(node_id) FROM node").fetchone()[0] or 0) + 1
+
+    def append_node(self, node, father_id, commit=True):
+        """
+        Save a node and its children at the end of the children of a
+        node already in the database, the ids of the node and its
+        children must not be used in the document
+
+        :param node: The node to save
+        :type node: class:`CherryTreeNode`
+
+        :param father_id: The id of the father, 0 for a root node
+        :type father_id: int
+
+        :param commit: Commit the transaction, False to append many nodes at once
+        :type commit: bool
+        """
+        node.father_id = father_id
+        sequence = self.get_next_sequence(father_id)
+        self.save([node], report=getattr(self, "report", None), commit=commit)
+        self.cursor.execute("UPDATE children SET sequence=? WHERE node_id=?",
+                            (sequence, node.node_id))
+        if commit:
+            self.con.commit()
+
+    def replace_node(self, node):
+        """
+        Replace the content of a node already saved, the node keeps its
+        place in the tree and its children are not changed
+
+        :param node: The new content of the node, with the id of the node to replace
+        :type node: class:`CherryTreeNode`
+        """
+        for table in ("node",) + self.entity_tables:
+            self.cursor.execute(f"DELETE FROM {table} WHERE node_id=?", (node.node_id,))
+        self.report = getattr(self, "report", None) or CherryTreeSaveReport()
+        self._saved_images = {}
+        self._save_node_recurse([node])
+        self._saved_images = {}
+
+    def delete_node(self, node_id, commit=True):
+        """
+        Delete a node and all its children from the database
+
+        :param commit: Commit the transaction, False to delete many nodes at once
+        :type commit: bool
+
+        :return: The ids of the nodes deleted
+        :rtype: List[int]
+        """
+        node_ids = [node_id] + [row[0] for row in self.iter_tree(node_id)]
+        for table in ("node", "children", "bookmark") + self.entity_tables:
+            self.cursor.executemany(f"DELETE FROM {table} WHERE node_id=?",
+                                    [(deleted_id,) for deleted_id in node_ids])
+        if commit:
+            self.con.commit()
+        return node_ids
+
+    # Columns copied from a document to another, node_id being remapped
+    copied_columns = {
+        "node": ("name", "txt", "syntax", "tags", "is_ro", "is_richtxt", "has_codebox",
+                 "has_table", "has_image", "level", "ts_creation", "ts_lastsave"),
+        "codebox": ("offset", "justification", "txt", "syntax", "width", "height",
+                    "is_width_pix", "do_highl_bra", "do_show_linenum"),
+        "grid": ("offset", "justification", "txt", "col_min", "col_max"),
+        "image": ("offset", "justification", "anchor", "png", "filename", "link", "time"),
+    }
+
+    def copy_document(self, source, under=0):
+        """
+        Copy the nodes of another document after the children of a node
+        of this one, the rows are copied by sqlite without being read in python
+
+        The nodes copied get new ids following the ids already used, in
+        depth first order, and the sequences of their children are made
+        dense. Rows not reachable from the root nodes, such as the
+        entities of deleted nodes, are not copied.
+
+        :param source: The document to copy
+        :type source: str
+
+        :param under: The id of the node under which to add the root
+                      nodes of the source, 0 adds them as root nodes
+        :type under: int
+
+        :return: The number of nodes copied
+        :rtype: int
+
+        :raise ValueError: If the node under which to copy does not exist
+        """
+        if under and not self.get_rows("node", under, "node_id"):
+            raise ValueError(f"Node {under} not found in database")
+
+        alias = self._attach(source)
+        offset = self.get_next_id() - 1
+        last_sequence = self.get_next_sequence(under) - 1
+        self.cursor.execute("DROP TABLE IF EXISTS temp.id_map")
+        self.cursor.execute("CREATE TEMP TABLE id_map (old_id INTEGER PRIMARY KEY, new_id INTEGER)")
+        self.cursor.execute(f"""WITH RECURSIVE tree(node_id, path) AS (
+                                    SELECT children.node_id, printf('%010d', children.sequence)
+                                    FROM {alias}.children AS children
+                                    JOIN {alias}.node AS node ON node.node_id=children.node_id
+                                    WHERE children.father_id=0
+                                    UNION ALL
+                                    SELECT children.node_id, tree.path || printf('/%010d', children.sequence)
+                                    FROM {alias}.children AS children
+                                    JOIN tree ON children.father_id=tree.node_id
+                                    JOIN {alias}.node AS node ON node.node_id=children.node_id
+                                )
+                                INSERT INTO temp.id_map
+                                SELECT node_id, ? + ROW_NUMBER() OVER (ORDER BY path, node_id) FROM tree
+                                """, (offset,))
+
+        for table, columns in self.copied_columns.items():
+            order = "id_map.new_id" if table == "node" else "id_map.new_id, copied.offset"
+            self.cursor.execute(f"""INSERT INTO {table} (node_id, {", ".join(columns)})
+                                    SELECT id_map.new_id, {", ".join("copied." + column for column in columns)}
+                                    FROM {alias}.{table} AS copied
+                                    JOIN temp.id_map AS id_map ON copied.node_id=id_map.old_id
+                                    ORDER BY {order}""")
+
+        self.cursor.execute(f"""INSERT INTO children (node_id, father_id, sequence, master_id)
+                                SELECT id_map.new_id, COALESCE(father.new_id, ?),
+                                       CASE WHEN children.father_id=0 THEN ? ELSE 0 END +
+                                       ROW_NUMBER() OVER (PARTITION BY children.father_id
+                                                          ORDER BY children.sequence, children.node_id),
+                                       COALESCE(master.new_id, 0)
+                                FROM {alias}.children AS children
+                                JOIN temp.id_map AS id_map ON children.node_id=id_map.old_id
+                                LEFT JOIN temp.id_map AS father ON children.father_id=father.old_id
+                                LEFT JOIN temp.id_map AS master ON children.master_id=master.old_id
+                                """, (under, last_sequence))
+
+        last_bookmark = self.cursor.execute("SELECT COALESCE(MAX(sequence), 0) FROM bookmark").fetchone()[0]
+        self.cursor.execute(f"""INSERT INTO bookmark (node_id, sequence)
+                                SELECT id_map.new_id, ? + ROW_NUMBER() OVER (ORDER BY bookmark.sequence)
+                                FROM {alias}.bookmark AS bookmark
+                                JOIN temp.id_map AS id_map ON bookmark.node_id=id_map.old_id
+                                """, (last_bookmark,))
+
+        self._remap_node_links(offset)
+        count = self.cursor.execute("SELECT COUNT(*) FROM temp.id_map").fetchone()[0]
+        self.cursor.execute("DROP TABLE temp.id_map")
+        self._detach_all()
+        return count
+
+    def _remap_node_links(self, offset):
+        """
+        Update the links to other nodes in the rich texts copied, only
+        the texts containing such links are read
+        """
+        rows = self.cursor.execute("""SELECT rowid, txt FROM node
+                                      WHERE node_id > ? AND txt LIKE '%link="node %'""", (offset,)).fetchall()
+        if not rows:
+            return
+
+        id_map = dict(self.cursor.execute("SELECT old_id, new_id FROM temp.id_map"))
+        def remap(match):
+            new_id = id_map.get(int(match.group(2)))
+            return match.group(0) if new_id is None else f"{match.group(1)}{new_id}"
+
+        for rowid, txt in rows:
+            self.cursor.execute("UPDATE node SET txt=? WHERE rowid=?",
+                                (NODE_LINK_RE.sub(remap, txt), rowid))
+
+    def _attach_image_sources(self, nodes):
+        """
+        Attach the documents from which images were loaded,
+        so they are copied without being read in python
+
+        Only the first max_image_sources documents are attached, the
+        images of the other ones are streamed through their blobs
+        """
+        for root_node in nodes:
+            for node in root_node:
+                for image in getattr(node, "images", []):
+                    if isinstance(image.source, DatabaseImageSource) and\
+                       (len(self._attached) < self.max_image_sources or
+                        os.path.abspath(image.source.database) in self._attached):
+                        self._attach(image.source.database)
+
+    def _attach(self, database):
+        """
+        Attach a database and return its alias
+        """
+        database = os.path.abspath(database)
+        if database not in self._attached:
+            alias = f"source_{len(self._attached)}"
+            self.con.commit()
+            self.cursor.execute("ATTACH DATABASE ? AS " + alias, (database,))
+            self._attached[database] = alias
+        return self._attached[database]
+
+    def _detach_all(self, commit=True):
+        """
+        Detach all the databases attached
+        """
+        if commit or self._attached:
+            # Databases cannot be detached during a transaction
+            self.con.commit()
+        for alias in self._attached.values():
+            self.cursor.execute(f"DETACH DATABASE {alias}")
+        self._attached = {}
 
     def _save_images(self, node):
         """
-        Save images of a node
+        Save images of a node, the data is streamed by chunks
+        when the image is a reference to a file
+
+        An image whose content was already saved is copied from
+        its first row, without its data going through python
         """
         for image in node.images:
-            self.cursor.execute(
-                            """INSERT INTO image
-                            (node_id, offset, justification, png)
-                            VALUES (?, ?, ?, ?)
-                            """,
-                            (node.node_id, image.position, image.justification, image.data)
-                            )
+            key = image.source.get_key()
+            saved_rowid = self._saved_images.get(key)
+            if saved_rowid is not None:
+                self._copy_image(node, image, "main", saved_rowid)
+                self._add_image_row(saved_rowid, node, image)
+                self.report.add_image(image.size, duplicated=True)
+                continue
+
+            if isinstance(image.source, DatabaseImageSource) and\
+               os.path.abspath(image.source.database) in self._attached:
+                alias = self._attached[os.path.abspath(image.source.database)]
+                self._copy_image(node, image, alias, image.source.rowid)
+
+            else:
+                is_streamed = hasattr(self.con, "blobopen")
+                self.cursor.execute(
+                                """INSERT INTO image
+                                (node_id, offset, justification, png)
+                                VALUES (?, ?, ?, ?)
+                                """,
+                                (node.node_id, image.position, image.justification,
+                                 None if is_streamed else image.data)
+                                )
+                if is_streamed:
+                    self.stream_blob("image", "png", self.cursor.lastrowid,
+                                      image.size, image.iter_data())
+
+            self._saved_images[key] = self.cursor.lastrowid
+            self._add_image_row(self.cursor.lastrowid, node, image)
+            self.report.add_image(image.size)
+
+    def _add_image_row(self, saved_rowid, node, image):
+        """
+        Keep the row of an image written, with the first row having the same png
+        """
+        if getattr(self, "_image_rows", None) is not None:
+            self._image_rows.setdefault(saved_rowid, []).append((self.cursor.lastrowid, node.node_id,
+                                                                 image.position))
+
+    def _recompress_images(self, workers):
+        """
+        Recompress the png written by the save, in a pool of processes.
+        Images having the same png are recompressed once, and only the
+        rows whose png is made smaller are rewritten
+        """
+        groups = list(self._image_rows.values())
+        pngs = (b"".join(self.iter_blob("image", "png", group[0][0])) for group in groups)
+        for group, recompressed in zip(groups, iter_recompressed(pngs, workers=workers)):
+            if recompressed is None:
+                continue
+            before = self.cursor.execute("SELECT length(png) FROM image WHERE rowid=?",
+                                         (group[0][0],)).fetchone()[0]
+            for rowid, node_id, position in group:
+                self.stream_blob("image", "png", rowid, len(recompressed), [recompressed])
+                self.report.recompressed.append((node_id, position, before, len(recompressed)))
+
+    def _copy_image(self, node, image, database, rowid):
+        """
+        Insert an image by copying the row of an image already in a database
+
+        :param database: The alias of the database containing the image to copy
+        :type database: str
+
+        :param rowid: The rowid of the image to copy
+        :type rowid: int
+        """
+        self.cursor.execute(
+                f"""INSERT INTO image
+                (node_id, offset, justification, anchor, png, filename, link, time)
+                SELECT ?, ?, ?, anchor, png, filename, link, time
+                FROM {database}.image WHERE rowid=?
+                """,
+                (node.node_id, image.position, image.justification, rowid)
+                )
 
     def _save_codebox(self, node):
         """
         Save codebox of a node
         """
         for codebox in node.codebox:
+            is_file = isinstance(codebox.txt, CherryTreeTextFile)
             self.cursor.execute(
                             """INSERT INTO codebox
                             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                             """,
                             (node.node_id, codebox.position, codebox.justification,
-                             codebox.txt, codebox.syntax, codebox.width,
+                             "" if is_file else codebox.txt, codebox.syntax, codebox.width,
                              codebox.height, codebox.is_width_pix, codebox.highlight_brackets,
                              codebox.show_line_numbers)
                             )
+            if is_file:
+                self._stream_text("codebox", "txt", self.cursor.lastrowid, [codebox.txt])
+
+    def _stream_text(self, table, column, rowid, parts):
+        """
+        Write the text parts in a column of a row, parts which are
+        files are copied by chunks so they never stay in memory
+
+        :param parts: The parts of the text
+        :type parts: List[Union[str, class:`CherryTreeTextFile`]]
+        """
+        if not hasattr(self.con, "blobopen"):
+            # Incremental I/O is only available from python 3.11
+            text = "".join(part if isinstance(part, str) else part.read() for part in parts)
+            self.cursor.execute(f"UPDATE {table} SET {column}=? WHERE rowid=?", (text, rowid))
+            return
+
+        size = 0
+        for part in parts:
+            size += len(part.encode("UTF-8")) if isinstance(part, str) else part.get_size()
+
+        self.cursor.execute(f"UPDATE {table} SET {column}=CAST(zeroblob(?) AS TEXT) WHERE rowid=?",
+                            (size, rowid))
+        with self.con.blobopen(table, column, rowid) as blob:
+            for part in parts:
+                if isinstance(part, str):
+                    blob.write(part.encode("UTF-8"))
+                else:
+                    for chunk in part.iter_bytes():
+                        blob.write(chunk)
 
     def _save_table(self, node):
         """
         Save table of a node
         """
         for table in node.tables:
+            is_streamed = table.is_streamed and hasattr(self.con, "blobopen")
             self.cursor.execute(
                             """INSERT INTO grid
                             VALUES (?, ?, ?, ?, ?, ?)
                             """,
                             (node.node_id, table.position, table.justification,
-                             table.get_table(), table.col_min, table.col_max)
+                             None if is_streamed else table.get_table(),
+                             table.col_min, table.col_max)
                             )
+            if is_streamed:
+                self.stream_blob("grid", "txt", self.cursor.lastrowid,
+                                  table.get_table_size(), table.iter_table())
+
+    def stream_blob(self, table, column, rowid, size, chunks):
+        """
+        Write the chunks of bytes in a column of a row as a blob, the
+        chunks are joined when incremental I/O is not available
+
+        :param size: The total size of the chunks
+        :type size: int
+
+        :param chunks: The content of the blob
+        :type chunks: Iterable[bytes]
+        """
+        if not hasattr(self.con, "blobopen"):
+            # Incremental I/O is only available from python 3.11
+            self.cursor.execute(f"UPDATE {table} SET {column}=? WHERE rowid=?", (b"".join(chunks), rowid))
+            return
+
+        self.cursor.execute(f"UPDATE {table} SET {column}=zeroblob(?) WHERE rowid=?",
+                            (size, rowid))
+        with self.con.blobopen(table, column, rowid) as blob:
+            for chunk in chunks:
+                blob.write(chunk)
+
+    def iter_blob(self, table, column, rowid, chunk_size=1 << 20):
+        """
+        Iter through a column of a row by chunks of bytes, the value is
+        read at once when incremental I/O is not available
+
+        :rtype: Iterator[bytes]
+        """
+        if hasattr(self.con, "blobopen"):
+            try:
+                blob = self.con.blobopen(table, column, rowid, readonly=True)
+            except sqlite3.OperationalError:
+                # The value is NULL
+                return
+            with blob:
+                while chunk := blob.read(chunk_size):
+                    yield chunk
+            return
+
+        row = self.con.execute(f"SELECT {column} FROM {table} WHERE rowid=?", (rowid,)).fetchone()
+        if row and row[0]:
+            yield row[0].encode("UTF-8") if isinstance(row[0], str) else bytes(row[0])
+
+    def close(self):
+        """
+        Close the connection to the document
+        """
+        self.con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     def _save_node_recurse(self, nodes):
         """
@@ -259,7 +757,7 @@ class CherryTreeLink:
                             """,
                             (node.node_id,
                              node.name,
-                             node.get_text(),
+                             "" if node.is_file_backed else node.get_text(),
                              node.syntax,
                              node.get_tags(),
                              _ColumnConvert.to_ro(node),
@@ -271,6 +769,9 @@ class CherryTreeLink:
                              int(time())-2,
                              int(time()))
                             )
+            if node.is_file_backed:
+                self._stream_text("node", "txt", self.cursor.lastrowid, node.parts)
+
             if node.has_image:
                 self._save_images(node)
 
@@ -280,8 +781,6 @@ class CherryTreeLink:
             if node.has_table:
                 self._save_table(node)
 
-            self.con.commit()
-
     def _save_children_recurse(self, nodes):
         """
         Save the children of nodes recursively
@@ -297,7 +796,6 @@ class CherryTreeLink:
                         """,
                         (node.node_id, node.father_id, seq + 1, 0)
                         )
-            self.con.commit()
             if not node.is_last_node:
                 self._save_children_recurse(node.children)
 
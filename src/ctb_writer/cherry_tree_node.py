@@ -2,9 +2,9 @@
 Class representing a cherry tree node
 """
 from copy import copy
-from os.path import expanduser
 from dataclasses import dataclass
-from .beautify import CherryTreeRichtext, color
+from .beautify import CherryTreeRichtext, color, resolve_style, OBJECT_REPLACEMENT
+from .beautify.plain_text import insert_placeholders
 from .assets import *
 import xml.etree.ElementTree as ET
 
@@ -70,6 +70,11 @@ class _CherryTreeNodeBase:
         """
         return self.title_style
 
+    @property
+    def is_file_backed(self):
+        """Check if the text of the node must be read from files on save"""
+        return False
+
     @property
     def is_root_node(self):
         """Check if a node is the root node"""
@@ -139,9 +144,20 @@ class CherryTreeNode(_CherryTreeNodeBase):
             [("bold|underline", "test")]            
         """
         for style, text in texts:
-            richtext = CherryTreeRichtext.from_style(text, style).get_xml()
+            richtext = ET.Element("rich_text", **resolve_style(style))
+            richtext.text = text
             self.xml.append(richtext)
 
+    def add_rich_elements(self, elements):
+        """
+        Add rich_text elements already built, such as the
+        ones rendered by a :class:`MarkupTemplate`
+
+        :param elements: The elements to add
+        :type elements: List[class:`ET.Element`]
+        """
+        self.xml.extend(elements)
+
     def replace(self, replace, replacement, style={}):
         """
         Replace a text, and can also change its style
@@ -171,26 +187,24 @@ class CherryTreeNode(_CherryTreeNodeBase):
 
     def add_image(self, image_name, position=-1, justification="left"):
         """
-        Add an image to the text
+        Add an image to the text, the image is only read when
+        the document is saved
 
-        :param image_name: The name of the image to add
-        :type image_name: str
+        :param image_name: The path of the image to add, an open binary file or the data
+        :type image_name: Union[str, BinaryIO, bytes, memoryview]
 
         :param position: The position of the images in the text
         :type position: int (default: -1)
         """
-        image = None
-        with open(expanduser(image_name), "rb") as file_image:
-            image = file_image.read()
-
-        if not image:
+        image = CherryTreeImage(image_name, position=position, justification=justification)
+        if not image.size:
             return
 
         if position < 0:
             # In this case, append the image at the end of the text
-            position = self._get_text_length()
+            image.position = self._get_text_length()
 
-        self.images.append(CherryTreeImage(image, position=position, justification=justification))
+        self.images.append(image)
 
     def add_codebox(self, text, syntax, position=-1, **kwargs):
         """
@@ -212,8 +226,10 @@ class CherryTreeNode(_CherryTreeNodeBase):
         """
         Add a table to the node
 
-        :param content: The table content
-        :type content: List[List]
+        :param content: The table content, any iterable of rows such as a
+                        generator or a csv reader is serialised without being
+                        kept in memory
+        :type content: Iterable[Iterable]
         """
         if position < 0:
             # In this case, append the table at the end of the text
@@ -268,6 +284,18 @@ class CherryTreeNode(_CherryTreeNodeBase):
         """
         self.xml = ET.fromstring(text)
 
+    def plain_text(self, placeholder=OBJECT_REPLACEMENT):
+        """
+        Return the text of the node without its style, each codebox,
+        table or image standing as a placeholder at its position
+
+        :param placeholder: The text standing for an entity
+        :type placeholder: str
+        """
+        texts = (element.text or "" for element in self.xml)
+        return "".join(insert_placeholders(texts, [entity.position for entity in self.entities],
+                                           placeholder))
+
 class _CherryTreeTextNode(_CherryTreeNodeBase):
     """
     Class representing a node that contains only text
@@ -281,17 +309,59 @@ class _CherryTreeTextNode(_CherryTreeNodeBase):
         super().__init__(name, father_id, icon, is_ro, children, tags)
         self.txt = txt
 
+    @property
+    def txt(self):
+        """
+        The text of the node, files added are read
+        """
+        return "".join(part if isinstance(part, str) else part.read()
+                       for part in self.parts)
+
+    @txt.setter
+    def txt(self, text):
+        """
+        The parts of the node are either str or :class:`CherryTreeTextFile`
+        """
+        self.parts = [text]
+
+    @property
+    def is_file_backed(self):
+        """Check if the text of the node must be read from files on save"""
+        return any(isinstance(part, CherryTreeTextFile) for part in self.parts)
+
     def get_text(self):
         """
         Get the text content
         """
         return self.txt
 
+    def plain_text(self, placeholder=None):
+        """
+        Return the text of the node, which has no style nor entities
+        """
+        return self.txt
+
     def add_text(self, txt):
         """
         Add text to the node
         """
-        self.txt += txt
+        if isinstance(self.parts[-1], str):
+            self.parts[-1] += txt
+        else:
+            self.parts.append(txt)
+
+    def add_text_file(self, filename, encoding="utf-8"):
+        """
+        Add the content of a file to the node, only the path is
+        kept and the file is read when the document is saved
+
+        :param filename: The path of the file to add
+        :type filename: str
+
+        :param encoding: The encoding of the file
+        :type encoding: str
+        """
+        self.parts.append(CherryTreeTextFile.from_path(filename, encoding))
 
     def set_text(self, text):
         """
@@ -0,0 +1,217 @@
+"""
+Query the nodes of a document with sql, without loading it
+
+    >>> link = CherryTreeLink("notes.ctb")
+    >>> link.query().filter(type="code", syntax="python", size__gt=10240).ids()
+    >>> link.query().filter(has_image=True, has_table=False).order_by("-ts_lastsave").rows()
+"""
+from copy import copy
+from dataclasses import dataclass
+from .cherry_tree_tags import get_tags_condition
+
+# Fields that can be filtered and ordered, and their sql expression
+FIELDS = {
+    "node_id": "node.node_id",
+    "name": "node.name",
+    "syntax": "node.syntax",
+    "tags": "node.tags",
+    "is_richtxt": "(node.is_richtxt & 1)",
+    "is_ro": "(node.is_ro & 1)",
+    "has_codebox": "node.has_codebox",
+    "has_table": "node.has_table",
+    "has_image": "node.has_image",
+    "size": "length(node.txt)",
+    "ts_creation": "node.ts_creation",
+    "ts_lastsave": "node.ts_lastsave",
+    "father_id": "children.father_id",
+    "sequence": "children.sequence",
+}
+
+# Conditions of the type of a node, rich text nodes have the syntax custom-colors
+TYPES = {
+    "rich": "(node.is_richtxt & 1) = 1",
+    "plain": "(node.is_richtxt & 1) = 0 AND node.syntax = 'plain-text'",
+    "code": "(node.is_richtxt & 1) = 0 AND node.syntax != 'plain-text'",
+}
+
+OPERATORS = {"eq": "=", "ne": "!=", "lt": "<", "le": "<=", "gt": ">", "ge": ">=", "like": "LIKE"}
+
+@dataclass
+class CherryTreeNodeRecord:
+    """
+    The columns of a node, without its text nor its entities
+    """
+    node_id: int
+    name: str
+    syntax: str
+    tags: str
+    is_richtxt: int
+    is_ro: int
+    has_codebox: int
+    has_table: int
+    has_image: int
+    size: int
+    ts_creation: int
+    ts_lastsave: int
+    father_id: int
+    sequence: int
+
+class CherryTreeQuery:
+    """
+    Build a query over the nodes of a document, compiled to sql
+
+    Conditions are given as field=value or field__operator=value, the
+    operators being eq, ne, lt, le, gt, ge, like and in. The tags are
+    matched with tags=tag (or a list of tags which must all be present)
+    and the type of the nodes with type='rich', 'plain' or 'code' (with
+the operators eq, ne and in).
+
+    :param link: The link to the document
+    :type link: class:`CherryTreeLink`
+    """
+    def __init__(self, link):
+        self.link = link
+        self.conditions = []
+        self.params = []
+        self.ordering = []
+        self.max_rows = None
+
+    def filter(self, **conditions):
+        """
+        Return a query keeping only the nodes matching all the conditions
+
+        :raises ValueError: If a field or an operator is unknown
+        :rtype: class:`CherryTreeQuery`
+        """
+        query = self._copy()
+        for key, value in conditions.items():
+            field, _, operator = key.partition("__")
+            if field == "type":
+                query.conditions.append(self._get_type_condition(value, operator or "eq"))
+
+            elif field == "tags" and not operator:
+                condition, params = get_tags_condition(all=[value] if isinstance(value, str) else value)
+                query.conditions.append(condition)
+                query.params.extend(params)
+
+            elif field not in FIELDS:
+                raise ValueError(f"Unknown field {field!r}, choose between: {', '.join(FIELDS)}")
+
+            elif operator == "in":
+                values = list(value)
+                query.conditions.append(f"{FIELDS[field]} IN ({', '.join('?' * len(values))})")
+                query.params.extend(values)
+
+            else:
+                operator = operator or "eq"
+                if operator not in OPERATORS:
+                    raise ValueError(f"Unknown operator {operator!r}, choose between: "
+                                     f"{', '.join(OPERATORS)} and in")
+                if value is None and operator in ("eq", "ne"):
+                    query.conditions.append(f"{FIELDS[field]} IS {'NOT ' if operator == 'ne' else ''}NULL")
+                    continue
+                query.conditions.append(f"{FIELDS[field]} {OPERATORS[operator]} ?")
+                query.params.append(int(value) if isinstance(value, bool) else value)
+        return query
+
+    @staticmethod
+    def _get_type_condition(value, operator):
+        """
+        Return the condition on the type of the nodes, the
+        operators supported being eq, ne and in
+
+        :raises ValueError: If a type or the operator is unknown
+        """
+        if operator not in ("eq", "ne", "in"):
+            raise ValueError(f"Unknown operator {operator!r} for type, choose between: eq, ne and in")
+        values = list(value) if operator == "in" else [value]
+        for value in values:
+            if value not in TYPES:
+                raise ValueError(f"Unknown node type {value!r}, choose between: 'rich', 'plain' and 'code'")
+        if not values:
+            return "0"
+        condition = " OR ".join(f"({TYPES[value]})" for value in values)
+        return f"NOT ({condition})" if operator == "ne" else f"({condition})"
+
+    def order_by(self, *fields):
+        """
+        Return a query ordering the nodes by the fields, a field
+        starting with - is in descending order
+
+        :rtype: class:`CherryTreeQuery`
+        """
+        query = self._copy()
+        for field in fields:
+            name = field.lstrip("-")
+            if name not in FIELDS:
+                raise ValueError(f"Unknown field {name!r}, choose between: {', '.join(FIELDS)}")
+            query.ordering.append(f"{FIELDS[name]} {'DESC' if field.startswith('-') else 'ASC'}")
+        return query
+
+    def limit(self, max_rows):
+        """
+        Return a query keeping at most max_rows nodes
+
+        :rtype: class:`CherryTreeQuery`
+        """
+        query = self._copy()
+        query.max_rows = max_rows
+        return query
+
+    def _copy(self):
+        query = copy(self)
+        query.conditions = list(self.conditions)
+        query.params = list(self.params)
+        query.ordering = list(self.ordering)
+        return query
+
+    def get_sql(self, columns):
+        """
+        Return the sql of the query and its parameters
+
+        :rtype: Tuple[str, List]
+        """
+        sql = f"""SELECT {columns} FROM node
+                  LEFT JOIN children ON children.node_id=node.node_id
+                  WHERE {" AND ".join(self.conditions) or "1"}
+                  ORDER BY {", ".join(self.ordering + ["node.node_id ASC"])}"""
+        params = list(self.params)
+        if self.max_rows is not None:
+            sql += " LIMIT ?"
+            params.append(self.max_rows)
+        return sql, params
+
+    def ids(self):
+        """
+        Return the ids of the nodes
+
+        :rtype: List[int]
+        """
+        return [row[0] for row in self.link.con.execute(*self.get_sql("node.node_id"))]
+
+    def count(self):
+        """
+        Return the number of nodes
+        """
+        sql, params = self.get_sql("node.node_id")
+        return self.link.con.execute(f"SELECT COUNT(*) FROM ({sql})", params).fetchone()[0]
+
+    def rows(self):
+        """
+        Iter through the columns of the nodes, the texts are not read
+
+        :rtype: Iterator[class:`CherryTreeNodeRecord`]
+        """
+        columns = ", ".join(FIELDS[field] for field in CherryTreeNodeRecord.__dataclass_fields__)
+        for row in self.link.con.execute(*self.get_sql(columns)):
+            yield CherryTreeNodeRecord(*row)
+
+    def nodes(self):
+        """
+        Iter through the nodes, each node being recovered with its
+        text and entities when reached, without its children
+
+        :rtype: Iterator[class:`_CherryTreeNodeBase`]
+        """
+        for node_id in self.ids():
+            yield self.link.recover_node(node_id)
@@ -0,0 +1,44 @@
+"""
+Report of what happened when saving a document
+"""
+from dataclasses import dataclass, field
+
+@dataclass
+class CherryTreeSaveReport:
+    """
+    Statistics gathered while saving a document
+
+    :param images: The number of images saved
+    :param images_deduplicated: The number of images whose content was
+                                already saved and copied inside the database
+    :param bytes_deduplicated: The bytes of these images which were
+                               neither held twice nor read again
+    :param recompressed: For each png recompressed, its node_id,
+                         position, size before and after
+    """
+    images: int = 0
+    images_deduplicated: int = 0
+    bytes_deduplicated: int = 0
+    recompressed: list = field(default_factory=list)
+
+    @property
+    def bytes_recompressed(self):
+        """The bytes saved by recompressing png"""
+        return sum(before - after for _, _, before, after in self.recompressed)
+
+    def add_image(self, size, duplicated=False):
+        """
+        Count an image saved
+        """
+        self.images += 1
+        if duplicated:
+            self.images_deduplicated += 1
+            self.bytes_deduplicated += size
+
+    def __str__(self):
+        report = (f"{self.images} images saved, {self.images_deduplicated} duplicates "
+                  f"({self.bytes_deduplicated} bytes saved)")
+        if self.recompressed:
+            report += (f", {len(self.recompressed)} png recompressed "
+                       f"({self.bytes_recompressed} bytes saved)")
+        return report
@@ -20,6 +20,8 @@ class _ImageRow:
     JUSTIFICATION = 2
     ANCHOR = 3
     PNG = 4
+    SIZE = 4 # When length(png) is selected instead of png
+    ROWID = 5
 
 @dataclass(frozen=True)
 class _TableRow:
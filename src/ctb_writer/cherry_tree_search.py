@@ -0,0 +1,178 @@
+"""
+Full text search over the nodes of a document
+
+The index is a sqlite FTS5 table kept in a sidecar database next to
+the document, so that the document itself is left as cherry tree
+expects it. The index covers the name of the nodes, their text (the
+plain text of rich text nodes), their codeboxes and their tables, and
+only the nodes changed since the last update are indexed again.
+"""
+import os
+import sqlite3
+from dataclasses import dataclass
+from ctb_writer.assets import CherryTreeTable
+from ctb_writer.beautify import iter_plain_texts
+from .cherry_tree_link import CherryTreeLink
+from .cherry_tree_hash import CherryTreeHasher
+
+@dataclass
+class CherryTreeSearchResult:
+    """
+    A node matching a search
+
+    :param node_id: The id of the node
+    :param name: The name of the node
+    :param snippet: The part of the node matching, terms found are between []
+    :param rank: The rank of the node, lower is better
+    """
+    node_id: int
+    name: str
+    snippet: str
+    rank: float
+
+class CherryTreeSearchIndex:
+    """
+    Full text index of a document
+
+    :param ctb_path: The document to index
+    :type ctb_path: str
+
+    :param index_path: The database of the index, next to the document by default
+    :type index_path: str
+    """
+    # Weight of the columns when ranking the nodes: name, text, code, tables
+    weights = (10.0, 1.0, 1.0, 1.0)
+
+    # Number of rich text nodes sent at once to the processes extracting their text
+    batch_size = 1000
+
+    def __init__(self, ctb_path, index_path=None):
+        if not os.path.exists(ctb_path):
+            raise FileNotFoundError(f"Cannot find file {ctb_path}")
+        self.link = CherryTreeLink(ctb_path)
+        self.index_path = index_path or self.get_index_path(ctb_path)
+        self.con = sqlite3.connect(self.index_path)
+        try:
+            self.con.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS search
+                                USING fts5(name, text, code, tables, tokenize='unicode61 remove_diacritics 2')""")
+        except sqlite3.OperationalError as error:
+            raise RuntimeError("The sqlite library does not support FTS5") from error
+        self.con.execute("CREATE TABLE IF NOT EXISTS indexed (node_id INTEGER PRIMARY KEY, signature TEXT)")
+
+    @staticmethod
+    def get_index_path(ctb_path):
+        """
+        Return the path of the sidecar index of a document
+        """
+        return f"{ctb_path}.search"
+
+    def update(self, workers=None):
+        """
+        Index the nodes added or changed since the last update,
+        and remove the nodes deleted from the index
+
+        :param workers: The number of processes extracting the text of
+                        rich text nodes, used when there are more than
+                        batch_size nodes to index. The text is extracted
+                        in the current process by default
+        :type workers: int
+
+        :return: The number of nodes indexed and removed
+        :rtype: Tuple[int, int]
+        """
+        signatures = CherryTreeHasher(self.link).get_signatures()
+        indexed = dict(self.con.execute("SELECT node_id, signature FROM indexed"))
+        removed = [(node_id,) for node_id in indexed.keys() - signatures.keys()]
+        self.con.executemany("DELETE FROM search WHERE rowid=?", removed)
+        self.con.executemany("DELETE FROM indexed WHERE node_id=?", removed)
+
+        changed = [node_id for node_id, signature in signatures.items() if indexed.get(node_id) != signature]
+        rich = [node_id for node_id in changed if self._is_rich(node_id)]
+        if workers is None or len(rich) < self.batch_size:
+            workers = 1
+        texts = iter_plain_texts(((self._get_text(node_id), ()) for node_id in rich),
+                                 workers=workers, batch_size=self.batch_size)
+        for node_id, text in zip(rich, texts):
+            self._index(node_id, signatures[node_id], text)
+
+        rich = set(rich)
+        for node_id in changed:
+            if node_id not in rich:
+                self._index(node_id, signatures[node_id], self._get_text(node_id))
+        self.con.commit()
+        return len(changed), len(removed)
+
+    def _is_rich(self, node_id):
+        return bool(self.link.get_rows("node", node_id, "is_richtxt")[0]["is_richtxt"] & 0x1)
+
+    def _get_text(self, node_id):
+        """
+        Return the txt column of a node as a string
+        """
+        text = self.link.get_rows("node", node_id, "txt")[0]["txt"] or ""
+        if isinstance(text, bytes):
+            text = text.decode("UTF-8", errors="replace")
+        return text
+
+    def _index(self, node_id, signature, text):
+        """
+        Replace a node in the index, text being its plain text
+        """
+        self.con.execute("DELETE FROM search WHERE rowid=?", (node_id,))
+        self.con.execute("INSERT INTO search (rowid, name, text, code, tables) VALUES (?, ?, ?, ?, ?)",
+                         (node_id, *self._get_columns(node_id, text)))
+        self.con.execute("INSERT OR REPLACE INTO indexed VALUES (?, ?)", (node_id, signature))
+
+    def _get_columns(self, node_id, text):
+        """
+        Return the name, text, code and tables of a node as plain text
+        """
+        name = self.link.get_rows("node", node_id, "name")[0]["name"]
+        code = "\n".join(codebox["txt"] if isinstance(codebox["txt"], str)
+                         else (codebox["txt"] or b"").decode("UTF-8", errors="replace")
+                         for codebox in self.link.get_rows("codebox", node_id, "txt"))
+        tables = []
+        for grid in self.link.get_rows("grid", node_id, "txt"):
+            for cells in CherryTreeTable.from_xml(grid["txt"], position=0).iter_rows():
+                tables.append(" ".join(cells))
+        return name, text, code, "\n".join(tables)
+
+    @staticmethod
+    def quote_terms(query):
+        """
+        Quote each term of a query, so that it is matched as is
+        (10.0.0.1, /etc/passwd, v1.2) and not read as a FTS5 query
+        """
+        return " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+
+    def search(self, query, limit=20):
+        """
+        Search the nodes matching a FTS5 query, best ranked first. A
+        query which is not a valid FTS5 query is searched again with
+        each of its terms quoted
+
+        :param query: The query, such as 'nmap AND NOT udp', 'name:report' or '10.0.0.1'
+        :type query: str
+
+        :param limit: The maximum number of results
+        :type limit: int
+
+        :raises ValueError: If the query cannot be searched
+        :rtype: List[class:`CherryTreeSearchResult`]
+        """
+        weights = ", ".join(str(weight) for weight in self.weights)
+        sql = f"""SELECT rowid, name, snippet(search, -1, '[', ']', '...', 12),
+                         bm25(search, {weights}) AS rank
+                  FROM search WHERE search MATCH ?
+                  ORDER BY rank LIMIT ?"""
+        try:
+            rows = self.con.execute(sql, (query, limit)).fetchall()
+        except sqlite3.OperationalError:
+            try:
+                rows = self.con.execute(sql, (self.quote_terms(query), limit)).fetchall()
+            except sqlite3.OperationalError as error:
+                raise ValueError(f"Cannot search {query!r}: {error}") from error
+        return [CherryTreeSearchResult(*row) for row in rows]
+
+    def close(self):
+        self.con.close()
@@ -0,0 +1,86 @@
+"""
+Find the nodes of a document by their tags
+
+Tags are stored in the tags column joined by spaces. Loaded documents
+are searched with an index built in memory, and documents not loaded
+with sql queries over the tags column.
+"""
+
+def get_tags_condition(all=(), any=(), none=()):
+    """
+    Return the sql condition over the tags column selecting the nodes
+    having all the tags of all, at least one tag of any and no tag of none
+
+    :return: The condition and its parameters
+    :rtype: Tuple[str, List[str]]
+    """
+    has_tag = "instr(' ' || IFNULL(tags, '') || ' ', ' ' || ? || ' ') > 0"
+    conditions = []
+    params = []
+    for tag in all:
+        conditions.append(has_tag)
+        params.append(tag)
+    if any:
+        conditions.append("(" + " OR ".join([has_tag] * len(any)) + ")")
+        params.extend(any)
+    for tag in none:
+        conditions.append(f"NOT {has_tag}")
+        params.append(tag)
+    return " AND ".join(conditions) or "1", params
+
+class CherryTreeTagIndex:
+    """
+    Index of the nodes by tag, built from nodes in memory
+
+    The index is not updated when the tags of the nodes
+    change, build a new one to take changes into account
+    """
+    def __init__(self):
+        self.tags = {}
+        self.node_ids = set()
+
+    @classmethod
+    def from_nodes(cls, nodes):
+        """
+        Build the index of the nodes given and of their children
+
+        :param nodes: The root nodes
+        :type nodes: List[class:`_CherryTreeNodeBase`]
+        """
+        index = cls()
+        for root_node in nodes:
+            for node in root_node:
+                index.add(node.node_id, node.tags)
+        return index
+
+    def add(self, node_id, tags):
+        """
+        Add a node and its tags to the index
+        """
+        self.node_ids.add(node_id)
+        for tag in tags or []:
+            self.tags.setdefault(tag, set()).add(node_id)
+
+    def get_counts(self):
+        """
+        Return the number of nodes having each tag
+
+        :rtype: Dict[str, int]
+        """
+        return {tag: len(node_ids) for tag, node_ids in sorted(self.tags.items())}
+
+    def find(self, all=(), any=(), none=()):
+        """
+        Return the ids of the nodes having all the tags of all, at
+        least one tag of any and no tag of none
+
+        :rtype: List[int]
+        """
+        node_ids = set(self.node_ids)
+        for tag in all:
+            node_ids &= self.tags.get(tag, set())
+        if any:
+            node_ids &= set().union(*(self.tags.get(tag, set()) for tag in any))
+        for tag in none:
+            node_ids -= self.tags.get(tag, set())
+        return sorted(node_ids)
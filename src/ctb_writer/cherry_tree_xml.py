@@ -0,0 +1,318 @@
+"""
+Link cherry tree instance to a .ctd document, the xml format of cherry tree
+
+The document is read with iterparse, each node being built as soon as
+its content is parsed and its elements released, and it is written
+with an incremental emitter, so that big documents never need their
+whole xml tree in memory.
+"""
+import os
+import base64
+import xml.etree.ElementTree as ET
+from time import time
+from xml.sax.saxutils import escape, quoteattr
+from .cherry_tree_report import CherryTreeSaveReport
+from .cherry_tree_node import CherryTreeNode, CherryTreeCodeNode, CherryTreePlainNode
+from ctb_writer.assets import *
+from ctb_writer.assets.png import recompress_png
+
+class CherryTreeXmlLink:
+    """
+    Cherry Tree link to a .ctd document
+    ./src/ct/ct_storage_xml.cc --> Some implementations of the elements
+    """
+    # Elements holding the content of a node
+    content_tags = ("rich_text", "codebox", "table", "encoded_png")
+
+    def __init__(self, name):
+        self.name = name
+
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self, val):
+        """
+        Checks that the extension is .ctd
+
+        :raises ValueError: If the extension is not .ctd
+        """
+        if os.path.splitext(val)[1] != ".ctd":
+            raise ValueError(f"Extension {val} is not supported "
+                             "for cherry tree xml document")
+        self._name = val
+
+    def iter_nodes(self):
+        """
+        Parse the document and yield each node as soon as its
+        content is read, parents are yielded before their children
+
+        The nodes yielded have no children, and the elements parsed
+        are released once their node is built
+
+        :return: The node and the id of its father, 0 for root nodes
+        :rtype: Iterator[Tuple[class:`_CherryTreeNodeBase`, int]]
+        """
+        # Each item is the element of a node, its father id and whether it was yielded
+        stack = []
+        root = None
+        for event, element in ET.iterparse(self.name, events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = element
+                elif element.tag == "node":
+                    if stack and not stack[-1][2]:
+                        # The content of a node is written before its children
+                        yield self._build_node(*stack[-1][:2]), stack[-1][1]
+                        stack[-1][2] = True
+                        stack[-1][0][:] = [child for child in stack[-1][0] if child.tag == "node"]
+                    father_id = int(stack[-1][0].get("unique_id")) if stack else 0
+                    stack.append([element, father_id, False])
+
+            elif element.tag == "node":
+                node_element, father_id, is_yielded = stack.pop()
+                if not is_yielded:
+                    yield self._build_node(node_element, father_id), father_id
+                element.clear()
+                (stack[-1][0] if stack else root).remove(element)
+
+            elif element.tag == "bookmarks":
+                root.remove(element)
+
+    def _build_node(self, element, father_id):
+        """
+        Build a node from its element, its content being parsed
+        """
+        syntax = element.get("prog_lang", "custom-colors")
+        name = element.get("name", "")
+        if syntax == "custom-colors":
+            node = CherryTreeNode(name)
+            for child in element:
+                self._add_content(node, child)
+        else:
+            if syntax == "plain-text":
+                node = CherryTreePlainNode(name)
+            else:
+                node = CherryTreeCodeNode(name, syntax=syntax)
+            node.set_text("".join(child.text or "" for child in element.iter("rich_text")))
+
+        node.node_id = int(element.get("unique_id"))
+        node.father_id = father_id
+        node.is_ro = int(element.get("readonly", "0") in ("1", "True"))
+        node.icon = int(element.get("custom_icon_id", "0"))
+        if element.get("tags"):
+            node.tags = element.get("tags").split(" ")
+        if element.get("is_bold", "0") in ("1", "True"):
+            node.set_bold_title()
+        if element.get("foreground"):
+            node.set_title_color(element.get("foreground"))
+        return node
+
+    @staticmethod
+    def _add_content(node, element):
+        """
+        Add a rich text or an entity to a rich node
+        """
+        if element.tag == "rich_text":
+            element.tail = None
+            node.xml.append(element)
+            return
+
+        position = int(element.get("char_offset", "0"))
+        justification = element.get("justification", "left")
+        if element.tag == "codebox":
+            node.codebox.append(CherryTreeCodebox(txt=element.text or "",
+                                                  syntax=element.get("syntax_highlighting", "plain-text"),
+                                                  position=position,
+                                                  justification=justification,
+                                                  width=int(element.get("frame_width", "700")),
+                                                  height=int(element.get("frame_height", "400")),
+                                                  is_width_pix=int(element.get("width_in_pixels", "1") in ("1", "True")),
+                                                  highlight_brackets=int(element.get("highlight_brackets", "1") in ("1", "True")),
+                                                  show_line_numbers=int(element.get("show_line_numbers", "1") in ("1", "True"))))
+
+        elif element.tag == "table":
+            rows = [[cell.text or "" for cell in row.iter("cell")] for row in element.iter("row")]
+            node.tables.append(CherryTreeTable(rows, position=position, justification=justification,
+                                               col_min=int(element.get("col_min", "250")),
+                                               col_max=int(element.get("col_max", "250"))))
+
+        elif element.tag == "encoded_png":
+            if element.get("filename") or element.get("anchor") or not element.text:
+                # Embedded files and anchors are stored as encoded_png too,
+                # they have no equivalent in the nodes and are skipped
+                return
+            node.images.append(CherryTreeImage(base64.b64decode(element.text), position=position,
+                                               justification=justification))
+
+    def get_nodes(self):
+        """
+        Recover the nodes from the document
+
+        :return: The root nodes
+        :rtype: List[class:`_CherryTreeNodeBase`]
+        """
+        root_nodes = []
+        nodes = {}
+        for node, father_id in self.iter_nodes():
+            nodes[node.node_id] = node
+            if father_id:
+                nodes[father_id].append(node)
+            else:
+                root_nodes.append(node)
+        return root_nodes
+
+    def init(self):
+        """
+        Nothing to create before saving, the document is written at once
+        """
+
+    def save(self, nodes, report=None, optimize_images=False, workers=None):
+        """
+        Write the nodes in the document
+
+        :param nodes: The root nodes to save
+        :type nodes: List[class:`_CherryTreeNodeBase`]
+
+        :param report: The report to fill, a new one is created by default
+        :type report: class:`CherryTreeSaveReport`
+
+        :param optimize_images: Recompress the png while they are written,
+                                one at a time, the nodes are not changed
+        :type optimize_images: bool
+
+        :param workers: Unused, the png of a .ctd are recompressed in order
+        :type workers: int
+
+        :return: The report of the save
+        :rtype: class:`CherryTreeSaveReport`
+        """
+        def iter_tree(nodes, level):
+            for node in nodes:
+                yield node, level
+                yield from iter_tree(node.children, level + 1)
+        return self.write_nodes(iter_tree(nodes, 0), report, optimize_images)
+
+    def write_nodes(self, nodes, report=None, optimize_images=False):
+        """
+        Write the nodes one at a time, in depth first order
+
+        :param nodes: The nodes and their level, their children are not written
+        :type nodes: Iterable[Tuple[class:`_CherryTreeNodeBase`, int]]
+
+        :return: The report of the save
+        :rtype: class:`CherryTreeSaveReport`
+        """
+        report = CherryTreeSaveReport() if report is None else report
+        with open(self.name, "w", encoding="UTF-8") as output:
+            writer = _CtdWriter(output, report, optimize_images)
+            output.write('<?xml version="1.0" encoding="UTF-8"?>\n<cherrytree>\n')
+            opened = 0
+            for node, level in nodes:
+                for _ in range(opened - level):
+                    output.write("</node>\n")
+                opened = level
+                writer.write_node(node)
+                opened += 1
+            output.write("</node>\n" * opened)
+            output.write("</cherrytree>\n")
+        return report
+
+class _CtdWriter:
+    """
+    Write the content of the nodes as xml, the texts
+    and the images are written by chunks
+    """
+
+    def __init__(self, output, report, optimize_images=False):
+        self.output = output
+        self.report = report
+        self.optimize_images = optimize_images
+
+    def write(self, text):
+        self.output.write(text)
+
+    def write_node(self, node):
+        """
+        Write the opening tag of a node and its content
+        """
+        title_style = node.get_title_style()
+        timestamp = str(int(time()))
+        attributes = {"name": node.name,
+                      "unique_id": node.node_id,
+                      "prog_lang": node.syntax,
+                      "tags": node.get_tags() or "",
+                      "readonly": node.is_ro,
+                      "nosearch_me": 0,
+                      "nosearch_ch": 0,
+                      "custom_icon_id": node.icon,
+                      "is_bold": int(bool(title_style.get("bold"))),
+                      "foreground": title_style.get("color") or "",
+                      "ts_creation": timestamp,
+                      "ts_lastsave": timestamp}
+        self.write("<node " + " ".join(f"{key}={quoteattr(str(value))}"
+                                       for key, value in attributes.items()) + ">")
+
+        if not node.is_richtext:
+            self.write("<rich_text>")
+            for part in node.parts:
+                for chunk in ([part] if isinstance(part, str) else part.iter_text()):
+                    self.write(escape(chunk))
+            self.write("</rich_text>\n")
+            return
+
+        for element in node.xml:
+            self.write(ET.tostring(element, encoding="unicode"))
+        for codebox in node.codebox:
+            self._write_codebox(codebox)
+        for table in node.tables:
+            self._write_table(table)
+        for image in node.images:
+            self._write_image(image, node.node_id)
+        self.write("\n")
+
+    @staticmethod
+    def _get_attributes(entity, **attributes):
+        attributes = {"char_offset": entity.position, "justification": entity.justification, **attributes}
+        return " ".join(f"{key}={quoteattr(str(value))}" for key, value in attributes.items())
+
+    def _write_codebox(self, codebox):
+        self.write("<codebox " + self._get_attributes(codebox,
+                                                      frame_width=codebox.width,
+                                                      frame_height=codebox.height,
+                                                      width_in_pixels=int(codebox.is_width_pix),
+                                                      syntax_highlighting=codebox.syntax,
+                                                      highlight_brackets=int(codebox.highlight_brackets),
+                                                      show_line_numbers=int(codebox.show_line_numbers)) + ">")
+        chunks = codebox.txt.iter_text() if isinstance(codebox.txt, CherryTreeTextFile) else [codebox.txt]
+        for chunk in chunks:
+            self.write(escape(chunk))
+        self.write("</codebox>")
+
+    def _write_table(self, table):
+        self.write("<table " + self._get_attributes(table, col_min=table.col_min,
+                                                    col_max=table.col_max) + ">")
+        for row in table.iter_rows():
+            self.write("<row>" + "".join(f"<cell>{escape(cell)}</cell>" for cell in row) + "</row>")
+        self.write("</table>")
+
+    def _write_image(self, image, node_id):
+        self.write("<encoded_png " + self._get_attributes(image, link="", time=0) + ">")
+        chunks = image.iter_data()
+        if self.optimize_images:
+            data = b"".join(chunks)
+            recompressed = recompress_png(data)
+            if recompressed is not None:
+                self.report.recompressed.append((node_id, image.position, len(data), len(recompressed)))
+            chunks = [recompressed or data]
+
+        pending = b""
+        for chunk in chunks:
+            pending += chunk
+            cut = len(pending) - len(pending) % 3
+            self.write(base64.b64encode(pending[:cut]).decode("ascii"))
+            pending = pending[cut:]
+        self.write(base64.b64encode(pending).decode("ascii"))
+        self.write("</encoded_png>")
+        self.report.add_image(image.size)
@@ -0,0 +1,306 @@
+"""
+Compare two documents
+
+Nodes are matched by id, or by path when the ids of the documents
+differ. The subtrees having the same digest in both documents are
+skipped, so only the parts of the documents that changed are read,
+and the changes are yielded as soon as they are found. The structure
+of the documents is kept in temporary sqlite tables, not in memory.
+
+Usage:
+
+    >>> from ctb_writer.diff import iter_diff
+    >>> for change in iter_diff("last_week.ctb", "this_week.ctb"):
+    ...     print(change)
+"""
+import sqlite3
+import hashlib
+from dataclasses import dataclass, field
+from ctb_writer.cherry_tree_link import CherryTreeLink
+from ctb_writer.cherry_tree_hash import CherryTreeHasher, NODE_PARTS
+
+__all__ = ["iter_diff", "CherryTreeChange"]
+
+# Name of the entity tables in the details of the changes
+ENTITY_NAMES = {"codebox": "codebox", "grid": "table", "image": "image"}
+
+@dataclass
+class CherryTreeChange:
+    """
+    A change of a node between two documents
+
+    :param kind: Either added, removed, moved, renamed or changed
+    :param path: The path of the node, in the first document if it was removed
+    :param node_id: The id of the node, in the first document if it was removed
+    :param old_path: The path in the first document of a node moved or renamed
+    :param details: The parts of the node that changed, such as 'text' or 'image +1'
+    """
+    kind: str
+    path: str
+    node_id: int
+    old_path: str = None
+    details: list = field(default_factory=list)
+
+    def __str__(self):
+        line = f"{self.kind:<8} {self.path}"
+        if self.old_path is not None:
+            line += f" (was {self.old_path})"
+        if self.details:
+            line += f" [{', '.join(self.details)}]"
+        return line
+
+class _DiffSide:
+    """
+    The structure and hashes of one of the documents compared, kept in
+    temporary tables of its connection so that the memory used does not
+    depend on the size of the document. The nodes are indexed by a key
+    which is either their id or their path
+    """
+    def __init__(self, ctb_path, by):
+        self.hasher = CherryTreeHasher(CherryTreeLink(ctb_path))
+        self.con = self.hasher.link.con
+        self.root = 0 if by == "id" else ""
+        self._load_tree(by)
+        self._load_hashes()
+
+    def close(self):
+        """
+        Close the link to the document, its temporary tables are dropped
+        """
+        self.hasher.link.close()
+
+    def _load_tree(self, by):
+        """
+        Fill the table of the nodes with their path, siblings with the
+        same name being told apart by their rank
+        """
+        self.con.execute("""CREATE TEMP TABLE diff_node (
+                            node_id INTEGER PRIMARY KEY, father_id INTEGER, sequence INTEGER,
+                            key, father_key, name TEXT, path TEXT, position TEXT,
+                            node_hash TEXT, tree_hash TEXT
+                            )""")
+        key, father_key = ("node_id", "father_id") if by == "id" else ("path", "father_path")
+        self.con.execute(f"""INSERT INTO temp.diff_node
+                                 (node_id, father_id, sequence, key, father_key, name, path, position)
+                             WITH RECURSIVE ranked AS (
+                                 SELECT children.node_id, children.father_id, children.sequence, node.name,
+                                        IFNULL(node.name, '') || IIF(ROW_NUMBER() OVER siblings > 1,
+                                                                     '[' || ROW_NUMBER() OVER siblings || ']',
+                                                                     '') AS unique_name
+                                 FROM children LEFT JOIN node ON node.node_id=children.node_id
+                                 WINDOW siblings AS (PARTITION BY children.father_id, IFNULL(node.name, '')
+                                                     ORDER BY children.sequence)
+                             ),
+                             tree(node_id, father_id, sequence, name, path, father_path, position) AS (
+                                 SELECT node_id, father_id, sequence, name, unique_name, '',
+                                        printf('%010d', sequence)
+                                 FROM ranked WHERE father_id=0
+                                 UNION ALL
+                                 SELECT ranked.node_id, ranked.father_id, ranked.sequence, ranked.name,
+                                        tree.path || '/' || ranked.unique_name, tree.path,
+                                        tree.position || printf('/%010d', ranked.sequence)
+                                 FROM ranked JOIN tree ON ranked.father_id=tree.node_id
+                             )
+                             SELECT node_id, father_id, sequence, {key}, {father_key}, name, path, position
+                             FROM tree""")
+        self.con.execute("""INSERT INTO temp.diff_node (node_id, key, path, position)
+                            VALUES (0, ?, '', '')""", (self.root,))
+        self.con.execute("CREATE INDEX temp.diff_node_key ON diff_node (key)")
+        self.con.execute("CREATE INDEX temp.diff_node_father_key ON diff_node (father_key, sequence)")
+        self.con.execute("CREATE INDEX temp.diff_node_father_id ON diff_node (father_id, sequence)")
+
+    def _load_hashes(self):
+        """
+        Hash the nodes, then compute the digests of the subtrees, the
+        children being always hashed before their father
+        """
+        for node_id, node_hash in self.hasher.iter_node_hashes():
+            self.con.execute("UPDATE temp.diff_node SET node_hash=? WHERE node_id=?", (node_hash, node_id))
+
+        self.con.execute("CREATE TEMP TABLE diff_tree (node_id INTEGER PRIMARY KEY, tree_hash TEXT)")
+        for node_id, node_hash in self.con.execute("""SELECT node_id, node_hash FROM temp.diff_node
+                                                      ORDER BY position DESC"""):
+            children = self.con.execute("""SELECT diff_tree.tree_hash
+                                           FROM temp.diff_node JOIN temp.diff_tree USING (node_id)
+                                           WHERE diff_node.father_id=? ORDER BY diff_node.sequence""", (node_id,))
+            self.con.execute("INSERT INTO temp.diff_tree VALUES (?, ?)",
+                             (node_id, self.hasher.hash_tree(node_hash, (row[0] for row in children))))
+        self.con.execute("""UPDATE temp.diff_node
+                            SET tree_hash=(SELECT tree_hash FROM temp.diff_tree
+                                           WHERE diff_tree.node_id=diff_node.node_id)""")
+        self.con.execute("DROP TABLE temp.diff_tree")
+
+    def get(self, key):
+        """
+        Return the node having a key, None if there is none
+
+        :rtype: class:`sqlite3.Row`
+        """
+        cursor = self.con.cursor()
+        cursor.row_factory = sqlite3.Row
+        return cursor.execute("""SELECT node_id, father_key, name, path, node_hash, tree_hash
+                                 FROM temp.diff_node WHERE key=?""", (key,)).fetchone()
+
+    def has(self, key):
+        return self.con.execute("SELECT 1 FROM temp.diff_node WHERE key=?", (key,)).fetchone() is not None
+
+    def get_children(self, key):
+        """
+        Return the keys and the digests of the children of a node
+
+        :rtype: List[Tuple[Union[int, str], str]]
+        """
+        return self.con.execute("""SELECT key, tree_hash FROM temp.diff_node
+                                   WHERE father_key=? ORDER BY sequence""", (key,)).fetchall()
+
+    def count_nodes(self, key, other):
+        """
+        Count the nodes of a subtree which are not in the other document
+        """
+        count = 0
+        stack = [key]
+        while stack:
+            key = stack.pop()
+            count += not other.has(key)
+            stack.extend(child for child, _ in self.get_children(key))
+        return count
+
+def _get_details(first, second, before, after):
+    """
+    Return the parts of a node that changed
+    """
+    first_rows = first.hasher.hash_rows(before["node_id"])
+    second_rows = second.hasher.hash_rows(after["node_id"])
+    details = [part for part in NODE_PARTS if part != "name" and first_rows.get(part) != second_rows.get(part)]
+    for table, name in ENTITY_NAMES.items():
+        before, after = dict(first_rows[table]), dict(second_rows[table])
+        added = len(after.keys() - before.keys())
+        removed = len(before.keys() - after.keys())
+        changed = sum(1 for offset in before.keys() & after.keys() if before[offset] != after[offset])
+        for sign, count in (("+", added), ("-", removed), ("~", changed)):
+            if count:
+                details.append(f"{name} {sign}{count}")
+    return details
+
+def iter_diff(first_path, second_path, by="id"):
+    """
+    Compare two documents and yield the changes of their nodes, the
+    documents are only read
+
+    When matching the nodes by path, a node moved or renamed is found
+    by pairing the subtrees removed and added having the same digest,
+    these changes are yielded once the documents are walked
+
+    :param first_path: The document before the changes
+    :type first_path: str
+
+    :param second_path: The document after the changes
+    :type second_path: str
+
+    :param by: Match the nodes by "id" or by "path"
+    :type by: str
+
+    :rtype: Iterator[class:`CherryTreeChange`]
+    """
+    if by not in ("id", "path"):
+        raise ValueError(f"Unknown value {by!r} for by, choose between: 'id' and 'path'")
+
+    first = _DiffSide(first_path, by)
+    try:
+        second = _DiffSide(second_path, by)
+    except BaseException:
+        first.close()
+        raise
+    try:
+        yield from _iter_changes(first, second, by)
+    finally:
+        # Also run when the caller stops iterating before the end
+        first.close()
+        second.close()
+
+def _iter_changes(first, second, by):
+    """
+    Walk both documents and yield the changes of their nodes
+    """
+    added, removed = [], []
+    visited = set()
+    stack = [first.root]
+    while stack:
+        key = stack.pop()
+        before, after = first.get(key), second.get(key)
+        if key != first.root:
+            if key in visited:
+                continue
+            visited.add(key)
+            if after is None:
+                count = first.count_nodes(key, second)
+                change = CherryTreeChange("removed", before["path"], before["node_id"],
+                                          details=[f"{count} nodes"] if count > 1 else [])
+                if by == "path":
+                    removed.append((key, change))
+                else:
+                    yield change
+                continue
+            if before is None:
+                count = second.count_nodes(key, first)
+                change = CherryTreeChange("added", after["path"], after["node_id"],
+                                          details=[f"{count} nodes"] if count > 1 else [])
+                if by == "path":
+                    added.append((key, change))
+                else:
+                    yield change
+                continue
+
+            path, node_id = after["path"], after["node_id"]
+            if before["father_key"] != after["father_key"]:
+                yield CherryTreeChange("moved", path, node_id, old_path=before["path"])
+            if before["name"] != after["name"]:
+                yield CherryTreeChange("renamed", path, node_id, old_path=before["path"])
+            if before["node_hash"] != after["node_hash"]:
+                details = _get_details(first, second, before, after)
+                if details:
+                    yield CherryTreeChange("changed", path, node_id, details=details)
+        if before["tree_hash"] == after["tree_hash"]:
+            continue
+
+        children = [child for child, _ in second.get_children(key)]
+        known = set(children)
+        children = children + [child for child, _ in first.get_children(key) if child not in known]
+        stack.extend(reversed(children))
+
+    yield from _pair_moves(first, second, removed, added)
+
+def _get_content_digest(side, key):
+    """
+    Return the digest of a subtree without the name of its root,
+    so that a subtree renamed keeps the same digest
+    """
+    digest = hashlib.sha256()
+    for part, hashes in side.hasher.hash_rows(side.get(key)["node_id"]).items():
+        if part != "name":
+            digest.update(repr(hashes).encode("UTF-8"))
+    for _, tree_hash in side.get_children(key):
+        digest.update(tree_hash.encode("UTF-8"))
+    return digest.hexdigest()
+
+def _pair_moves(first, second, removed, added):
+    """
+    Pair the subtrees removed and added having the same content
+    as nodes moved or renamed, the others are yielded as they are
+    """
+    removed_by_digest = {}
+    for key, change in removed:
+        removed_by_digest.setdefault(_get_content_digest(first, key), []).append((key, change))
+
+    for key, change in added:
+        candidates = removed_by_digest.get(_get_content_digest(second, key))
+        if not candidates:
+            yield change
+            continue
+        old_key, old = candidates.pop(0)
+        kind = "renamed" if first.get(old_key)["father_key"] == second.get(key)["father_key"] else "moved"
+        yield CherryTreeChange(kind, change.path, change.node_id, old_path=old.path)
+
+    for candidates in removed_by_digest.values():
+        for _, change in candidates:
+            yield change
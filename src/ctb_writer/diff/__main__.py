@@ -0,0 +1,27 @@
+"""
+Compare two documents, the changes are printed as soon as they are found
+
+Usage:
+
+    python3 -m ctb_writer.diff last_week.ctb this_week.ctb [--by path] [--json]
+"""
+import sys
+import json
+import argparse
+from dataclasses import asdict
+from . import iter_diff
+
+parser = argparse.ArgumentParser(prog="python3 -m ctb_writer.diff",
+                                 description="Compare two cherry tree documents")
+parser.add_argument("first", help="The document before the changes")
+parser.add_argument("second", help="The document after the changes")
+parser.add_argument("--by", choices=["id", "path"], default="id",
+                    help="Match the nodes by id, or by path when the ids differ")
+parser.add_argument("--json", action="store_true", help="Print each change as a json line")
+args = parser.parse_args()
+
+has_changes = False
+for change in iter_diff(args.first, args.second, by=args.by):
+    has_changes = True
+    print(json.dumps(asdict(change)) if args.json else change, flush=True)
+sys.exit(1 if has_changes else 0)
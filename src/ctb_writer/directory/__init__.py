@@ -0,0 +1,306 @@
+"""
+Import a directory tree in a document
+
+Directories become rich nodes, and files become code, plain text
+or image nodes. The files are hashed by a pool of threads, and the
+document keeps a manifest of the files imported (and of the files
+skipped) so that importing the same directory again only touches the
+files that changed. The content of the files is only read when the
+nodes are saved, and all the changes are written in one transaction.
+
+Usage:
+
+    >>> from ctb_writer.directory import import_directory
+    >>> import_directory("project/", "project.ctb")
+"""
+import os
+import codecs
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from ctb_writer.cherry_tree_link import CherryTreeLink
+from ctb_writer.node_builder import CherryTreeNodeBuilder
+
+__all__ = ["import_directory", "DirectoryImporter", "guess_syntax"]
+
+# Syntax of the code nodes, from the extension of the files
+SYNTAXES = {
+    ".py": "python", ".pyw": "python", ".c": "c", ".h": "c", ".cpp": "cpp", ".cc": "cpp",
+    ".hpp": "cpp", ".cs": "c-sharp", ".java": "java", ".js": "js", ".mjs": "js",
+    ".ts": "typescript", ".go": "go", ".rs": "rust", ".rb": "ruby", ".php": "php",
+    ".pl": "perl", ".lua": "lua", ".sh": "sh", ".bash": "sh", ".zsh": "sh", ".ps1": "powershell",
+    ".sql": "sql", ".html": "html", ".htm": "html", ".css": "css", ".xml": "xml",
+    ".json": "json", ".yml": "yaml", ".yaml": "yaml", ".toml": "toml", ".ini": "ini",
+    ".cfg": "ini", ".md": "markdown", ".diff": "diff", ".patch": "diff", ".tex": "latex",
+}
+
+# Syntax of the files known by their name
+FILENAME_SYNTAXES = {"makefile": "makefile", "dockerfile": "dockerfile", "cmakelists.txt": "cmake"}
+
+IMAGE_EXTENSIONS = (".png",)
+
+# Directories that are never imported
+IGNORED_DIRECTORIES = {".git", ".hg", ".svn", "__pycache__", "node_modules"}
+
+def guess_syntax(filename):
+    """
+    Guess the syntax of a file from its name
+
+    :return: The syntax, or None for a plain text file
+    :rtype: str
+    """
+    basename = os.path.basename(filename).lower()
+    if basename in FILENAME_SYNTAXES:
+        return FILENAME_SYNTAXES[basename]
+    return SYNTAXES.get(os.path.splitext(basename)[1])
+
+# Size of the chunks read when hashing the files
+CHUNK_SIZE = 1 << 20
+
+def _hash_file(path, encoding):
+    """
+    Hash a file by chunks, and check whether it is a text in the encoding
+
+    :return: The sha256 of the file and whether it can be decoded
+    :rtype: Tuple[str, bool]
+    """
+    digest = hashlib.sha256()
+    decoder = codecs.getincrementaldecoder(encoding)()
+    is_text = True
+    with open(path, "rb") as file:
+        while chunk := file.read(CHUNK_SIZE):
+            digest.update(chunk)
+            if is_text:
+                try:
+                    decoder.decode(chunk)
+                except UnicodeDecodeError:
+                    is_text = False
+    if is_text:
+        try:
+            decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            is_text = False
+    return digest.hexdigest(), is_text
+
+class DirectoryImporter:
+    """
+    Import a directory in a document, or update the nodes of a
+    document previously imported from this directory
+
+    :param directory: The directory to import
+    :type directory: str
+
+    :param ctb_path: The document, created if it does not exist
+    :type ctb_path: str
+
+    :param workers: The number of threads reading the files
+    :type workers: int
+
+    :param encoding: The encoding of the text files
+    :type encoding: str
+    """
+    MANIFEST_TABLE = "ctb_writer_files"
+
+    def __init__(self, directory, ctb_path, workers=4, encoding="utf-8"):
+        if not os.path.isdir(directory):
+            raise NotADirectoryError(f"Cannot find directory {directory}")
+        self.directory = directory
+        self.workers = workers
+        self.encoding = encoding
+        is_new = not os.path.exists(ctb_path)
+        self.link = CherryTreeLink(ctb_path)
+        if is_new:
+            self.link.init()
+        self._init_manifest(is_new)
+        self.stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0, "skipped": 0}
+
+    def _init_manifest(self, is_new):
+        """
+        Create the table holding the files imported in the document
+        """
+        exists = self.link.cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
+                                          (self.MANIFEST_TABLE,)).fetchone()
+        if not exists and not is_new:
+            raise ValueError(f"The document {self.link.name} was not created from a directory")
+        self.link.cursor.execute(f"""CREATE TABLE IF NOT EXISTS {self.MANIFEST_TABLE} (
+                                    path TEXT PRIMARY KEY,
+                                    node_id INTEGER,
+                                    mtime_ns INTEGER,
+                                    size INTEGER,
+                                    sha256 TEXT
+                                    )""")
+        self.manifest = {row[0]: row[1:] for row in self.link.cursor.execute(
+                            f"SELECT path, node_id, mtime_ns, size, sha256 FROM {self.MANIFEST_TABLE}")}
+
+    def _walk(self):
+        """
+        Walk through the directory in a stable order
+
+        :return: The relative path, the path and the stat of the directories and files
+        :rtype: Iterator[Tuple[str, str, os.stat_result]]
+        """
+        root = os.path.abspath(self.directory)
+        yield ".", root, os.stat(root)
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = sorted(name for name in dirnames if name not in IGNORED_DIRECTORIES)
+            relative_dir = os.path.relpath(dirpath, root)
+            for name in dirnames + sorted(filenames):
+                path = os.path.join(dirpath, name)
+                relative = name if relative_dir == "." else f"{relative_dir}/{name}".replace(os.sep, "/")
+                if os.path.islink(path) or not (os.path.isfile(path) or os.path.isdir(path)):
+                    continue
+                yield relative, path, os.stat(path)
+
+    def run(self):
+        """
+        Import the directory
+
+        :return: The number of files added, updated, removed, unchanged and skipped
+        :rtype: Dict[str, int]
+        """
+        self.next_id = self.link.get_next_id()
+        seen = set()
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for relative, path, stat in self._walk():
+                seen.add(relative)
+                if os.path.isdir(path):
+                    # Directories are added in order, once their files before are saved
+                    pending.append((relative, path, stat, None))
+                else:
+                    known = self.manifest.get(relative)
+                    if known and known[1:3] == (stat.st_mtime_ns, stat.st_size):
+                        self.stats["unchanged" if known[0] is not None else "skipped"] += 1
+                        continue
+                    pending.append((relative, path, stat, executor.submit(_hash_file, path, self.encoding)))
+
+                while len(pending) > 2 * self.workers:
+                    self._import(*pending.popleft())
+            while pending:
+                self._import(*pending.popleft())
+
+        self._remove_deleted(seen)
+        self.link.con.commit()
+        return self.stats
+
+    def _get_father_id(self, relative):
+        """
+        Return the id of the node of the directory containing a path
+        """
+        if relative == ".":
+            return 0
+        parent = relative.rpartition("/")[0] or "."
+        return self.manifest[parent][0]
+
+    def _import(self, relative, path, stat, future):
+        """
+        Add or update the node of a file or a directory
+        """
+        known = self.manifest.get(relative)
+        if future is None:
+            if known is None:
+                name = os.path.basename(path) if relative != "." else os.path.basename(os.path.abspath(path))
+                node = CherryTreeNodeBuilder(name, bold=True).icon("directory").get_node()
+                self._add(relative, node, stat, None)
+            return
+
+        digest, is_text = future.result()
+        if known and known[3] == digest:
+            self._set_manifest(relative, known[0], stat, digest)
+            self.stats["unchanged" if known[0] is not None else "skipped"] += 1
+            return
+
+        node = self._build_node(os.path.basename(path), path, is_text)
+        if node is None:
+            if known and known[0] is not None:
+                # A text file which is now a binary one
+                self._delete(known[0])
+            # Recorded so that it is not read again until it changes
+            self._set_manifest(relative, None, stat, digest)
+            self.stats["skipped"] += 1
+            return
+
+        if known and known[0] is not None:
+            node.node_id = known[0]
+            self.link.replace_node(node)
+            self._set_manifest(relative, known[0], stat, digest)
+            self.stats["updated"] += 1
+        else:
+            self._add(relative, node, stat, digest)
+            self.stats["added"] += 1
+
+    def _build_node(self, name, path, is_text):
+        """
+        Build the node of a file, the file is read when the node is saved
+
+        :return: The node, or None if the file is not a text or an image
+        :rtype: class:`_CherryTreeNodeBase`
+        """
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            return CherryTreeNodeBuilder(name).icon("file").image(path).get_node()
+
+        if not is_text:
+            return None
+
+        syntax = guess_syntax(name)
+        if syntax is None:
+            builder = CherryTreeNodeBuilder(name, type="plain")
+        else:
+            builder = CherryTreeNodeBuilder(name, type="code", syntax=syntax)
+        return builder.icon("file").text_from_file(path, encoding=self.encoding).get_node()
+
+    def _add(self, relative, node, stat, digest):
+        """
+        Add a node at the end of the directory containing it
+        """
+        node.node_id = self.next_id
+        self.next_id += 1
+        self.link.append_node(node, self._get_father_id(relative), commit=False)
+        self._set_manifest(relative, node.node_id, stat, digest)
+
+    def _set_manifest(self, relative, node_id, stat, digest):
+        size = stat.st_size if digest else None
+        mtime = stat.st_mtime_ns if digest else None
+        self.manifest[relative] = (node_id, mtime, size, digest)
+        self.link.cursor.execute(f"INSERT OR REPLACE INTO {self.MANIFEST_TABLE} VALUES (?, ?, ?, ?, ?)",
+                                 (relative, node_id, mtime, size, digest))
+
+    def _delete(self, node_id):
+        """
+        Delete a node and its children, and forget the files they held
+
+        :return: The number of files removed
+        """
+        removed = 0
+        deleted = set(self.link.delete_node(node_id, commit=False))
+        for path, values in list(self.manifest.items()):
+            if values[0] in deleted:
+                del self.manifest[path]
+                self.link.cursor.execute(f"DELETE FROM {self.MANIFEST_TABLE} WHERE path=?", (path,))
+                removed += values[3] is not None
+        return removed
+
+    def _remove_deleted(self, seen):
+        """
+        Remove the nodes of the files and directories deleted since the last import
+        """
+        for relative in sorted(set(self.manifest) - seen):
+            if relative not in self.manifest:
+                # Already removed with its directory
+                continue
+            node_id = self.manifest[relative][0]
+            if node_id is None:
+                # A file skipped, without node
+                del self.manifest[relative]
+                self.link.cursor.execute(f"DELETE FROM {self.MANIFEST_TABLE} WHERE path=?", (relative,))
+                continue
+            self.stats["removed"] += self._delete(node_id)
+
+def import_directory(directory, ctb_path, workers=4, encoding="utf-8"):
+    """
+    Import a directory in a document, see :class:`DirectoryImporter`
+
+    :return: The number of files added, updated, removed, unchanged and skipped
+    :rtype: Dict[str, int]
+    """
+    return DirectoryImporter(directory, ctb_path, workers=workers, encoding=encoding).run()
@@ -0,0 +1,22 @@
+"""
+Import a directory tree in a document, importing the same
+directory again only updates the files that changed
+
+Usage:
+
+    python3 -m ctb_writer.directory project/ project.ctb [--workers 4] [--encoding utf-8]
+"""
+import sys
+import argparse
+from . import import_directory
+
+parser = argparse.ArgumentParser(prog="python3 -m ctb_writer.directory",
+                                 description="Import a directory in a cherry tree document")
+parser.add_argument("source", help="The directory to import")
+parser.add_argument("destination", help="The document to create or update")
+parser.add_argument("--workers", type=int, default=4, help="Number of threads reading the files")
+parser.add_argument("--encoding", default="utf-8", help="Encoding of the text files")
+args = parser.parse_args()
+
+stats = import_directory(args.source, args.destination, workers=args.workers, encoding=args.encoding)
+print(", ".join(f"{count} {name}" for name, count in stats.items()), file=sys.stderr)
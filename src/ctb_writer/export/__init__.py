@@ -0,0 +1,376 @@
+"""
+Export a document as html or markdown files
+
+The document is walked from the database one node at a time, and the
+images are extracted to files by a pool of threads. Each node (or each
+subtree) is written in its own file, and a manifest kept in the output
+directory allows to only rewrite what changed since the last export.
+
+Usage:
+
+    >>> from ctb_writer.export import export_document
+    >>> export_document("notes.ctb", "wiki/", format="markdown", per="subtree")
+"""
+import os
+import json
+import base64
+import hashlib
+import sqlite3
+import threading
+from collections import deque
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+from ctb_writer.cherry_tree_link import CherryTreeLink
+from ctb_writer.assets import CherryTreeTable
+from ctb_writer.beautify import iter_runs
+from .renderers import HtmlRenderer, MarkdownRenderer
+
+__all__ = ["export_document", "DocumentExporter"]
+
+RENDERERS = {"html": HtmlRenderer, "markdown": MarkdownRenderer}
+
+MANIFEST = ".ctb_export.json"
+
+class _ImageWriter:
+    """
+    Write the png of images to files from a pool of threads, each
+    thread reading the blobs through its own connection
+    """
+    def __init__(self, database, workers):
+        self.database = os.path.abspath(database)
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.pending = deque()
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def _get_connection(self):
+        con = getattr(self.local, "con", None)
+        if con is None:
+            con = sqlite3.connect(f"file:{quote(self.database)}?mode=ro", uri=True,
+                                  check_same_thread=False)
+            self.local.con = con
+            with self.lock:
+                self.connections.append(con)
+        return con
+
+    def _write(self, rowid, path):
+        con = self._get_connection()
+        with open(path, "wb") as image_file:
+            if not hasattr(con, "blobopen"):
+                # Incremental I/O is only available from python 3.11
+                image_file.write(con.execute("SELECT png FROM image WHERE rowid=?", (rowid,)).fetchone()[0])
+                return
+            with con.blobopen("image", "png", rowid, readonly=True) as blob:
+                while chunk := blob.read(1 << 20):
+                    image_file.write(chunk)
+
+    def submit(self, rowid, path):
+        """
+        Write the png of the image in path, only a window of
+        images are waiting to be written at the same time
+        """
+        self.pending.append(self.executor.submit(self._write, rowid, path))
+        self.count += 1
+        while len(self.pending) > 2 * self.workers:
+            self.pending.popleft().result()
+
+    def close(self):
+        """
+        Wait for all the images to be written
+        """
+        while self.pending:
+            self.pending.popleft().result()
+        self.executor.shutdown()
+        for con in self.connections:
+            con.close()
+
+class _ExportUnit:
+    """
+    A node, or a subtree, being rendered in a temporary file until
+    its digest tells whether the file written last time is still valid
+    """
+    def __init__(self, unit_id, filename, renderer, temp_path):
+        self.unit_id = unit_id
+        self.files = [filename]
+        self.renderer = renderer
+        self.temp_path = temp_path
+        self.digest = hashlib.sha256()
+        self.images = []
+
+class DocumentExporter:
+    """
+    Export a document as html or markdown
+
+    :param ctb_path: The document to export
+    :type ctb_path: str
+
+    :param output_dir: The directory where to write the files
+    :type output_dir: str
+
+    :param format: Either html or markdown
+    :type format: str
+
+    :param per: Write a file per "node", or per "subtree" of the root nodes
+    :type per: str
+
+    :param workers: The number of threads writing the images
+    :type workers: int
+    """
+    def __init__(self, ctb_path, output_dir, format="html", per="node", workers=4):
+        if format not in RENDERERS:
+            raise ValueError(f"Unknown format {format!r}, choose between: 'html' and 'markdown'")
+        if per not in ("node", "subtree"):
+            raise ValueError(f"Unknown value {per!r} for per, choose between: 'node' and 'subtree'")
+        if not os.path.exists(ctb_path):
+            raise FileNotFoundError(f"Cannot find file {ctb_path}")
+
+        self.ctb_path = ctb_path
+        self.link = CherryTreeLink(ctb_path)
+        self.output_dir = output_dir
+        self.renderer_class = RENDERERS[format]
+        self.format = format
+        self.per = per
+        self.workers = workers
+        self.stats = {"written": 0, "skipped": 0, "removed": 0, "images": 0}
+        self._units = {}
+
+    @property
+    def extension(self):
+        return self.renderer_class.extension
+
+    def get_filename(self, node_id):
+        """
+        Return the file in which a node is written
+        """
+        unit_id = self._get_unit_id(node_id) if self.per == "subtree" else node_id
+        return f"node-{unit_id}.{self.extension}"
+
+    def _get_unit_id(self, node_id):
+        """
+        Return the root node of the subtree of a node, the nodes not
+        reached yet are looked up in the database
+        """
+        if node_id not in self._units:
+            row = self.link.con.execute("""WITH RECURSIVE ancestor(node_id, father_id) AS (
+                                               SELECT node_id, father_id FROM children WHERE node_id=?
+                                               UNION ALL
+                                               SELECT children.node_id, children.father_id
+                                               FROM children JOIN ancestor ON children.node_id=ancestor.father_id
+                                           )
+                                           SELECT node_id FROM ancestor WHERE father_id=0""", (node_id,)).fetchone()
+            return row[0] if row else node_id
+        return self._units[node_id]
+
+    def _read_manifest(self):
+        path = os.path.join(self.output_dir, MANIFEST)
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r", encoding="UTF-8") as manifest:
+            content = json.load(manifest)
+        if content.get("format") != self.format or content.get("per") != self.per:
+            return {}
+        return content.get("units", {})
+
+    def _write_manifest(self, units):
+        path = os.path.join(self.output_dir, MANIFEST)
+        with open(path, "w", encoding="UTF-8") as manifest:
+            json.dump({"format": self.format, "per": self.per, "units": units}, manifest)
+
+    def _get_node(self, node_id):
+        """
+        Return the row of a node and its entities
+        """
+        rows = self.link.get_rows("node", node_id)
+        if not rows:
+            return None, []
+        entities = []
+        for table in CherryTreeLink.entity_tables:
+            columns = "*"
+            if table == "image":
+                columns = "offset, justification, anchor, filename, link, time, length(png) AS png_size"
+            entities.extend((table, row) for row in self.link.get_rows(table, node_id, columns))
+        entities.sort(key=lambda entity: entity[1]["offset"])
+        return rows[0], entities
+
+    def _update_digest(self, digest, level, row, entities):
+        """
+        Update the digest with the content of a node, the png of the
+        images are read by chunks
+        """
+        values = [level] + [row[key] for key in row.keys() if key != "rowid"]
+        for table, entity in entities:
+            values.append(table)
+            values.extend(entity[key] for key in entity.keys() if key != "rowid")
+        digest.update(repr(values).encode("UTF-8"))
+        for table, entity in entities:
+            if table == "image":
+                for chunk in self.link.iter_blob("image", "png", entity["rowid"]):
+                    digest.update(chunk)
+
+    def export(self):
+        """
+        Export the document, in a single walk of its tree. Each unit is
+        rendered in a temporary file which only replaces the file of the
+        last export when the digest of the unit changed
+
+        :return: The number of files written, skipped and removed, and of images written
+        :rtype: Dict[str, int]
+        """
+        os.makedirs(os.path.join(self.output_dir, "images"), exist_ok=True)
+        previous = self._read_manifest()
+        units = {}
+        images = _ImageWriter(self.ctb_path, self.workers)
+        index = self.renderer_class(self, open(os.path.join(self.output_dir, f"index.{self.extension}"),
+                                                "w", encoding="UTF-8"))
+        index.begin("Index")
+
+        unit = None
+        try:
+            for node_id, father_id, _, level in self.link.iter_tree():
+                row, entities = self._get_node(node_id)
+                if row is None:
+                    continue
+                if unit is None or self.per == "node" or level == 0:
+                    self._end_unit(unit, previous, units, images)
+                    unit = self._begin_unit(node_id, row)
+                self._units[node_id] = unit.unit_id
+                index.index_entry(level, row["name"], self.get_filename(node_id), node_id)
+
+                self._update_digest(unit.digest, level, row, entities)
+                depth = level if self.per == "subtree" else 0
+                unit.renderer.heading(depth + 1, row["name"], node_id)
+                self._render_node(unit.renderer, row, entities, unit)
+
+            self._end_unit(unit, previous, units, images)
+            unit = None
+        finally:
+            index.end()
+            images.close()
+            if unit is not None:
+                unit.renderer.end()
+                os.remove(unit.temp_path)
+
+        self.stats["images"] = images.count
+        self._remove_stale(previous, units)
+        self._write_manifest(units)
+        return self.stats
+
+    def _begin_unit(self, node_id, row):
+        """
+        Start rendering a unit in a temporary file
+        """
+        self._units[node_id] = node_id
+        filename = self.get_filename(node_id)
+        temp_path = os.path.join(self.output_dir, f"{filename}.tmp")
+        renderer = self.renderer_class(self, open(temp_path, "w", encoding="UTF-8"))
+        renderer.begin(row["name"])
+        return _ExportUnit(node_id, filename, renderer, temp_path)
+
+    def _end_unit(self, unit, previous, units, images):
+        """
+        Keep the files of a unit unchanged since the last export, or
+        replace them with the file rendered and write its images
+        """
+        if unit is None:
+            return
+        unit.renderer.end()
+        unit_id = str(unit.unit_id)
+        digest = unit.digest.hexdigest()
+        last = previous.get(unit_id, {})
+        if last.get("digest") == digest and\
+           all(os.path.exists(os.path.join(self.output_dir, name)) for name in last["files"]):
+            os.remove(unit.temp_path)
+            units[unit_id] = last
+            self.stats["skipped"] += 1
+            return
+
+        os.replace(unit.temp_path, os.path.join(self.output_dir, unit.files[0]))
+        for rowid, name in unit.images:
+            images.submit(rowid, os.path.join(self.output_dir, name))
+        units[unit_id] = {"digest": digest, "files": unit.files}
+        self.stats["written"] += 1
+
+    def _render_node(self, renderer, row, entities, unit):
+        """
+        Render the content of a node, with its entities at their offset
+        """
+        if not row["is_richtxt"] & 0x1:
+            renderer.code(row["txt"] or "", row["syntax"])
+            for table, entity in entities:
+                self._render_entity(renderer, row, table, entity, unit)
+            return
+
+        pending = deque(entities)
+        position = 0
+        for attributes, text in iter_runs(row["txt"]):
+            while pending and pending[0][1]["offset"] <= position + len(text):
+                cut = max(pending[0][1]["offset"] - position, 0)
+                renderer.run(attributes, text[:cut])
+                text = text[cut:]
+                position += cut
+                table, entity = pending.popleft()
+                self._render_entity(renderer, row, table, entity, unit)
+                position += 1
+            renderer.run(attributes, text)
+            position += len(text)
+
+        for table, entity in pending:
+            self._render_entity(renderer, row, table, entity, unit)
+
+    def _render_entity(self, renderer, row, table, entity, unit):
+        """
+        Render a codebox, a table or an image
+        """
+        if table == "codebox":
+            renderer.codebox(entity["txt"] or "", entity["syntax"])
+
+        elif table == "grid":
+            renderer.table(list(CherryTreeTable.from_xml(entity["txt"], position=0).iter_rows()))
+
+        elif entity["png_size"]:
+            name = f"images/{row['node_id']}_{entity['offset']}.png"
+            # Written once the unit is known to have changed
+            unit.images.append((entity["rowid"], name))
+            unit.files.append(name)
+            renderer.image(name)
+
+    def _remove_stale(self, previous, units):
+        """
+        Remove the files written by the last export that are not used anymore
+        """
+        used = {name for unit in units.values() for name in unit["files"]}
+        for unit in previous.values():
+            for name in unit["files"]:
+                path = os.path.join(self.output_dir, name)
+                if name not in used and os.path.exists(path):
+                    os.remove(path)
+                    self.stats["removed"] += 1
+
+    def get_link(self, link):
+        """
+        Return the target of a link of a rich text
+
+        Cherry tree links are "webs URL", "file BASE64", "fold BASE64" or "node ID [ANCHOR]"
+        """
+        kind, _, value = link.partition(" ")
+        if kind == "webs":
+            return value
+        if kind in ("file", "fold"):
+            return base64.b64decode(value).decode("UTF-8", errors="replace")
+        if kind == "node":
+            node_id = value.split(" ")[0]
+            if node_id.isdigit():
+                return f"{self.get_filename(int(node_id))}#node-{node_id}"
+        return value
+
+def export_document(ctb_path, output_dir, format="html", per="node", workers=4):
+    """
+    Export a document as html or markdown files, see :class:`DocumentExporter`
+
+    :return: The number of files written, skipped and removed, and of images written
+    :rtype: Dict[str, int]
+    """
+    return DocumentExporter(ctb_path, output_dir, format=format, per=per, workers=workers).export()
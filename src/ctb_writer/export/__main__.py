@@ -0,0 +1,25 @@
+"""
+Export a document as html or markdown files
+
+Usage:
+
+    python3 -m ctb_writer.export notes.ctb output_dir [--format markdown] [--per subtree] [--workers 4]
+"""
+import sys
+import argparse
+from . import export_document
+
+parser = argparse.ArgumentParser(prog="python3 -m ctb_writer.export",
+                                 description="Export a cherry tree document as html or markdown")
+parser.add_argument("source", help="The document to export")
+parser.add_argument("destination", help="The directory where to write the files")
+parser.add_argument("--format", choices=["html", "markdown"], default="html")
+parser.add_argument("--per", choices=["node", "subtree"], default="node",
+                    help="Write a file per node or per subtree of the root nodes")
+parser.add_argument("--workers", type=int, default=4, help="Number of threads writing the images")
+args = parser.parse_args()
+
+stats = export_document(args.source, args.destination, format=args.format,
+                        per=args.per, workers=args.workers)
+print(f"{stats['written']} files written, {stats['skipped']} unchanged, "
+      f"{stats['removed']} removed, {stats['images']} images", file=sys.stderr)
@@ -0,0 +1,201 @@
+"""
+Renderers writing the content of nodes as html or markdown
+"""
+import re
+from html import escape
+
+MARKDOWN_SPECIALS = re.compile(r"([\\`*_\[\]~<>#|])")
+
+class _Renderer:
+    """
+    Write the content of nodes in an open file
+
+    :param exporter: The exporter, used to resolve the links
+    :type exporter: DocumentExporter
+
+    :param output: The file to write to, closed by :meth:`end`
+    :type output: TextIO
+    """
+    extension = None
+
+    def __init__(self, exporter, output):
+        self.exporter = exporter
+        self.output = output
+
+    def write(self, text):
+        self.output.write(text)
+
+    def begin(self, title):
+        pass
+
+    def end(self):
+        self.output.close()
+
+class HtmlRenderer(_Renderer):
+    """
+    Write nodes as html
+    """
+    extension = "html"
+    SCALES = {"h1": "2em", "h2": "1.5em", "h3": "1.25em", "h4": "1.1em",
+              "h5": "1em", "h6": "0.9em", "small": "0.8em", "sup": "0.7em", "sub": "0.7em"}
+
+    def begin(self, title):
+        self.write(f"<!DOCTYPE html>\n<html>\n<head>\n<meta charset=\"utf-8\">\n"
+                   f"<title>{escape(title)}</title>\n</head>\n<body>\n")
+
+    def end(self):
+        self.write("</body>\n</html>\n")
+        super().end()
+
+    def heading(self, level, name, node_id):
+        level = min(level, 6)
+        self.write(f"<h{level} id=\"node-{node_id}\">{escape(name)}</h{level}>\n")
+
+    def index_entry(self, level, name, filename, node_id):
+        self.write(f"<div style=\"margin-left: {2 * level}em\">"
+                   f"<a href=\"{escape(filename)}#node-{node_id}\">{escape(name)}</a></div>\n")
+
+    def run(self, attrib, text):
+        if not text:
+            return
+        html = escape(text).replace("\n", "<br>\n")
+        style = []
+        if attrib.get("weight") == "heavy":
+            style.append("font-weight: bold")
+        if attrib.get("style") == "italic":
+            style.append("font-style: italic")
+        decorations = []
+        if "underline" in attrib:
+            decorations.append("underline")
+        if attrib.get("strikethrough") == "true":
+            decorations.append("line-through")
+        if decorations:
+            style.append(f"text-decoration: {' '.join(decorations)}")
+        if "foreground" in attrib:
+            style.append(f"color: {attrib['foreground']}")
+        if "background" in attrib:
+            style.append(f"background-color: {attrib['background']}")
+        if attrib.get("scale") in self.SCALES:
+            style.append(f"font-size: {self.SCALES[attrib['scale']]}")
+        if attrib.get("family") == "monospace":
+            style.append("font-family: monospace")
+
+        if style:
+            html = f"<span style=\"{escape('; '.join(style))}\">{html}</span>"
+        if "link" in attrib:
+            html = f"<a href=\"{escape(self.exporter.get_link(attrib['link']))}\">{html}</a>"
+        self.write(html)
+
+    def code(self, text, syntax):
+        self.codebox(text, syntax)
+
+    def codebox(self, text, syntax):
+        language = f" class=\"language-{escape(syntax)}\"" if syntax and syntax != "plain-text" else ""
+        self.write(f"<pre><code{language}>{escape(text)}</code></pre>\n")
+
+    def table(self, rows):
+        if not rows:
+            return
+        self.write("<table>\n<thead><tr>")
+        self.write("".join(f"<th>{escape(cell)}</th>" for cell in rows[-1]))
+        self.write("</tr></thead>\n<tbody>\n")
+        for row in rows[:-1]:
+            self.write("<tr>" + "".join(f"<td>{escape(cell)}</td>" for cell in row) + "</tr>\n")
+        self.write("</tbody>\n</table>\n")
+
+    def image(self, src):
+        self.write(f"<img src=\"{escape(src)}\">")
+
+class MarkdownRenderer(_Renderer):
+    """
+    Write nodes as markdown
+    """
+    extension = "md"
+    at_line_start = True
+
+    def write(self, text):
+        if text:
+            self.output.write(text)
+            self.at_line_start = text.endswith("\n")
+
+    def _block(self, text):
+        """
+        Write a block on its own lines
+        """
+        if not self.at_line_start:
+            self.write("\n")
+        self.write(text)
+
+    @staticmethod
+    def _escape_name(name):
+        """
+        Escape the name of a node, written on a single line
+        """
+        return MARKDOWN_SPECIALS.sub(r"\\\1", " ".join((name or "").splitlines()))
+
+    def heading(self, level, name, node_id):
+        self._block(f"\n<a id=\"node-{node_id}\"></a>\n{'#' * min(level, 6)} {self._escape_name(name)}\n\n")
+
+    def index_entry(self, level, name, filename, node_id):
+        name = self._escape_name(name)
+        self.write(f"{'  ' * level}- [{name}]({filename}#node-{node_id})\n")
+
+    def run(self, attrib, text):
+        if not text:
+            return
+        if attrib.get("family") == "monospace":
+            self.write(self._wrap(text, "`", escape_text=False))
+            return
+        markers = ""
+        if attrib.get("weight") == "heavy":
+            markers += "**"
+        if attrib.get("style") == "italic":
+            markers += "*"
+        if attrib.get("strikethrough") == "true":
+            markers += "~~"
+        markdown = self._wrap(text, markers)
+        if "link" in attrib:
+            markdown = f"[{markdown}]({self.exporter.get_link(attrib['link'])})"
+        self.write(markdown)
+
+    @staticmethod
+    def _wrap(text, markers, escape_text=True):
+        """
+        Wrap each line of the text in the markers, as markdown
+        emphasis cannot span several lines
+        """
+        lines = []
+        for line in text.split("\n"):
+            if escape_text:
+                line = MARKDOWN_SPECIALS.sub(r"\\\1", line)
+            if line.strip() and markers:
+                # Emphasis cannot start or end with a space
+                stripped = line.strip()
+                start = line[:len(line) - len(line.lstrip())]
+                end = line[len(line.rstrip()):]
+                line = f"{start}{markers}{stripped}{markers[::-1]}{end}"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def code(self, text, syntax):
+        self.codebox(text, syntax)
+
+    def codebox(self, text, syntax):
+        fence = "```"
+        while fence in text:
+            fence += "`"
+        language = syntax if syntax and syntax != "plain-text" else ""
+        newline = "" if text.endswith("\n") else "\n"
+        self._block(f"{fence}{language}\n{text}{newline}{fence}\n")
+
+    def table(self, rows):
+        if not rows:
+            return
+        def line(row):
+            return "| " + " | ".join(cell.replace("|", "\\|").replace("\n", " ") for cell in row) + " |\n"
+        self._block(line(rows[-1]) + "|" + "---|" * len(rows[-1]) + "\n")
+        for row in rows[:-1]:
+            self.write(line(row))
+
+    def image(self, src):
+        self.write(f"![]({src})")
@@ -0,0 +1,283 @@
+"""
+Read markdown into cherry tree nodes, line by line
+
+ - Headings become the nodes of the tree, following their level
+ - Emphasis, inline code and links become rich text runs
+ - Fenced blocks become codeboxes
+ - Pipe tables become tables (the header being moved at the end)
+ - Images become images, only read when the document is saved
+
+Usage:
+
+    >>> from ctb_writer import CherryTree
+    >>> from ctb_writer.markdown import read_markdown
+    >>> document = CherryTree()
+    >>> document.add_child(read_markdown("notes.md"))
+"""
+import os
+import re
+import base64
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+from types import MappingProxyType
+from ctb_writer.cherry_tree_node import CherryTreeNode
+
+__all__ = ["MarkdownReader", "read_markdown"]
+
+HEADING_RE = re.compile(r"^(#{1,6})\s+(.*?)(?:\s+#+)?\s*$")
+FENCE_RE = re.compile(r"^\s*(`{3,}|~{3,})\s*([\w+#.-]*)")
+TABLE_SEPARATOR_RE = re.compile(r"^\s*\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$")
+URL_RE = re.compile(r"^[a-z][a-z0-9+.-]*:", re.I)
+
+INLINE_RE = re.compile(r"""
+    (?P<image>!\[(?P<image_alt>[^\]]*)\]\((?P<image_src>[^)\s]+)(?:\s+"[^"]*")?\))
+  | (?P<link>\[(?P<link_text>[^\]]+)\]\((?P<link_href>[^)\s]+)(?:\s+"[^"]*")?\))
+  | (?P<code>`(?P<code_text>[^`]+)`)
+  | (?P<bold>\*\*(?P<bold_text>.+?)\*\*|(?<!\w)__(?P<bold_text2>.+?)__(?!\w))
+  | (?P<strike>~~(?P<strike_text>.+?)~~)
+  | (?P<italic>\*(?P<italic_text>[^\s*](?:.*?[^\s*])?)\*|(?<!\w)_(?P<italic_text2>[^\s_](?:.*?[^\s_])?)_(?!\w))
+""", re.X)
+
+# Syntax of the fenced blocks without language
+DEFAULT_SYNTAX = "plain-text"
+
+@lru_cache(maxsize=64)
+def _get_attributes(bold=False, italic=False, strike=False, code=False, link=None):
+    """
+    Return the xml attributes of a run
+    """
+    attributes = {}
+    if bold:
+        attributes["weight"] = "heavy"
+    if italic:
+        attributes["style"] = "italic"
+    if strike:
+        attributes["strikethrough"] = "true"
+    if code:
+        attributes["family"] = "monospace"
+    if link:
+        attributes["link"] = link
+    return MappingProxyType(attributes)
+
+def _split_row(line):
+    """
+    Split a line of a pipe table into its cells
+    """
+    line = line.strip()
+    if line.startswith("|"):
+        line = line[1:]
+    if line.endswith("|") and not line.endswith("\\|"):
+        line = line[:-1]
+    cells = re.split(r"(?<!\\)\|", line)
+    return [cell.strip().replace("\\|", "|") for cell in cells]
+
+class MarkdownReader:
+    """
+    Build nodes from markdown lines, the lines are read one by one
+    and the runs and entities are added directly to the nodes
+
+    :param name: The name of the root node, holding the text before the first heading
+    :type name: str
+
+    :param base_dir: The directory from which the images are resolved
+    :type base_dir: str
+    """
+    def __init__(self, name, base_dir="."):
+        self.base_dir = base_dir
+        self.root = CherryTreeNode(name)
+        # Stack of (level, node) of the headings open
+        self.headings = [(0, self.root)]
+        self.lengths = {}
+        self.fence = None
+        self.code_lines = []
+        self.syntax = DEFAULT_SYNTAX
+        self.table_lines = []
+
+    @property
+    def node(self):
+        """The node currently filled"""
+        return self.headings[-1][1]
+
+    def feed(self, line):
+        """
+        Read a line of markdown
+        """
+        line = line.rstrip("\r\n")
+
+        if self.fence is not None:
+            closing = line.strip()
+            # A closing fence has nothing after its characters, "```bash" is a line of the block
+            if closing.startswith(self.fence) and not closing.strip(self.fence[0]):
+                self._end_code()
+            else:
+                self.code_lines.append(line + "\n")
+            return
+
+        if self.table_lines:
+            if "|" in line and line.strip():
+                self.table_lines.append(line)
+                return
+            self._end_table()
+
+        fence = FENCE_RE.match(line)
+        if fence:
+            self.fence = fence.group(1)
+            self.syntax = fence.group(2).lower() or DEFAULT_SYNTAX
+            return
+
+        heading = HEADING_RE.match(line)
+        if heading:
+            self._start_node(len(heading.group(1)), heading.group(2))
+            return
+
+        if line.lstrip().startswith("|"):
+            self.table_lines.append(line)
+            return
+
+        self._add_inline(line + "\n")
+
+    def close(self):
+        """
+        End the blocks still open and return the root node
+
+        :rtype: class:`CherryTreeNode`
+        """
+        if self.fence is not None:
+            self._end_code()
+        if self.table_lines:
+            self._end_table()
+        return self.root
+
+    def _start_node(self, level, name):
+        """
+        Start the node of a heading, as a child of the last heading of lower level
+        """
+        while self.headings[-1][0] >= level:
+            self.headings.pop()
+        node = CherryTreeNode(name)
+        self.node.append(node)
+        self.headings.append((level, node))
+
+    def _get_position(self, length=0):
+        """
+        Return the current length of the text of the node and increase it
+        """
+        node_id = id(self.node)
+        position = self.lengths.get(node_id, 0)
+        self.lengths[node_id] = position + length
+        return position
+
+    def _add_run(self, text, **style):
+        """
+        Add a run of text to the current node
+        """
+        if not text:
+            return
+        element = ET.SubElement(self.node.xml, "rich_text", **_get_attributes(**style))
+        element.text = text
+        self._get_position(len(text))
+
+    def _add_inline(self, text, **style):
+        """
+        Add a text containing inline markdown
+        """
+        position = 0
+        for match in INLINE_RE.finditer(text):
+            self._add_run(text[position:match.start()], **style)
+            position = match.end()
+            kind = match.lastgroup
+
+            if match.group("image"):
+                self._add_image(match.group("image_src"), match.group("image_alt"))
+
+            elif match.group("link"):
+                self._add_run(match.group("link_text"), **dict(style, link=self._get_link(match.group("link_href"))))
+
+            elif match.group("code"):
+                self._add_run(match.group("code_text"), **dict(style, code=True))
+
+            elif match.group("bold"):
+                inner = match.group("bold_text") or match.group("bold_text2")
+                self._add_inline(inner, **dict(style, bold=True))
+
+            elif match.group("strike"):
+                self._add_inline(match.group("strike_text"), **dict(style, strike=True))
+
+            else:
+                inner = match.group("italic_text") or match.group("italic_text2")
+                self._add_inline(inner, **dict(style, italic=True))
+
+        self._add_run(text[position:], **style)
+
+    @staticmethod
+    def _get_link(href):
+        """
+        Return the value of the link attribute of a rich text
+        """
+        if URL_RE.match(href):
+            return f"webs {href}"
+        return "file " + base64.b64encode(href.encode("UTF-8")).decode("ascii")
+
+    def _add_image(self, src, alt):
+        """
+        Add an image, the images which are not local files, or empty ones,
+        are kept as links
+        """
+        path = os.path.join(self.base_dir, src)
+        if URL_RE.match(src) or not os.path.isfile(path) or not os.path.getsize(path):
+            self._add_run(alt or src, link=self._get_link(src))
+            return
+        self.node.add_image(path, position=self._get_position(1))
+
+    def _end_code(self):
+        """
+        Add the fenced block read as a codebox
+        """
+        self.node.add_codebox("".join(self.code_lines), self.syntax, position=self._get_position(1))
+        self.fence = None
+        self.code_lines = []
+        self.syntax = DEFAULT_SYNTAX
+
+    def _end_table(self):
+        """
+        Add the pipe table read, in cherry tree the header is the last row
+        """
+        lines = self.table_lines
+        self.table_lines = []
+        if len(lines) < 2 or not TABLE_SEPARATOR_RE.match(lines[1]):
+            for line in lines:
+                self._add_inline(line + "\n")
+            return
+
+        header = _split_row(lines[0])
+        rows = [_split_row(line) for line in lines[2:]]
+        rows.append(header)
+        self.node.add_table(rows, position=self._get_position(1))
+
+def read_markdown(source, name=None, encoding="utf-8"):
+    """
+    Read a markdown file or lines into nodes
+
+    :param source: The path of the markdown file, or an iterable of lines
+    :type source: Union[str, Iterable[str]]
+
+    :param name: The name of the root node, by default the name of the file
+    :type name: str
+
+    :return: The root node, whose children are the headings of level 1
+    :rtype: class:`CherryTreeNode`
+    """
+    if isinstance(source, (str, os.PathLike)):
+        path = os.fspath(source)
+        if name is None:
+            name = os.path.splitext(os.path.basename(path))[0]
+        reader = MarkdownReader(name, base_dir=os.path.dirname(os.path.abspath(path)))
+        with open(path, "r", encoding=encoding) as lines:
+            for line in lines:
+                reader.feed(line)
+        return reader.close()
+
+    reader = MarkdownReader(name or "Markdown")
+    for line in source:
+        reader.feed(line)
+    return reader.close()
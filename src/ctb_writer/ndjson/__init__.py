@@ -0,0 +1,292 @@
+"""
+Export a document as newline-delimited JSON and import it back
+
+Each line holds one node, in depth first order:
+
+    {"node_id": 2, "father_id": 1, "sequence": 1, "level": 1, "name": "Node",
+     "syntax": "custom-colors", "tags": "cve web", "is_ro": 0, "is_richtxt": 1,
+     "ts_creation": 0, "ts_lastsave": 0,
+     "text": "plain text of the node",
+     "runs": [[{"weight": "heavy"}, "bold text"], ...],
+     "entities": [{"type": "codebox", "offset": 3, ...}, ...]}
+
+The runs are only present for rich text nodes, the text of other nodes is
+in "text". The images are either given in base64 in "png", or written in a
+directory and referenced by "png_file".
+
+Both directions go through the database one node at a time, so the memory
+used does not depend on the size of the document.
+"""
+import os
+import json
+import base64
+import hashlib
+import xml.etree.ElementTree as ET
+from ctb_writer.cherry_tree_link import CherryTreeLink
+from ctb_writer.assets.image_source import FileImageSource
+from ctb_writer.beautify import iter_runs
+
+__all__ = ["export_ndjson", "import_ndjson", "iter_records"]
+
+# Columns of the node table exported as is
+NODE_COLUMNS = ("name", "syntax", "tags", "is_ro", "is_richtxt", "ts_creation", "ts_lastsave")
+
+# Columns of the entities exported as is
+ENTITY_COLUMNS = {
+    "codebox": ("offset", "justification", "txt", "syntax", "width", "height",
+                "is_width_pix", "do_highl_bra", "do_show_linenum"),
+    "grid": ("offset", "justification", "txt", "col_min", "col_max"),
+    "image": ("offset", "justification", "anchor", "filename", "link", "time"),
+}
+
+ENTITY_TYPES = {"codebox": "codebox", "grid": "table", "image": "image"}
+
+def _get_runs(txt):
+    """
+    Return the runs [attributes, text] of a rich text
+    """
+    return [[attributes, text] for attributes, text in iter_runs(txt)]
+
+def _save_png(link, rowid, images_dir):
+    """
+    Write the png of an image in images_dir, named after its sha256
+
+    :return: The name of the file written
+    """
+    digest = hashlib.sha256()
+    for chunk in link.iter_blob("image", "png", rowid):
+        digest.update(chunk)
+    filename = f"{digest.hexdigest()}.png"
+    path = os.path.join(images_dir, filename)
+    if not os.path.exists(path):
+        with open(path, "wb") as png_file:
+            for chunk in link.iter_blob("image", "png", rowid):
+                png_file.write(chunk)
+    return filename
+
+def _get_entities(link, node_id, images_dir=None):
+    """
+    Return the entities of a node ordered by offset
+    """
+    entities = []
+    for table in CherryTreeLink.entity_tables:
+        columns = "*"
+        if table == "image":
+            columns = ", ".join(ENTITY_COLUMNS["image"]) + ", length(png) AS png_size"
+            if images_dir is None:
+                columns += ", png"
+
+        for row in link.get_rows(table, node_id, columns):
+            entity = {"type": ENTITY_TYPES[table]}
+            for column in ENTITY_COLUMNS[table]:
+                value = row[column]
+                entity[column] = value.decode("UTF-8") if isinstance(value, bytes) else value
+
+            if table == "image" and row["png_size"] is not None:
+                if images_dir is None:
+                    entity["png"] = base64.b64encode(row["png"]).decode("ascii")
+                else:
+                    entity["png_file"] = _save_png(link, row["rowid"], images_dir)
+            entities.append(entity)
+    return sorted(entities, key=lambda entity: entity["offset"])
+
+def iter_records(link, images_dir=None):
+    """
+    Yield the record of each node of a document, in depth first order
+
+    :param link: The link to the document
+    :type link: class:`CherryTreeLink`
+
+    :param images_dir: The directory where to write images, by default
+                       they are included in base64 in the records
+    :type images_dir: str
+    """
+    for node_id, father_id, sequence, level in link.iter_tree():
+        rows = link.get_rows("node", node_id)
+        if not rows:
+            continue
+        row = rows[0]
+        record = {"node_id": node_id, "father_id": father_id,
+                  "sequence": sequence, "level": level}
+        record.update((column, row[column]) for column in NODE_COLUMNS)
+
+        if row["is_richtxt"] & 0x1:
+            runs = _get_runs(row["txt"])
+            record["text"] = "".join(text for _, text in runs)
+            record["runs"] = runs
+        else:
+            record["text"] = row["txt"]
+
+        record["entities"] = _get_entities(link, node_id, images_dir)
+        yield record
+
+def export_ndjson(ctb_path, output, images_dir=None):
+    """
+    Export a document as newline-delimited JSON
+
+    :param ctb_path: The document to export
+    :type ctb_path: str
+
+    :param output: The path of the file to write, or a file opened in text mode
+    :type output: Union[str, TextIO]
+
+    :param images_dir: The directory where to write images, by default
+                       they are included in base64 in the records
+    :type images_dir: str
+
+    :return: The number of nodes exported
+    """
+    if not os.path.exists(ctb_path):
+        raise FileNotFoundError(f"Cannot find file {ctb_path}")
+
+    if images_dir is not None:
+        os.makedirs(images_dir, exist_ok=True)
+
+    with CherryTreeLink(ctb_path) as link:
+        if not hasattr(output, "write"):
+            with open(output, "w", encoding="UTF-8") as output_file:
+                return _write_records(link, output_file, images_dir)
+        return _write_records(link, output, images_dir)
+
+def _write_records(link, output, images_dir):
+    count = 0
+    for record in iter_records(link, images_dir):
+        output.write(json.dumps(record, ensure_ascii=False))
+        output.write("\n")
+        count += 1
+    return count
+
+def _build_rich_text(runs):
+    """
+    Build the xml of a rich text node from its runs
+    """
+    xml = ET.Element("node")
+    for attributes, text in runs:
+        element = ET.SubElement(xml, "rich_text", attributes)
+        element.text = text
+    return ET.tostring(xml, encoding="UTF-8", xml_declaration=True).decode("UTF-8")
+
+class _NdjsonImporter:
+    """
+    Write the records of a newline-delimited JSON in a new document,
+    the rows are inserted by batches
+    """
+    def __init__(self, link, images_dir, batch_size):
+        self.link = link
+        self.images_dir = images_dir
+        self.batch_size = batch_size
+        self.batches = {"node": [], "children": [], "codebox": [], "grid": []}
+        self.pending = 0
+
+    def add(self, record):
+        """
+        Add the record of a node
+        """
+        node_id = record["node_id"]
+        entities = record.get("entities", [])
+        types = {entity["type"] for entity in entities}
+
+        if record["is_richtxt"] & 0x1:
+            txt = _build_rich_text(record.get("runs", []))
+        else:
+            txt = record.get("text", "")
+
+        self.batches["node"].append(
+            (node_id, record["name"], txt, record["syntax"], record.get("tags"),
+             record.get("is_ro", 0), record["is_richtxt"], int("codebox" in types),
+             int("table" in types), int("image" in types), 0,
+             record.get("ts_creation", 0), record.get("ts_lastsave", 0)))
+        self.batches["children"].append((node_id, record.get("father_id", 0),
+                                         record.get("sequence", 0), 0))
+
+        for entity in entities:
+            if entity["type"] == "image":
+                self._add_image(node_id, entity)
+            else:
+                table = "codebox" if entity["type"] == "codebox" else "grid"
+                self.batches[table].append((node_id,) + tuple(entity.get(column)
+                                                              for column in ENTITY_COLUMNS[table]))
+
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def _add_image(self, node_id, entity):
+        """
+        Insert an image, a png given as a file is copied by chunks
+        """
+        values = (node_id,) + tuple(entity.get(column) for column in ENTITY_COLUMNS["image"])
+        png = None
+        source = None
+        if "png" in entity:
+            png = base64.b64decode(entity["png"])
+        elif "png_file" in entity:
+            source = FileImageSource(os.path.join(self.images_dir, entity["png_file"]))
+
+        cursor = self.link.cursor
+        cursor.execute("""INSERT INTO image
+                          (node_id, offset, justification, anchor, filename, link, time, png)
+                          VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", values + (png,))
+        if source is not None:
+            self.link.stream_blob("image", "png", cursor.lastrowid, source.size, source.iter_chunks())
+
+    def flush(self):
+        """
+        Insert the rows pending
+        """
+        cursor = self.link.cursor
+        cursor.executemany("""INSERT INTO node
+                              (node_id, name, txt, syntax, tags, is_ro, is_richtxt, has_codebox,
+                               has_table, has_image, level, ts_creation, ts_lastsave)
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", self.batches["node"])
+        cursor.executemany("""INSERT INTO children (node_id, father_id, sequence, master_id)
+                              VALUES (?, ?, ?, ?)""", self.batches["children"])
+        cursor.executemany("INSERT INTO codebox VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           self.batches["codebox"])
+        cursor.executemany("INSERT INTO grid VALUES (?, ?, ?, ?, ?, ?)", self.batches["grid"])
+        self.link.con.commit()
+        for batch in self.batches.values():
+            batch.clear()
+        self.pending = 0
+
+def import_ndjson(source, ctb_path, images_dir=None, batch_size=500):
+    """
+    Import a newline-delimited JSON export in a new document
+
+    :param source: The path of the file to read, or an iterable of lines
+    :type source: Union[str, Iterable[str]]
+
+    :param ctb_path: The document to create
+    :type ctb_path: str
+
+    :param images_dir: The directory of the images referenced by png_file,
+                       by default the directory of the source file
+    :type images_dir: str
+
+    :param batch_size: The number of nodes inserted at once
+    :type batch_size: int
+
+    :raises ValueError: If the document already exists
+    :return: The number of nodes imported
+    """
+    if os.path.exists(ctb_path):
+        raise ValueError(f"File {ctb_path} already exists, cannot overwrite !")
+
+    if isinstance(source, (str, os.PathLike)):
+        if images_dir is None:
+            images_dir = os.path.dirname(os.path.abspath(source))
+        with open(source, "r", encoding="UTF-8") as lines:
+            return _import_lines(lines, ctb_path, images_dir, batch_size)
+    return _import_lines(source, ctb_path, images_dir or ".", batch_size)
+
+def _import_lines(lines, ctb_path, images_dir, batch_size):
+    with CherryTreeLink(ctb_path) as link:
+        link.init()
+        importer = _NdjsonImporter(link, images_dir, batch_size)
+        count = 0
+        for line in lines:
+            if line.strip():
+                importer.add(json.loads(line))
+                count += 1
+        importer.flush()
+    return count
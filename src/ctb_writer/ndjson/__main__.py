@@ -0,0 +1,26 @@
+"""
+Export a document as newline-delimited JSON or import it back
+
+Usage:
+
+    python3 -m ctb_writer.ndjson export notes.ctb notes.ndjson [--images images_dir]
+    python3 -m ctb_writer.ndjson import notes.ndjson new_notes.ctb [--images images_dir]
+"""
+import sys
+import argparse
+from . import export_ndjson, import_ndjson
+
+parser = argparse.ArgumentParser(prog="python3 -m ctb_writer.ndjson",
+                                 description="Convert a cherry tree document from/to ndjson")
+parser.add_argument("action", choices=["export", "import"])
+parser.add_argument("source", help="The document to export or the ndjson to import")
+parser.add_argument("destination", help="The ndjson to write ('-' for stdout) or the document to create")
+parser.add_argument("--images", default=None, help="Directory of the images, base64 is used otherwise")
+args = parser.parse_args()
+
+if args.action == "export":
+    output = sys.stdout if args.destination == "-" else args.destination
+    count = export_ndjson(args.source, output, images_dir=args.images)
+else:
+    count = import_ndjson(args.source, args.destination, images_dir=args.images)
+print(f"{count} nodes {args.action}ed", file=sys.stderr)
@@ -3,8 +3,9 @@ Class that allow to build a node given the parameters wanted
 """
 from os.path import expanduser
 from .icons import get_icon
-from .beautify import parse
+from .beautify import parse, iter_richtext, MarkupTemplate
 from .cherry_tree_node import CherryTreeNode, CherryTreeCodeNode, CherryTreePlainNode
+from .assets import CherryTreeTextFile
 import xml.etree.ElementTree as ET
 
 class CherryTreeNodeBuilder:
@@ -53,12 +54,36 @@ class CherryTreeNodeBuilder:
             self.node.add_text(text)
         return self
 
-    def texts(self, texts):
+    def text_from_file(self, filename, encoding="utf-8"):
+        """
+        Add the content of a file to a plain or code node, the file
+        is only read when the document is saved
+
+        :param filename: The path of the file
+        :type filename: str
+
+        :param encoding: The encoding of the file
+        :type encoding: str
+        """
+        if self.node.is_richtext:
+            raise ValueError("Cannot add a file to a richtext node, use codebox_from_file instead")
+        self.node.add_text_file(filename, encoding=encoding)
+        return self
+
+    def texts(self, texts, **values):
         """
         Add multiple texts to a node
         If texts is a string, it will be automatically parsed
+        If texts is a compiled template, it is rendered with the values given
         """
         if self.node.is_richtext:
+            if isinstance(texts, MarkupTemplate):
+                self.node.add_rich_elements(texts.render(**values))
+                return self
+
+            if values:
+                raise ValueError("Values can only be given with a template from compile_markup")
+
             if isinstance(texts, str):
                 texts = parse(texts)
             self.node.add_texts(texts)
@@ -66,6 +91,21 @@ class CherryTreeNodeBuilder:
             raise ValueError("Cannot add multiple texts to a node which is not richtext")
         return self
 
+    def texts_from_file(self, filename, encoding="utf-8"):
+        """
+        Add the markup text of a file to a node, the file is read and
+        parsed line by line
+
+        :param filename: The path of the file containing the markup text
+        :type filename: str
+        """
+        if not self.node.is_richtext:
+            raise ValueError("Cannot add multiple texts to a node which is not richtext")
+
+        with open(expanduser(filename), "r", encoding=encoding, newline="") as markup_file:
+            self.node.add_rich_elements(iter_richtext(markup_file))
+        return self
+
     def image(self, filename, position=-1, justification="left"):
         """
         Insert an image in the node, at the given position, default position is
@@ -93,9 +133,28 @@ class CherryTreeNodeBuilder:
         self.node.add_codebox(text, syntax.lower(), **kwargs)
         return self
 
+    def codebox_from_file(self, filename, syntax, encoding="utf-8", **kwargs):
+        """
+        Add a codebox filled with the content of a file, the file
+        is only read when the document is saved
+
+        :param filename: The path of the file
+        :type filename: str
+
+        :param syntax: The syntax to use for coloring code
+        :type syntax: str
+        """
+        text_file = CherryTreeTextFile.from_path(filename, encoding)
+        self.node.add_codebox(text_file, syntax.lower(), **kwargs)
+        return self
+
     def table(self, content, **kwargs):
         """
         Add a table to the node
+
+        :param content: The rows of the table, the header being the last row.
+                        Can be a list or any iterable of rows (generator, csv reader...)
+        :type content: Iterable[Iterable]
         """
         self.node.add_table(content, **kwargs)
         return self
@@ -0,0 +1,397 @@
+"""
+Keep the versions of a document in a snapshot store
+
+The store is a sqlite database in which the content of the nodes and
+the png of the images are addressed by their hash: a node or an image
+unchanged between two versions is only stored once. A version only
+records the place of each node in the tree and the id of its content.
+The rows are copied between the store and the documents by sqlite.
+
+Usage:
+
+    >>> from ctb_writer.snapshot import SnapshotStore
+    >>> store = SnapshotStore("notes.snapshots")
+    >>> version_id = store.snapshot("notes.ctb", label="before cleanup")
+    >>> store.restore(version_id, "notes_before_cleanup.ctb")
+"""
+import os
+import sqlite3
+from time import time
+from dataclasses import dataclass
+from ctb_writer.cherry_tree_link import CherryTreeLink
+from ctb_writer.cherry_tree_hash import CherryTreeHasher
+
+__all__ = ["SnapshotStore", "CherryTreeVersion", "CherryTreeNodeVersion"]
+
+# Columns of the node content kept in the store
+CONTENT_COLUMNS = ("name", "txt", "syntax", "tags", "is_ro", "is_richtxt",
+                   "has_codebox", "has_table", "has_image", "level")
+
+@dataclass
+class CherryTreeVersion:
+    """
+    A version of a document in the store
+
+    :param version_id: The id of the version
+    :param created: The timestamp of the snapshot
+    :param source: The path of the document
+    :param label: The label given to the snapshot
+    :param nodes: The number of nodes of the version
+    """
+    version_id: int
+    created: int
+    source: str
+    label: str
+    nodes: int
+
+@dataclass
+class CherryTreeNodeVersion:
+    """
+    The content of a node in a version
+
+    :param version_id: The first version having this content
+    :param created: The timestamp of this version
+    :param name: The name of the node
+    :param txt: The text of the node, xml for rich text nodes
+    :param content_id: The id of the content in the store
+    """
+    version_id: int
+    created: int
+    name: str
+    txt: str
+    content_id: int
+
+class SnapshotStore:
+    """
+    Store of the versions of documents
+
+    :param path: The database of the store, created if it does not exist
+    :type path: str
+    """
+    def __init__(self, path):
+        self.path = path
+        self.con = sqlite3.connect(path)
+        self.cursor = self.con.cursor()
+        self.init()
+
+    def init(self):
+        """
+        Create the tables of the store
+        """
+        self.cursor.executescript(f"""
+            CREATE TABLE IF NOT EXISTS version (
+                version_id INTEGER PRIMARY KEY,
+                created INTEGER,
+                source TEXT,
+                label TEXT,
+                digest TEXT
+            );
+            CREATE TABLE IF NOT EXISTS version_node (
+                version_id INTEGER,
+                node_id INTEGER,
+                father_id INTEGER,
+                sequence INTEGER,
+                content_id INTEGER,
+                master_id INTEGER DEFAULT 0,
+                PRIMARY KEY (version_id, node_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS version_bookmark (
+                version_id INTEGER,
+                node_id INTEGER,
+                sequence INTEGER,
+                PRIMARY KEY (version_id, node_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS version_node_history ON version_node (node_id, version_id);
+            CREATE TABLE IF NOT EXISTS content (
+                content_id INTEGER PRIMARY KEY,
+                hash TEXT UNIQUE,
+                {", ".join(CONTENT_COLUMNS)}
+            );
+            CREATE TABLE IF NOT EXISTS content_codebox (
+                content_id INTEGER, offset INTEGER, justification TEXT, txt TEXT, syntax TEXT,
+                width INTEGER, height INTEGER, is_width_pix INTEGER, do_highl_bra INTEGER,
+                do_show_linenum INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS content_codebox_id ON content_codebox (content_id);
+            CREATE TABLE IF NOT EXISTS content_grid (
+                content_id INTEGER, offset INTEGER, justification TEXT, txt TEXT,
+                col_min INTEGER, col_max INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS content_grid_id ON content_grid (content_id);
+            CREATE TABLE IF NOT EXISTS content_image (
+                content_id INTEGER, offset INTEGER, justification TEXT, anchor TEXT,
+                png_hash TEXT, filename TEXT, link TEXT, time INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS content_image_id ON content_image (content_id);
+            CREATE TABLE IF NOT EXISTS png (
+                hash TEXT PRIMARY KEY,
+                data BLOB
+            );
+            """)
+        columns = [row[1] for row in self.cursor.execute("PRAGMA table_info(version_node)")]
+        if "master_id" not in columns:
+            # Stores created before the shared nodes were kept
+            self.cursor.execute("ALTER TABLE version_node ADD COLUMN master_id INTEGER DEFAULT 0")
+        self.con.commit()
+
+    def _attach(self, database):
+        self.con.commit()
+        self.cursor.execute("ATTACH DATABASE ? AS document", (os.path.abspath(database),))
+
+    def _detach(self, commit=True):
+        """
+        Detach the document, the rows written are rolled back unless committed
+        """
+        if commit:
+            self.con.commit()
+        else:
+            self.con.rollback()
+        self.cursor.execute("DETACH DATABASE document")
+
+    def snapshot(self, ctb_path, label=None):
+        """
+        Record the current version of a document, only the nodes
+        and images not already in the store are copied
+
+        :param ctb_path: The document
+        :type ctb_path: str
+
+        :param label: A label for the version
+        :type label: str
+
+        :return: The id of the version, the last version of the
+                 document is returned if nothing changed since
+        :rtype: int
+        """
+        if not os.path.exists(ctb_path):
+            raise FileNotFoundError(f"Cannot find file {ctb_path}")
+
+        with CherryTreeLink(ctb_path) as link:
+            return self._snapshot(CherryTreeHasher(link), ctb_path, label)
+
+    def _snapshot(self, hasher, ctb_path, label):
+        """
+        Record a version of the document hashed, the version is
+        only committed once all its nodes are copied
+        """
+        source = os.path.abspath(ctb_path)
+        digest = self._get_digest(hasher)
+        last = self.cursor.execute("""SELECT version_id, digest FROM version WHERE source=?
+                                      ORDER BY version_id DESC LIMIT 1""", (source,)).fetchone()
+        if last and last[1] == digest:
+            return last[0]
+
+        self._attach(ctb_path)
+        try:
+            self.cursor.execute("INSERT INTO version (created, source, label, digest) VALUES (?, ?, ?, ?)",
+                                (int(time()), source, label, digest))
+            version_id = self.cursor.lastrowid
+            rows = []
+            for node_id, father_id, sequence, _ in hasher.link.iter_tree():
+                node_hash = hasher.get_node_hashes().get(node_id)
+                if node_hash is not None:
+                    rows.append((version_id, node_id, father_id, sequence,
+                                 self._store_content(hasher, node_id, node_hash)))
+            self.cursor.executemany("""INSERT INTO version_node
+                                       (version_id, node_id, father_id, sequence, content_id)
+                                       VALUES (?, ?, ?, ?, ?)""", rows)
+            self.cursor.execute("""UPDATE version_node
+                                   SET master_id=IFNULL((SELECT master_id FROM document.children
+                                                         WHERE children.node_id=version_node.node_id), 0)
+                                   WHERE version_id=?""", (version_id,))
+            self.cursor.execute("""INSERT INTO version_bookmark
+                                   SELECT ?, node_id, sequence FROM document.bookmark""", (version_id,))
+        except BaseException:
+            self._detach(commit=False)
+            raise
+        self._detach()
+        return version_id
+
+    @staticmethod
+    def _get_digest(hasher):
+        """
+        Return the digest of a version: the digest of its tree, its
+        shared nodes and its bookmarks
+        """
+        con = hasher.link.con
+        shared = con.execute("SELECT node_id, master_id FROM children WHERE master_id != 0 ORDER BY node_id")
+        bookmarks = con.execute("SELECT node_id, sequence FROM bookmark ORDER BY sequence, node_id")
+        digests = [repr(row) for row in shared] + ["bookmarks"] + [repr(row) for row in bookmarks]
+        return hasher.hash_tree(hasher.get_tree_hashes()[0], digests)
+
+    def _store_content(self, hasher, node_id, node_hash):
+        """
+        Copy the content of a node from the document attached, unless
+        a node with the same hash is already stored
+
+        :return: The id of the content
+        :rtype: int
+        """
+        row = self.cursor.execute("SELECT content_id FROM content WHERE hash=?", (node_hash,)).fetchone()
+        if row:
+            return row[0]
+
+        self.cursor.execute(f"""INSERT INTO content (hash, {", ".join(CONTENT_COLUMNS)})
+                                SELECT ?, {", ".join(CONTENT_COLUMNS)} FROM document.node WHERE node_id=?""",
+                            (node_hash, node_id))
+        content_id = self.cursor.lastrowid
+        self.cursor.execute("""INSERT INTO content_codebox
+                               SELECT ?, offset, justification, txt, syntax, width, height,
+                                      is_width_pix, do_highl_bra, do_show_linenum
+                               FROM document.codebox WHERE node_id=?""", (content_id, node_id))
+        self.cursor.execute("""INSERT INTO content_grid
+                               SELECT ?, offset, justification, txt, col_min, col_max
+                               FROM document.grid WHERE node_id=?""", (content_id, node_id))
+
+        for (rowid,) in self.cursor.execute("SELECT rowid FROM document.image WHERE node_id=?",
+                                            (node_id,)).fetchall():
+            png_hash = hasher.hash_png(rowid).hex()
+            self.cursor.execute("""INSERT OR IGNORE INTO png
+                                   SELECT ?, png FROM document.image WHERE rowid=?""", (png_hash, rowid))
+            self.cursor.execute("""INSERT INTO content_image
+                                   SELECT ?, offset, justification, anchor, ?, filename, link, time
+                                   FROM document.image WHERE rowid=?""", (content_id, png_hash, rowid))
+        return content_id
+
+    def iter_versions(self, ctb_path=None):
+        """
+        Iter through the versions in the store
+
+        :param ctb_path: Only the versions of this document
+        :type ctb_path: str
+
+        :rtype: Iterator[class:`CherryTreeVersion`]
+        """
+        query = """SELECT version.version_id, created, source, label, COUNT(node_id)
+                   FROM version LEFT JOIN version_node USING (version_id)
+                   {} GROUP BY version.version_id ORDER BY version.version_id"""
+        if ctb_path is None:
+            rows = self.con.execute(query.format(""))
+        else:
+            rows = self.con.execute(query.format("WHERE source=?"), (os.path.abspath(ctb_path),))
+        for row in rows:
+            yield CherryTreeVersion(*row)
+
+    def iter_node_history(self, node_id, ctb_path=None):
+        """
+        Iter through the contents a node had, a content is yielded
+        once for the first version in which it appeared
+
+        :param node_id: The id of the node
+        :type node_id: int
+
+        :param ctb_path: Only the versions of this document
+        :type ctb_path: str
+
+        :rtype: Iterator[class:`CherryTreeNodeVersion`]
+        """
+        where = "" if ctb_path is None else "AND version.source=?"
+        params = (node_id,) if ctb_path is None else (node_id, os.path.abspath(ctb_path))
+        rows = self.con.execute(f"""SELECT version.version_id, version.created, content.name,
+                                           content.txt, content.content_id
+                                    FROM version_node
+                                    JOIN version USING (version_id)
+                                    JOIN content USING (content_id)
+                                    WHERE version_node.node_id=? {where}
+                                    ORDER BY version.version_id""", params)
+        last_content = None
+        for row in rows:
+            if row[4] != last_content:
+                last_content = row[4]
+                yield CherryTreeNodeVersion(*row)
+
+    def restore(self, version_id, destination, node_id=None):
+        """
+        Write a version in a new document, with its bookmarks
+
+        :param version_id: The version to restore
+        :type version_id: int
+
+        :param destination: The document to create
+        :type destination: str
+
+        :param node_id: Only restore this node and its children, as a root node
+        :type node_id: int
+
+        :return: The number of nodes restored
+        :rtype: int
+
+        :raise ValueError: If the destination already exists or the version is unknown
+
+        The destination is removed if the restore fails
+        """
+        if os.path.exists(destination):
+            raise ValueError(f"File {destination} already exists, cannot overwrite !")
+        if not self.cursor.execute("SELECT 1 FROM version WHERE version_id=?", (version_id,)).fetchone():
+            raise ValueError(f"Version {version_id} not found in the store")
+
+        link = CherryTreeLink(destination)
+        link.init()
+        link.con.close()
+        self._attach(destination)
+        try:
+            count = self._restore(version_id, node_id)
+        except BaseException:
+            self._detach(commit=False)
+            os.remove(destination)
+            raise
+        self._detach()
+        return count
+
+    def _restore(self, version_id, node_id):
+        """
+        Copy the rows of a version in the document attached
+        """
+        self.cursor.execute("DROP TABLE IF EXISTS temp.restored")
+        self.cursor.execute("""CREATE TEMP TABLE restored (node_id INTEGER PRIMARY KEY, father_id INTEGER,
+                                                           sequence INTEGER, content_id INTEGER,
+                                                           master_id INTEGER)""")
+        root = 0 if node_id is None else node_id
+        self.cursor.execute("""WITH RECURSIVE tree(node_id, father_id, sequence, content_id, master_id) AS (
+                                   SELECT node_id, father_id, sequence, content_id, master_id FROM version_node
+                                   WHERE version_id=? AND (node_id=? OR (? = 0 AND father_id=0))
+                                   UNION ALL
+                                   SELECT version_node.node_id, version_node.father_id,
+                                          version_node.sequence, version_node.content_id,
+                                          version_node.master_id
+                                   FROM version_node JOIN tree ON version_node.father_id=tree.node_id
+                                   WHERE version_node.version_id=?
+                               )
+                               INSERT INTO temp.restored SELECT * FROM tree""",
+                            (version_id, root, root, version_id))
+        if node_id is not None:
+            self.cursor.execute("UPDATE temp.restored SET father_id=0, sequence=1 WHERE node_id=?", (node_id,))
+
+        now = int(time())
+        self.cursor.execute(f"""INSERT INTO document.node (node_id, {", ".join(CONTENT_COLUMNS)},
+                                                           ts_creation, ts_lastsave)
+                                SELECT restored.node_id, {", ".join("content." + column for column in CONTENT_COLUMNS)},
+                                       ?, ?
+                                FROM temp.restored AS restored JOIN content USING (content_id)
+                                ORDER BY restored.node_id""", (now, now))
+        # A shared node whose master is not restored becomes a node of its own
+        self.cursor.execute("""INSERT INTO document.children (node_id, father_id, sequence, master_id)
+                               SELECT node_id, father_id, sequence,
+                                      IIF(master_id IN (SELECT node_id FROM temp.restored), master_id, 0)
+                               FROM temp.restored""")
+        self.cursor.execute("""INSERT INTO document.bookmark (node_id, sequence)
+                               SELECT node_id, ROW_NUMBER() OVER (ORDER BY sequence)
+                               FROM version_bookmark
+                               WHERE version_id=? AND node_id IN (SELECT node_id FROM temp.restored)""",
+                            (version_id,))
+        self.cursor.execute("""INSERT INTO document.codebox
+                               SELECT restored.node_id, offset, justification, txt, syntax, width, height,
+                                      is_width_pix, do_highl_bra, do_show_linenum
+                               FROM temp.restored AS restored JOIN content_codebox USING (content_id)""")
+        self.cursor.execute("""INSERT INTO document.grid
+                               SELECT restored.node_id, offset, justification, txt, col_min, col_max
+                               FROM temp.restored AS restored JOIN content_grid USING (content_id)""")
+        self.cursor.execute("""INSERT INTO document.image
+                               SELECT restored.node_id, offset, justification, anchor, png.data,
+                                      filename, link, time
+                               FROM temp.restored AS restored
+                               JOIN content_image USING (content_id)
+                               LEFT JOIN png ON png.hash=content_image.png_hash""")
+        count = self.cursor.execute("SELECT COUNT(*) FROM temp.restored").fetchone()[0]
+        self.cursor.execute("DROP TABLE temp.restored")
+        return count
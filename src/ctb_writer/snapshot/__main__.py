@@ -0,0 +1,51 @@
+"""
+Record, list and restore the versions of documents
+
+Usage:
+
+    python3 -m ctb_writer.snapshot notes.snapshots take notes.ctb [--label LABEL]
+    python3 -m ctb_writer.snapshot notes.snapshots list [notes.ctb]
+    python3 -m ctb_writer.snapshot notes.snapshots history NODE_ID [notes.ctb]
+    python3 -m ctb_writer.snapshot notes.snapshots restore VERSION_ID restored.ctb [--node NODE_ID]
+"""
+import argparse
+from datetime import datetime
+from . import SnapshotStore
+
+parser = argparse.ArgumentParser(prog="python3 -m ctb_writer.snapshot",
+                                 description="Keep the versions of cherry tree documents")
+parser.add_argument("store", help="The snapshot store, created if it does not exist")
+actions = parser.add_subparsers(dest="action", required=True)
+take = actions.add_parser("take", help="Record the current version of a document")
+take.add_argument("document")
+take.add_argument("--label", default=None)
+listing = actions.add_parser("list", help="List the versions")
+listing.add_argument("document", nargs="?", default=None)
+history = actions.add_parser("history", help="List the contents of a node across the versions")
+history.add_argument("node_id", type=int)
+history.add_argument("document", nargs="?", default=None)
+restore = actions.add_parser("restore", help="Write a version in a new document")
+restore.add_argument("version_id", type=int)
+restore.add_argument("destination")
+restore.add_argument("--node", type=int, default=None, help="Only restore this node and its children")
+args = parser.parse_args()
+
+def get_date(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+store = SnapshotStore(args.store)
+if args.action == "take":
+    print(f"Version {store.snapshot(args.document, label=args.label)}")
+
+elif args.action == "list":
+    for version in store.iter_versions(args.document):
+        print(f"{version.version_id:>6}  {get_date(version.created)}  {version.nodes:>7} nodes  "
+              f"{version.source}  {version.label or ''}")
+
+elif args.action == "history":
+    for node_version in store.iter_node_history(args.node_id, args.document):
+        print(f"{node_version.version_id:>6}  {get_date(node_version.created)}  {node_version.name}")
+
+else:
+    count = store.restore(args.version_id, args.destination, node_id=args.node)
+    print(f"{count} nodes restored in {args.destination}")
@@ -0,0 +1,8 @@
+import pytest
+
+PNG_DATA = b"\x89PNG\r\n\x1a\n" + b"\x00" * 32
+
+@pytest.fixture
+def png_data():
+    """The data of the images added to the documents, only its signature is a png"""
+    return PNG_DATA
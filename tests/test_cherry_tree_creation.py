@@ -1,3 +1,5 @@
+import io
+import pytest
 from ctb_writer import CherryTree, CherryTreeNodeBuilder
 
 COMPLEX_TEXT = """\
@@ -42,3 +44,200 @@ def test_entities_order():
     assert node.entities[1] == node.tables[0]
     assert node.entities[0] == node.codebox[0]
 
+
+def test_file_backed_content(tmp_path):
+    source = tmp_path / "script.py"
+    source.write_text(CODEBOX)
+    latin = tmp_path / "latin.txt"
+    latin.write_bytes("café".encode("latin-1"))
+
+    document = CherryTree()
+    codenode = CherryTreeNodeBuilder("Code node", type="code", syntax="python")\
+                                    .text("# header\n").text_from_file(source).get_node()
+    plainnode = CherryTreeNodeBuilder("Plain node", type="plain")\
+                                     .text_from_file(latin, encoding="latin-1").eol().get_node()
+    richnode = CherryTreeNodeBuilder("Rich node").codebox_from_file(source, "python").get_node()
+    assert codenode.is_file_backed
+
+    document.add_child(codenode)
+    document.add_child(plainnode)
+    document.add_child(richnode)
+    document.save(str(tmp_path / "file_backed.ctb"))
+
+    loaded = CherryTree.load(str(tmp_path / "file_backed.ctb"))
+    assert loaded.get_node_by_name("Code node")[0].get_text() == "# header\n" + CODEBOX
+    assert loaded.get_node_by_name("Plain node")[0].get_text() == "café\n"
+    assert loaded.get_node_by_name("Rich node")[0].codebox[0].txt == CODEBOX
+
+def test_streamed_table(tmp_path):
+    rows = ((str(i), i * 2, "<&>" if i == 1 else None) for i in range(3))
+    node = CherryTreeNodeBuilder("Rich node").table(rows, auto_width=True, col_min=20).get_node()
+    table = node.tables[0]
+    assert table.is_streamed
+    assert table.get_table_size() == len(table.get_table())
+    assert b'col_widths="20,20,27"' in table.get_table()
+
+    document = CherryTree()
+    document.add_child(node)
+    document.save(str(tmp_path / "table.ctb"))
+
+    loaded = CherryTree.load(str(tmp_path / "table.ctb"))
+    assert loaded.get_node_by_id(1).tables[0].content == [["0", "0", ""], ["1", "2", "<&>"], ["2", "4", ""]]
+
+def test_streamed_table_edited(tmp_path):
+    node = CherryTreeNodeBuilder("Rich node").table(iter([["a", "b"], ["H1", "H2"]])).get_node()
+    table = node.tables[0]
+    rows_xml = table._rows_xml
+    table.content.insert(0, ["c", "d"])
+    assert not table.is_streamed and rows_xml.closed
+
+    document = CherryTree()
+    document.add_child(node)
+    document.save(str(tmp_path / "table.ctb"))
+    loaded = CherryTree.load(str(tmp_path / "table.ctb"))
+    assert loaded.get_node_by_id(1).tables[0].content == [["c", "d"], ["a", "b"], ["H1", "H2"]]
+
+def test_loaded_table_is_lazy(tmp_path):
+    document = CherryTree()
+    document.add_child(CherryTreeNodeBuilder("Rich node").table([["a", "b"], ["c", "d"], ["H1", "H2"]]).get_node())
+    document.save(str(tmp_path / "first.ctb"))
+
+    loaded = CherryTree.load(str(tmp_path / "first.ctb"))
+    table = loaded.get_node_by_id(1).tables[0]
+    raw_xml = table.get_table()
+    assert table.is_loaded
+    assert table.get_header() == ["H1", "H2"]
+    assert table.get_row_count() == 3
+
+    loaded.save(str(tmp_path / "second.ctb"))
+    copy = CherryTree.load(str(tmp_path / "second.ctb")).get_node_by_id(1).tables[0]
+    assert copy.get_table() == raw_xml
+
+    assert table.content[0] == ["a", "b"]
+    assert not table.is_loaded
+
+PNG_DATA = bytes.fromhex("89504e470d0a1a0a0000000d49484452000000010000000108060000001f15c4890000000d"
+                         "4944415478da63f8cfc0f01f0005000200a3a5d5e70000000049454e44ae426082")
+
+def test_deferred_images(tmp_path):
+    image_path = tmp_path / "pixel.png"
+    image_path.write_bytes(PNG_DATA)
+
+    with open(image_path, "rb") as image_file:
+        node = CherryTreeNodeBuilder("Rich node").image(str(image_path)).image(image_file)\
+                                                 .image(memoryview(PNG_DATA)).get_node()
+        assert [image.size for image in node.images] == [len(PNG_DATA)] * 3
+        document = CherryTree()
+        document.add_child(node)
+        document.save(str(tmp_path / "images.ctb"))
+
+    loaded = CherryTree.load(str(tmp_path / "images.ctb"))
+    assert [image.data for image in loaded.get_node_by_id(1).images] == [PNG_DATA] * 3
+
+def test_loaded_images_are_lazy(tmp_path):
+    document = CherryTree()
+    document.add_child(CherryTreeNodeBuilder("Rich node").image(PNG_DATA).get_node())
+    document.save(str(tmp_path / "first.ctb"))
+
+    loaded = CherryTree.load(str(tmp_path / "first.ctb"))
+    image = loaded.get_node_by_id(1).images[0]
+    assert image.size == len(PNG_DATA)
+    assert b"".join(image.iter_data()) == PNG_DATA
+
+    loaded.save(str(tmp_path / "second.ctb"))
+    copy = CherryTree.load(str(tmp_path / "second.ctb"))
+    assert copy.get_node_by_id(1).images[0].data == PNG_DATA
+
+def test_images_deduplication(tmp_path):
+    image_path = tmp_path / "pixel.png"
+    image_path.write_bytes(PNG_DATA)
+
+    node = CherryTreeNodeBuilder("Rich node").image(str(image_path)).image(str(image_path))\
+                                             .image(bytes(PNG_DATA)).image(bytearray(PNG_DATA)).get_node()
+    assert node.images[0].source is node.images[1].source
+    assert node.images[2].source is node.images[3].source
+
+    reports = []
+    document = CherryTree()
+    document.add_child(node)
+    document.save(str(tmp_path / "images.ctb"), report=reports.append)
+    assert reports[0].images == 4
+    assert reports[0].bytes_deduplicated == 2 * len(PNG_DATA)
+
+    loaded = CherryTree.load(str(tmp_path / "images.ctb"))
+    assert [image.data for image in loaded.get_node_by_id(1).images] == [PNG_DATA] * 4
+
+def test_image_buffers_and_streams(tmp_path):
+    buffer = bytearray(PNG_DATA)
+    node = CherryTreeNodeBuilder("Rich node").image(buffer).get_node()
+    buffer[-1] ^= 0xff
+    assert node.images[0].data == PNG_DATA
+
+    reads = []
+    class Stream(io.BytesIO):
+        def read(self, *args):
+            reads.append(args)
+            return super().read(*args)
+
+    node = CherryTreeNodeBuilder("Rich node").image(Stream(PNG_DATA)).image(Stream(PNG_DATA)).get_node()
+    assert not reads
+    document = CherryTree()
+    document.add_child(node)
+    reports = []
+    document.save(str(tmp_path / "images.ctb"), report=reports.append)
+    assert reports[0].bytes_deduplicated == len(PNG_DATA)
+
+def test_from_records(tmp_path):
+    document = CherryTree.from_records([
+        {"name": "Root", "text": "root text", "icon": "add", "children": [
+            {"name": "Script", "type": "code", "syntax": "python", "text": "print(1)\n"},
+            {"name": "Notes", "type": "plain", "tags": ["cve", "web"]}]},
+    ])
+    root_id = document.add_child("Other root")
+    ids = document.extend_tree([(10, 11, "Grand child", "plain", "text"),
+                                (11, None, "Child"),
+                                (12, 1, "Under first root")], parent_id=root_id)
+    assert ids == [5, 6, 7]
+
+    document.save(str(tmp_path / "records.ctb"))
+    loaded = CherryTree.load(str(tmp_path / "records.ctb"))
+    assert [child.name for child in loaded.get_node_by_id(1).children] == ["Script", "Notes", "Under first root"]
+    assert loaded.get_node_by_id(2).get_text() == "print(1)\n"
+    assert loaded.get_node_by_id(3).tags == ["cve", "web"]
+    assert loaded.get_node_by_id(6).children[0].name == "Grand child"
+    assert loaded.get_node_by_id(6).father_id == root_id
+
+def test_images_from_many_documents(tmp_path):
+    document = CherryTree()
+    for index in range(12):
+        source = CherryTree()
+        source.add_child(CherryTreeNodeBuilder(f"Image {index}").image(PNG_DATA + bytes([index])).get_node())
+        source.save(str(tmp_path / f"source{index}.ctb"))
+        document.add_child(CherryTree.load(str(tmp_path / f"source{index}.ctb")).nodes[0])
+
+    document.save(str(tmp_path / "merged.ctb"))
+    loaded = CherryTree.load(str(tmp_path / "merged.ctb"))
+    assert [node.images[0].data for node in loaded.nodes] == [PNG_DATA + bytes([index]) for index in range(12)]
+
+def test_extend_tree_errors_leave_document_unchanged():
+    document = CherryTree()
+    document.add_child("x")
+    with pytest.raises(ValueError):
+        document.extend_tree([(1, 2, "a"), (2, 1, "b"), (3, None, "c")])
+    with pytest.raises(ValueError):
+        document.extend_tree([(1, None, "ok"), (2, 42, "orphan")])
+    with pytest.raises(ValueError):
+        document.extend_tree([{"name": "ok"}], parent_id=42)
+    assert [node.name for node in document.nodes] == ["x"]
+    assert document.extend_tree([(1, 2, "a"), (2, None, "b")]) == [2, 3]
+    assert document.nodes[1].children[0].name == "a"
+
+def test_images_of_replaced_document(tmp_path):
+    for data in (PNG_DATA, PNG_DATA + b"\x01"):
+        document = CherryTree()
+        document.add_child(CherryTreeNodeBuilder("Rich node").image(data).get_node())
+        if (tmp_path / "images.ctb").exists():
+            (tmp_path / "images.ctb").unlink()
+        document.save(str(tmp_path / "images.ctb"))
+        loaded = CherryTree.load(str(tmp_path / "images.ctb"))
+        assert loaded.get_node_by_id(1).images[0].data == data
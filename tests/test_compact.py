@@ -0,0 +1,86 @@
+import pytest
+import sqlite3
+from ctb_writer import CherryTree, CherryTreeNodeBuilder
+
+def build_document(path, png_data):
+    document = CherryTree()
+    root_id = document.add_child("Root", text="root text")
+    document.add_child("Removed", parent_id=root_id)
+    rich = CherryTreeNodeBuilder("Rich").text("see ", {})\
+                                        .codebox("print(1)\n", "python")\
+                                        .image(png_data).get_node()
+    rich_id = document.add_child(rich, parent_id=root_id)
+    rich.xml.append(CherryTreeNodeBuilder("x").text("root", {}).get_node().xml[0])
+    rich.xml[-1].set("link", f"node {rich_id} anchor")
+    document.add_child("Other root", text="other")
+    document.save(str(path))
+
+    # Delete the second node, leaving holes in the ids and the sequences
+    con = sqlite3.connect(str(path))
+    con.execute("DELETE FROM node WHERE node_id=2")
+    con.execute("DELETE FROM children WHERE node_id=2")
+    con.execute("INSERT INTO codebox (node_id, offset, txt) VALUES (42, 0, 'orphan')")
+    con.commit()
+    con.close()
+
+def test_compact(tmp_path, png_data):
+    build_document(tmp_path / "notes.ctb", png_data)
+    assert CherryTree.compact(str(tmp_path / "notes.ctb"), str(tmp_path / "compact.ctb")) == 3
+
+    con = sqlite3.connect(str(tmp_path / "compact.ctb"))
+    assert con.execute("SELECT node_id, father_id, sequence FROM children ORDER BY node_id").fetchall() ==\
+           [(1, 0, 1), (2, 1, 1), (3, 0, 2)]
+    assert con.execute("SELECT node_id, txt FROM codebox").fetchall() == [(2, "print(1)\n")]
+    assert 'link="node 2 anchor"' in con.execute("SELECT txt FROM node WHERE node_id=2").fetchone()[0]
+    con.close()
+
+    document = CherryTree.load(str(tmp_path / "compact.ctb"))
+    assert [node.name for node in document.nodes] == ["Root", "Other root"]
+    assert document.get_node_by_id(2).images[0].data == png_data
+
+def test_compact_in_place(tmp_path, png_data):
+    build_document(tmp_path / "notes.ctb", png_data)
+    assert CherryTree.compact(str(tmp_path / "notes.ctb")) == 3
+    assert not (tmp_path / "notes.compacting.ctb").exists()
+    assert CherryTree.load(str(tmp_path / "notes.ctb")).get_node_by_id(3).name == "Other root"
+
+def test_merge_files(tmp_path):
+    master = CherryTree()
+    master.add_child("Engagements")
+    master.save(str(tmp_path / "master.ctb"))
+    sources = []
+    for index in range(2):
+        document = CherryTree()
+        root_id = document.add_child(f"Engagement {index}")
+        document.add_child("Findings", text=f"finding {index}", parent_id=root_id)
+        document.save(str(tmp_path / f"engagement{index}.ctb"))
+        sources.append(str(tmp_path / f"engagement{index}.ctb"))
+
+    assert CherryTree.merge_files(str(tmp_path / "master.ctb"), sources, under=1) == 4
+    document = CherryTree.load(str(tmp_path / "master.ctb"))
+    engagements = document.nodes[0]
+    assert [node.name for node in engagements.children] == ["Engagement 0", "Engagement 1"]
+    assert [node.node_id for node in engagements.children] == [2, 4]
+    assert engagements.children[1].children[0].node_id == 5
+
+def test_merge_files_failure_leaves_target_unchanged(tmp_path):
+    master = CherryTree()
+    master.add_child("Engagements")
+    master.save(str(tmp_path / "master.ctb"))
+    source = CherryTree()
+    source.add_child("Engagement")
+    source.save(str(tmp_path / "engagement.ctb"))
+    (tmp_path / "broken.ctb").write_bytes(b"not a database" * 100)
+
+    with pytest.raises(sqlite3.DatabaseError):
+        CherryTree.merge_files(str(tmp_path / "master.ctb"),
+                               [str(tmp_path / "engagement.ctb"), str(tmp_path / "broken.ctb")])
+    assert [node.name for node in CherryTree.load(str(tmp_path / "master.ctb")).nodes] == ["Engagements"]
+    assert not (tmp_path / "master.merging.ctb").exists()
+
+def test_failed_compact_removes_target(tmp_path):
+    (tmp_path / "broken.ctb").write_bytes(b"not a database" * 100)
+    for _ in range(2):
+        with pytest.raises(sqlite3.DatabaseError):
+            CherryTree.compact(str(tmp_path / "broken.ctb"))
+    assert not (tmp_path / "broken.compacting.ctb").exists()
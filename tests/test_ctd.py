@@ -0,0 +1,63 @@
+import base64
+from ctb_writer import CherryTree, CherryTreeNodeBuilder
+
+def build_document(png_data):
+    document = CherryTree()
+    root_id = document.add_child("Root & co", text="root <text>")
+    rich = CherryTreeNodeBuilder("Rich", bold=True, color="sun").texts("[(bold|fg:green)]Title[/]\n")\
+                                .codebox("if a < b:\n    pass\n", "python")\
+                                .table([["a", "b"], ["H1", "H2"]])\
+                                .image(png_data).get_node()
+    rich.tags = ["one", "two"]
+    document.add_child(rich, parent_id=root_id)
+    document.add_child(CherryTreeNodeBuilder("Code", type="code", syntax="python").text("x = 1\n").get_node(),
+                       parent_id=root_id)
+    document.add_child("Second root", text="second")
+    return document
+
+def check_document(document, png_data):
+    root, second = document.nodes
+    assert root.name == "Root & co"
+    assert [child.name for child in root.children] == ["Rich", "Code"]
+    assert second.name == "Second root"
+
+    rich = document.get_node_by_id(2)
+    assert rich.get_title_style()["bold"] and rich.get_title_style()["color"]
+    assert rich.tags == ["one", "two"]
+    assert rich.xml[0].text == "Title" and rich.xml[0].get("weight") == "heavy"
+    assert rich.codebox[0].txt == "if a < b:\n    pass\n"
+    assert rich.tables[0].get_header() == ["H1", "H2"]
+    assert rich.images[0].data == png_data
+    assert document.get_node_by_id(3).get_text() == "x = 1\n"
+    assert document.get_node_by_id(3).syntax == "python"
+
+def test_ctd_save_and_load(tmp_path, png_data):
+    build_document(png_data).save(str(tmp_path / "notes.ctd"))
+    document = CherryTree.load(str(tmp_path / "notes.ctd"))
+    check_document(document, png_data)
+    assert document.get_node_by_id(1).xml[0].text == "root <text>"
+
+def test_convert_ctb_ctd(tmp_path, png_data):
+    build_document(png_data).save(str(tmp_path / "notes.ctb"))
+    assert CherryTree.convert(str(tmp_path / "notes.ctb"), str(tmp_path / "notes.ctd")) == 4
+    assert CherryTree.convert(str(tmp_path / "notes.ctd"), str(tmp_path / "copy.ctb")) == 4
+
+    source = CherryTree.load(str(tmp_path / "notes.ctb"))
+    copy = CherryTree.load(str(tmp_path / "copy.ctb"))
+    check_document(copy, png_data)
+    for node_id in (1, 2, 3, 4):
+        assert copy.get_node_by_id(node_id).get_text() == source.get_node_by_id(node_id).get_text()
+        assert copy.get_node_by_id(node_id).get_title_style() == source.get_node_by_id(node_id).get_title_style()
+
+def test_ctd_embedded_files_are_not_images(tmp_path, png_data):
+    png = base64.b64encode(png_data).decode("ascii")
+    (tmp_path / "notes.ctd").write_text(
+        '<?xml version="1.0" encoding="UTF-8"?>\n<cherrytree>'
+        '<node name="Files" unique_id="1" prog_lang="custom-colors">'
+        '<rich_text>text</rich_text>'
+        f'<encoded_png char_offset="1" filename="report.pdf" time="0">{png}</encoded_png>'
+        '<encoded_png char_offset="2" anchor="here"></encoded_png>'
+        f'<encoded_png char_offset="3">{png}</encoded_png>'
+        '</node></cherrytree>')
+    node = CherryTree.load(str(tmp_path / "notes.ctd")).get_node_by_id(1)
+    assert [(image.position, image.data) for image in node.images] == [(3, png_data)]
@@ -0,0 +1,72 @@
+from ctb_writer import CherryTree, CherryTreeNodeBuilder
+from ctb_writer.cherry_tree_link import CherryTreeLink
+from ctb_writer.diff import iter_diff
+
+def build_document(path, png_data, second=False):
+    document = CherryTree()
+    reports = document.add_child("Reports")
+    archive = document.add_child("Archive")
+    if not second:
+        document.add_child("Week 1", text="findings", parent_id=reports)
+        document.add_child("Old", text="old", parent_id=archive)
+        document.add_child(CherryTreeNodeBuilder("Scan").codebox("nmap\n", "sh").get_node(), parent_id=reports)
+        document.add_child("Draft", text="draft", parent_id=reports)
+    else:
+        document.add_child("Week one", text="findings", parent_id=reports)
+        document.add_child("Old", text="old", parent_id=archive)
+        document.add_child(CherryTreeNodeBuilder("Scan").codebox("nmap -sV\n", "sh").image(png_data).get_node(),
+                           parent_id=reports)
+        document.add_child("Week 2", text="new", parent_id=reports)
+    document.save(str(path))
+
+def test_diff_by_id(tmp_path, png_data):
+    build_document(tmp_path / "first.ctb", png_data)
+    build_document(tmp_path / "second.ctb", png_data, second=True)
+    changes = [str(change) for change in iter_diff(str(tmp_path / "first.ctb"), str(tmp_path / "second.ctb"))]
+    assert changes == ["renamed  Reports/Week one (was Reports/Week 1)",
+                       "changed  Reports/Scan [codebox ~1, image +1]",
+                       "renamed  Reports/Week 2 (was Reports/Draft)",
+                       "changed  Reports/Week 2 [text]"]
+
+def test_diff_by_path(tmp_path, png_data):
+    build_document(tmp_path / "first.ctb", png_data)
+    build_document(tmp_path / "second.ctb", png_data, second=True)
+    changes = [(change.kind, change.path, change.old_path)
+               for change in iter_diff(str(tmp_path / "first.ctb"), str(tmp_path / "second.ctb"), by="path")]
+    assert changes == [("changed", "Reports/Scan", None),
+                       ("renamed", "Reports/Week one", "Reports/Week 1"),
+                       ("added", "Reports/Week 2", None),
+                       ("removed", "Reports/Draft", None)]
+
+def test_no_changes(tmp_path, png_data):
+    build_document(tmp_path / "first.ctb", png_data)
+    build_document(tmp_path / "second.ctb", png_data)
+    assert list(iter_diff(str(tmp_path / "first.ctb"), str(tmp_path / "second.ctb"))) == []
+
+def test_diff_is_read_only(tmp_path, png_data):
+    build_document(tmp_path / "first.ctb", png_data)
+    build_document(tmp_path / "second.ctb", png_data, second=True)
+    contents = [(tmp_path / name).read_bytes() for name in ("first.ctb", "second.ctb")]
+    list(iter_diff(str(tmp_path / "first.ctb"), str(tmp_path / "second.ctb"), by="path"))
+    assert [(tmp_path / name).read_bytes() for name in ("first.ctb", "second.ctb")] == contents
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["first.ctb", "second.ctb"]
+
+def test_diff_same_length_edit(tmp_path):
+    for name, text in (("first.ctb", "findings"), ("second.ctb", "FINDINGS")):
+        document = CherryTree()
+        document.add_child("Week 1", text=text)
+        document.save(str(tmp_path / name))
+    changes = [str(change) for change in iter_diff(str(tmp_path / "first.ctb"), str(tmp_path / "second.ctb"))]
+    assert changes == ["changed  Week 1 [text]"]
+
+def test_diff_closes_documents(tmp_path, png_data, monkeypatch):
+    build_document(tmp_path / "first.ctb", png_data)
+    build_document(tmp_path / "second.ctb", png_data, second=True)
+    closed = []
+    close = CherryTreeLink.close
+    monkeypatch.setattr(CherryTreeLink, "close", lambda link: closed.append(link.name) or close(link))
+
+    changes = iter_diff(str(tmp_path / "first.ctb"), str(tmp_path / "second.ctb"))
+    next(changes)
+    changes.close()
+    assert sorted(closed) == [str(tmp_path / "first.ctb"), str(tmp_path / "second.ctb")]
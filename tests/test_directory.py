@@ -0,0 +1,64 @@
+import os
+from ctb_writer import CherryTree
+from ctb_writer import directory
+from ctb_writer.directory import import_directory, guess_syntax
+
+def test_guess_syntax():
+    assert guess_syntax("src/main.py") == "python"
+    assert guess_syntax("Makefile") == "makefile"
+    assert guess_syntax("notes.txt") is None
+
+def test_import_directory_and_resync(tmp_path, png_data):
+    project = tmp_path / "project"
+    (project / "src").mkdir(parents=True)
+    (project / "src" / "main.py").write_text("print(1)\n")
+    (project / "README.txt").write_text("readme\n")
+    (project / "logo.png").write_bytes(png_data)
+    (project / "binary.bin").write_bytes(b"\xff\xfe\x00")
+    ctb_path = str(tmp_path / "project.ctb")
+
+    stats = import_directory(str(project), ctb_path, workers=2)
+    assert stats == {"added": 3, "updated": 0, "removed": 0, "unchanged": 0, "skipped": 1}
+    document = CherryTree.load(ctb_path)
+    root = document.nodes[0]
+    assert root.name == "project"
+    assert [child.name for child in root.children] == ["src", "README.txt", "logo.png"]
+    assert root.children[0].children[0].syntax == "python"
+    assert root.children[0].children[0].get_text() == "print(1)\n"
+    assert root.children[1].syntax == "plain-text"
+    assert root.children[2].images[0].data == png_data
+
+    stats = import_directory(str(project), ctb_path, workers=2)
+    assert stats["unchanged"] == 3 and stats["added"] == stats["updated"] == 0
+
+    (project / "src" / "main.py").write_text("print(2)\n")
+    os.remove(project / "README.txt")
+    (project / "src" / "util.py").write_text("x = 1\n")
+    stats = import_directory(str(project), ctb_path, workers=2)
+    assert stats == {"added": 1, "updated": 1, "removed": 1, "unchanged": 1, "skipped": 1}
+
+    root = CherryTree.load(ctb_path).nodes[0]
+    assert [child.name for child in root.children] == ["src", "logo.png"]
+    assert [child.get_text() for child in root.children[0].children] == ["print(2)\n", "x = 1\n"]
+
+def test_reimport_does_not_read_skipped_files(tmp_path, monkeypatch):
+    project = tmp_path / "project"
+    project.mkdir()
+    (project / "notes.txt").write_text("notes\n")
+    (project / "binary.bin").write_bytes(b"\xff\xfe\x00" * 1000)
+    ctb_path = str(tmp_path / "project.ctb")
+    assert import_directory(str(project), ctb_path)["skipped"] == 1
+
+    hashed = []
+    original = directory._hash_file
+    monkeypatch.setattr(directory, "_hash_file", lambda path, encoding: hashed.append(path) or original(path, encoding))
+    stats = import_directory(str(project), ctb_path)
+    assert stats == {"added": 0, "updated": 0, "removed": 0, "unchanged": 1, "skipped": 1}
+    assert hashed == []
+
+    # A text file which becomes a binary one loses its node
+    (project / "notes.txt").write_bytes(b"\xff\xfe\x01")
+    os.remove(project / "binary.bin")
+    stats = import_directory(str(project), ctb_path)
+    assert stats == {"added": 0, "updated": 0, "removed": 0, "unchanged": 0, "skipped": 1}
+    assert CherryTree.load(ctb_path).nodes[0].children == []
@@ -0,0 +1,61 @@
+from ctb_writer import CherryTree, CherryTreeNodeBuilder
+from ctb_writer.export import export_document
+
+def build_document(path, png, code="x = 1\n"):
+    if path.exists():
+        path.unlink()
+    document = CherryTree()
+    root_id = document.add_child("Root", text="root text")
+    rich = CherryTreeNodeBuilder("Rich").texts("[(bold)]Title[/] after\n")\
+                                        .codebox("print(1)\n", "python", position=5)\
+                                        .table([["a", "b"], ["H1", "H2"]])\
+                                        .image(png).get_node()
+    document.add_child(rich, parent_id=root_id)
+    document.add_child(CherryTreeNodeBuilder("Code", type="code", syntax="python").text(code).get_node(),
+                       parent_id=root_id)
+    document.save(str(path))
+
+def test_export_html_per_node(tmp_path, png_data):
+    build_document(tmp_path / "notes.ctb", png_data)
+    stats = export_document(str(tmp_path / "notes.ctb"), str(tmp_path / "out"), workers=2)
+    assert stats == {"written": 3, "skipped": 0, "removed": 0, "images": 1}
+
+    rich = (tmp_path / "out" / "node-2.html").read_text()
+    assert "<span style=\"font-weight: bold\">Title</span>" in rich
+    assert rich.index("Title") < rich.index("language-python") < rich.index(" after")
+    assert "<th>H1</th>" in rich and "<td>a</td>" in rich
+    assert (tmp_path / "out" / "images" / "2_14.png").read_bytes() == png_data
+    assert "node-3.html#node-3" in (tmp_path / "out" / "index.html").read_text()
+
+def test_export_markdown_only_rewrites_changes(tmp_path, png_data):
+    build_document(tmp_path / "notes.ctb", png_data)
+    export_document(str(tmp_path / "notes.ctb"), str(tmp_path / "out"), format="markdown", per="subtree")
+    content = (tmp_path / "out" / "node-1.md").read_text()
+    assert "**Title**" in content and "```python\nx = 1\n```" in content
+    assert "| H1 | H2 |\n|---|---|\n| a | b |" in content
+
+    stats = export_document(str(tmp_path / "notes.ctb"), str(tmp_path / "out"), format="markdown", per="subtree")
+    assert stats == {"written": 0, "skipped": 1, "removed": 0, "images": 0}
+
+    build_document(tmp_path / "notes.ctb", png_data, code="x = 2\n")
+    stats = export_document(str(tmp_path / "notes.ctb"), str(tmp_path / "out"), format="markdown", per="subtree")
+    assert stats["written"] == 1
+    assert "x = 2" in (tmp_path / "out" / "node-1.md").read_text()
+
+def test_export_image_replaced_with_same_size(tmp_path, png_data):
+    build_document(tmp_path / "notes.ctb", png_data)
+    export_document(str(tmp_path / "notes.ctb"), str(tmp_path / "out"))
+
+    other_png = png_data[:-1] + b"\x01"
+    build_document(tmp_path / "notes.ctb", other_png)
+    stats = export_document(str(tmp_path / "notes.ctb"), str(tmp_path / "out"))
+    assert stats == {"written": 1, "skipped": 2, "removed": 0, "images": 1}
+    assert (tmp_path / "out" / "images" / "2_14.png").read_bytes() == other_png
+    assert not [path for path in (tmp_path / "out").iterdir() if path.suffix == ".tmp"]
+
+def test_export_markdown_escapes_names(tmp_path):
+    document = CherryTree()
+    document.add_child("# <b>not bold</b> *", text="text")
+    document.save(str(tmp_path / "notes.ctb"))
+    export_document(str(tmp_path / "notes.ctb"), str(tmp_path / "out"), format="markdown")
+    assert "# \\# \\<b\\>not bold\\</b\\> \\*\n" in (tmp_path / "out" / "node-1.md").read_text()
@@ -0,0 +1,45 @@
+from ctb_writer import CherryTree, CherryTreeNodeBuilder
+from ctb_writer.cherry_tree_link import CherryTreeLink
+from ctb_writer.cherry_tree_hash import CherryTreeHasher, iter_changed_nodes
+
+def build_document(path, png_data, text="child text"):
+    if path.exists():
+        path.unlink()
+    document = CherryTree()
+    root_id = document.add_child("Root", text="root text")
+    document.add_child("Child", text=text, parent_id=root_id)
+    document.add_child(CherryTreeNodeBuilder("Image").image(png_data).get_node(), parent_id=root_id)
+    document.add_child("Other root", text="other")
+    document.save(str(path))
+
+def test_hashes_are_stable(tmp_path, png_data):
+    build_document(tmp_path / "first.ctb", png_data)
+    build_document(tmp_path / "second.ctb", png_data)
+    first = CherryTreeHasher(CherryTreeLink(str(tmp_path / "first.ctb")))
+    second = CherryTreeHasher(CherryTreeLink(str(tmp_path / "second.ctb")))
+    assert first.get_node_hashes() == second.get_node_hashes()
+    assert first.get_tree_hashes() == second.get_tree_hashes()
+    assert list(iter_changed_nodes(first, second)) == []
+    # The document is only read
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["first.ctb", "second.ctb"]
+
+def test_signatures_detect_same_length_edits(tmp_path, png_data):
+    build_document(tmp_path / "notes.ctb", png_data, text="nmap -sV 10.0.0.1")
+    hasher = CherryTreeHasher(CherryTreeLink(str(tmp_path / "notes.ctb")))
+    before = hasher.get_signatures(), hasher.get_node_hashes()
+
+    # Saved again within the same second, with a text of the same length
+    build_document(tmp_path / "notes.ctb", png_data, text="nmap -sS 10.0.0.9")
+    hasher = CherryTreeHasher(CherryTreeLink(str(tmp_path / "notes.ctb")))
+    after = hasher.get_signatures(), hasher.get_node_hashes()
+    assert after[0][2] != before[0][2] and after[1][2] != before[1][2]
+    assert after[0][1] == before[0][1] and after[1][1] == before[1][1]
+
+def test_changed_nodes(tmp_path, png_data):
+    build_document(tmp_path / "first.ctb", png_data)
+    build_document(tmp_path / "second.ctb", png_data, text="new text")
+    first = CherryTreeHasher(CherryTreeLink(str(tmp_path / "first.ctb")))
+    second = CherryTreeHasher(CherryTreeLink(str(tmp_path / "second.ctb")))
+    assert first.get_tree_hashes()[4] == second.get_tree_hashes()[4]
+    assert first.get_tree_hashes()[1] != second.get_tree_hashes()[1]
+    assert list(iter_changed_nodes(first, second)) == [2]
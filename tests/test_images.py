@@ -0,0 +1,56 @@
+import zlib
+import struct
+from ctb_writer import CherryTree, CherryTreeNodeBuilder
+from ctb_writer.assets.png import recompress_png, _iter_chunks, _chunk, PNG_SIGNATURE
+
+def build_png(width=32, height=32, level=0):
+    """Build a poorly compressed rgb png with a gamma and a text chunk"""
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    pixels = b"".join(b"\x00" + bytes([x % 7, 10, 20] * width) for x in range(height))
+    return (PNG_SIGNATURE + _chunk(b"IHDR", ihdr) + _chunk(b"gAMA", struct.pack(">I", 45455))
+            + _chunk(b"tEXt", b"Comment\x00test")
+            + _chunk(b"IDAT", zlib.compress(pixels, level)) + _chunk(b"IEND", b""))
+
+def get_pixels(png):
+    return zlib.decompress(b"".join(data for kind, data in _iter_chunks(png) if kind == b"IDAT"))
+
+def test_recompress_png():
+    png = build_png()
+    recompressed = recompress_png(png)
+    assert len(recompressed) < len(png)
+    assert get_pixels(recompressed) == get_pixels(png)
+    assert [kind for kind, _ in _iter_chunks(recompressed)] == [b"IHDR", b"gAMA", b"IDAT", b"IEND"]
+
+    assert recompress_png(recompressed) is None
+    assert recompress_png(b"not a png") is None
+
+def test_save_optimize_images(tmp_path):
+    png = build_png()
+    node = CherryTreeNodeBuilder("Rich node").image(png).image(png).get_node()
+    document = CherryTree()
+    document.add_child(node)
+
+    reports = []
+    document.save(str(tmp_path / "optimized.ctb"), report=reports.append, optimize_images=True, workers=2)
+    assert len(reports[0].recompressed) == 2
+    assert reports[0].bytes_recompressed > 0
+
+    # The png are recompressed in the document only
+    assert [image.data for image in node.images] == [png, png]
+
+    loaded = CherryTree.load(str(tmp_path / "optimized.ctb"))
+    for image in loaded.get_node_by_id(1).images:
+        assert len(image.data) < len(png)
+        assert get_pixels(image.data) == get_pixels(png)
+
+def test_save_ctd_optimize_images(tmp_path):
+    png = build_png()
+    document = CherryTree()
+    document.add_child(CherryTreeNodeBuilder("Rich node").image(png).get_node())
+
+    reports = []
+    document.save(str(tmp_path / "optimized.ctd"), report=reports.append, optimize_images=True)
+    assert len(reports[0].recompressed) == 1
+    assert document.get_node_by_id(1).images[0].data == png
+    image = CherryTree.load(str(tmp_path / "optimized.ctd")).get_node_by_id(1).images[0]
+    assert get_pixels(image.data) == get_pixels(png) and len(image.data) < len(png)
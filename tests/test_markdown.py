@@ -0,0 +1,65 @@
+import xml.etree.ElementTree as ET
+from ctb_writer import CherryTree
+from ctb_writer.markdown import read_markdown
+
+MARKDOWN = """\
+Intro with **bold** and `code`
+
+# Title
+Some *italic* text, a [link](https://example.com) and snake_case_name
+![pixel](pixel.png)
+
+## Sub title
+```python
+print("test")
+```
+
+| Col1 | Col2 |
+|------|------|
+| a    | b \\| c |
+
+# Other title
+~~old~~
+"""
+
+def runs(node):
+    return [(dict(element.attrib), element.text) for element in node.xml]
+
+def test_read_markdown(tmp_path):
+    (tmp_path / "pixel.png").write_bytes(b"\x89PNG\r\n\x1a\n")
+    (tmp_path / "notes.md").write_text(MARKDOWN)
+    root = read_markdown(str(tmp_path / "notes.md"))
+
+    assert root.name == "notes"
+    assert [child.name for child in root.children] == ["Title", "Other title"]
+    assert runs(root)[1] == ({"weight": "heavy"}, "bold")
+    assert runs(root)[3] == ({"family": "monospace"}, "code")
+
+    title = root.children[0]
+    assert ({"style": "italic"}, "italic") in runs(title)
+    assert ({"link": "webs https://example.com"}, "link") in runs(title)
+    assert runs(title)[-3] == ({}, " and snake_case_name\n")
+    assert title.images[0].position == len("Some italic text, a link and snake_case_name\n")
+
+    sub_title = title.children[0]
+    assert sub_title.codebox[0].txt == 'print("test")\n'
+    assert sub_title.codebox[0].syntax == "python"
+    assert sub_title.tables[0].content == [["a", "b | c"], ["Col1", "Col2"]]
+    assert sub_title.tables[0].position == 2
+
+    document = CherryTree()
+    document.add_child(root)
+    assert [node.node_id for node in root] == [1, 2, 3, 4]
+    document.save(str(tmp_path / "notes.ctb"))
+    assert CherryTree.load(str(tmp_path / "notes.ctb")).get_node_by_id(3).tables[0].get_header() == ["Col1", "Col2"]
+
+def test_read_markdown_empty_image_and_inner_fence(tmp_path):
+    (tmp_path / "empty.png").write_bytes(b"")
+    (tmp_path / "notes.md").write_text("![empty](empty.png)\n"
+                                       "````markdown\n```bash\nls\n```\n````\n"
+                                       "after\n")
+    root = read_markdown(str(tmp_path / "notes.md"))
+    assert root.images == []
+    assert root.codebox[0].txt == "```bash\nls\n```\n"
+    assert root.codebox[0].position == len("empty\n")
+    assert runs(root)[-1][1].endswith("after\n")
@@ -0,0 +1,47 @@
+import io
+import json
+from ctb_writer import CherryTree, CherryTreeNodeBuilder
+from ctb_writer.ndjson import export_ndjson, import_ndjson
+
+def build_document(path, png_data):
+    document = CherryTree()
+    root_id = document.add_child("Root", text="root text")
+    rich = CherryTreeNodeBuilder("Rich", bold=True, color="sun").texts("[(bold|fg:green)]Title[/]\n")\
+                                .codebox("print(1)\n", "python").table([["a", "b"], ["H1", "H2"]])\
+                                .image(png_data).get_node()
+    document.add_child(rich, parent_id=root_id)
+    document.add_child(CherryTreeNodeBuilder("Code", type="code", syntax="python").text("x = 1\n").get_node(),
+                       parent_id=root_id)
+    document.save(str(path))
+
+def test_ndjson_round_trip(tmp_path, png_data):
+    build_document(tmp_path / "source.ctb", png_data)
+
+    output = io.StringIO()
+    assert export_ndjson(str(tmp_path / "source.ctb"), output) == 3
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [record["name"] for record in records] == ["Root", "Rich", "Code"]
+    assert records[1]["runs"][0] == [{"weight": "heavy", "foreground": "#008000"}, "Title"]
+    assert [entity["type"] for entity in records[1]["entities"]] == ["codebox", "table", "image"]
+
+    assert import_ndjson(io.StringIO(output.getvalue()), str(tmp_path / "copy.ctb"), batch_size=2) == 3
+    source = CherryTree.load(str(tmp_path / "source.ctb"))
+    copy = CherryTree.load(str(tmp_path / "copy.ctb"))
+    for node_id in (1, 2, 3):
+        assert copy.get_node_by_id(node_id).get_text() == source.get_node_by_id(node_id).get_text()
+        assert copy.get_node_by_id(node_id).get_title_style() == source.get_node_by_id(node_id).get_title_style()
+
+    rich = copy.get_node_by_id(2)
+    assert rich.codebox[0].txt == "print(1)\n"
+    assert rich.tables[0].get_header() == ["H1", "H2"]
+    assert rich.images[0].data == png_data
+
+def test_ndjson_images_out_of_band(tmp_path, png_data):
+    build_document(tmp_path / "source.ctb", png_data)
+    export_ndjson(str(tmp_path / "source.ctb"), str(tmp_path / "export.ndjson"),
+                  images_dir=str(tmp_path / "images"))
+    assert len(list((tmp_path / "images").iterdir())) == 1
+
+    import_ndjson(str(tmp_path / "export.ndjson"), str(tmp_path / "copy.ctb"),
+                  images_dir=str(tmp_path / "images"))
+    assert CherryTree.load(str(tmp_path / "copy.ctb")).get_node_by_id(2).images[0].data == png_data
@@ -0,0 +1,39 @@
+import pytest
+from ctb_writer import CherryTree, CherryTreeNodeBuilder
+from ctb_writer.cherry_tree_link import CherryTreeLink
+
+def build_document(path, png_data):
+    document = CherryTree()
+    root_id = document.add_child("Root", text="root")
+    document.add_child(CherryTreeNodeBuilder("big.py", type="code", syntax="python").text("x = 1\n" * 2000).get_node(),
+                       parent_id=root_id)
+    document.add_child(CherryTreeNodeBuilder("small.py", type="code", syntax="python").text("x = 1\n").get_node(),
+                       parent_id=root_id)
+    document.add_child(CherryTreeNodeBuilder("Screens").image(png_data).get_node(), parent_id=root_id)
+    tagged = CherryTreeNodeBuilder("Results").image(png_data).table([["a"], ["H"]]).get_node()
+    tagged.tags = ["cve"]
+    document.add_child(tagged)
+    document.add_child(CherryTreeNodeBuilder("log", type="plain").text("log").get_node())
+    document.save(str(path))
+
+def test_query(tmp_path, png_data):
+    build_document(tmp_path / "notes.ctb", png_data)
+    query = CherryTreeLink(str(tmp_path / "notes.ctb")).query()
+
+    assert query.filter(type="code", syntax="python", size__gt=10240).ids() == [2]
+    assert query.filter(has_image=True, has_table=False).ids() == [4]
+    assert query.filter(type="plain").ids() == [6]
+    assert query.filter(type__ne="code").ids() == [1, 4, 5, 6]
+    assert query.filter(type__in=["plain", "code"]).ids() == [2, 3, 6]
+    assert query.filter(tags="cve").ids() == [5]
+    assert query.filter(father_id=1, type="code").order_by("size").limit(1).ids() == [3]
+    assert query.filter(name__like="%.py", node_id__in=[1, 3]).count() == 1
+
+    row = next(query.filter(name="small.py").rows())
+    assert (row.syntax, row.size, row.father_id, row.sequence) == ("python", 6, 1, 2)
+    assert [node.get_text() for node in query.filter(name="small.py").nodes()] == ["x = 1\n"]
+
+    with pytest.raises(ValueError):
+        query.filter(color="red")
+    with pytest.raises(ValueError):
+        query.filter(type__lt="code")
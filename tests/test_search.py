@@ -0,0 +1,69 @@
+import importlib
+from ctb_writer import CherryTree, CherryTreeNodeBuilder
+from ctb_writer.cherry_tree_search import CherryTreeSearchIndex
+
+def build_document(path, scan="nmap -sV 10.0.0.1\n"):
+    document = CherryTree()
+    root_id = document.add_child("Report", text="")
+    document.add_child(CherryTreeNodeBuilder("Recon").texts("[(bold)]Open ports[/] found with nmap\n")
+                                                     .codebox(scan, "sh")
+                                                     .table([["22", "ssh"], ["Port", "Service"]])
+                                                     .get_node(), parent_id=root_id)
+    document.add_child("nmap", text="notes about the tool", parent_id=root_id)
+    if path.exists():
+        path.unlink()
+    document.save(str(path))
+    return document
+
+def test_search(tmp_path):
+    document = build_document(tmp_path / "notes.ctb")
+    results = document.search("nmap")
+    assert [result.node_id for result in results] == [3, 2]
+    assert results[1].snippet == "Open ports found with [nmap]\n"
+    assert [result.node_id for result in document.search("ssh")] == [2]
+    assert [result.node_id for result in document.search("bold")] == []
+    assert (tmp_path / "notes.ctb.search").exists()
+
+def test_search_index_update(tmp_path):
+    build_document(tmp_path / "notes.ctb")
+    index = CherryTreeSearchIndex(str(tmp_path / "notes.ctb"))
+    assert index.update() == (3, 0)
+    assert index.update() == (0, 0)
+    index.close()
+
+    document = build_document(tmp_path / "notes.ctb", scan="masscan 10.0.0.1\n")
+    index = CherryTreeSearchIndex(str(tmp_path / "notes.ctb"))
+    assert index.update() == (0, 0)
+    assert [result.node_id for result in index.search("masscan")] == [2]
+
+def test_search_punctuation(tmp_path):
+    document = build_document(tmp_path / "notes.ctb")
+    assert [result.node_id for result in document.search("10.0.0.1")] == [2]
+    assert [result.node_id for result in document.search("-sV 10.0.0.1")] == [2]
+    assert document.search('"unterminated') == []
+
+def test_search_index_same_length_edit(tmp_path):
+    build_document(tmp_path / "notes.ctb")
+    index = CherryTreeSearchIndex(str(tmp_path / "notes.ctb"))
+    index.update()
+    index.close()
+
+    # Saved again within the same second, with a codebox of the same length
+    document = build_document(tmp_path / "notes.ctb", scan="nmap -sS 10.0.0.9\n")
+    assert [result.node_id for result in document.search('"10.0.0.9"')] == [2]
+    assert [result.node_id for result in document.search("sS")] == [2]
+    assert document.search('"10.0.0.1"') == []
+
+def test_search_index_with_processes(tmp_path, monkeypatch):
+    build_document(tmp_path / "notes.ctb")
+    monkeypatch.setattr(CherryTreeSearchIndex, "batch_size", 1)
+    index = CherryTreeSearchIndex(str(tmp_path / "notes.ctb"))
+    assert index.update(workers=2) == (3, 0)
+    assert index.search("ports")[0].snippet == "Open [ports] found with nmap\n"
+
+def test_search_index_in_process_by_default(tmp_path, monkeypatch):
+    build_document(tmp_path / "notes.ctb")
+    monkeypatch.setattr(CherryTreeSearchIndex, "batch_size", 1)
+    monkeypatch.setattr(importlib.import_module("ctb_writer.beautify.plain_text"), "ProcessPoolExecutor", None)
+    index = CherryTreeSearchIndex(str(tmp_path / "notes.ctb"))
+    assert index.update() == (3, 0)
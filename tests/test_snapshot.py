@@ -0,0 +1,103 @@
+import pytest
+import sqlite3
+from ctb_writer import CherryTree, CherryTreeNodeBuilder
+from ctb_writer.snapshot import SnapshotStore
+
+def build_document(path, png_data, text, store=None):
+    document = CherryTree()
+    root_id = document.add_child("Root", text="root text")
+    document.add_child("Notes", text=text, parent_id=root_id)
+    document.add_child(CherryTreeNodeBuilder("Image").codebox("ls\n", "sh").image(png_data).get_node(),
+                       parent_id=root_id)
+    if path.exists():
+        path.unlink()
+    document.save(str(path), snapshot=store)
+
+def test_snapshots_share_content(tmp_path, png_data):
+    store = SnapshotStore(str(tmp_path / "notes.snapshots"))
+    build_document(tmp_path / "notes.ctb", png_data, "first", store)
+    assert store.snapshot(str(tmp_path / "notes.ctb")) == 1
+    build_document(tmp_path / "notes.ctb", png_data, "second", store)
+
+    assert [(version.version_id, version.nodes) for version in store.iter_versions()] == [(1, 3), (2, 3)]
+    con = sqlite3.connect(str(tmp_path / "notes.snapshots"))
+    assert con.execute("SELECT COUNT(*) FROM content").fetchone()[0] == 4
+    assert con.execute("SELECT COUNT(*) FROM png").fetchone()[0] == 1
+
+    history = list(store.iter_node_history(2))
+    assert [(node.version_id, node.name) for node in history] == [(1, "Notes"), (2, "Notes")]
+    assert "first" in history[0].txt and "second" in history[1].txt
+    assert len(list(store.iter_node_history(1))) == 1
+
+def test_restore(tmp_path, png_data):
+    store = SnapshotStore(str(tmp_path / "notes.snapshots"))
+    build_document(tmp_path / "notes.ctb", png_data, "first", store)
+    build_document(tmp_path / "notes.ctb", png_data, "second", store)
+
+    assert store.restore(1, str(tmp_path / "restored.ctb")) == 3
+    document = CherryTree.load(str(tmp_path / "restored.ctb"))
+    assert "first" in document.get_node_by_id(2).get_text()
+    assert document.get_node_by_id(3).images[0].data == png_data
+    assert document.get_node_by_id(3).codebox[0].txt == "ls\n"
+
+    assert store.restore(2, str(tmp_path / "node.ctb"), node_id=3) == 1
+    document = CherryTree.load(str(tmp_path / "node.ctb"))
+    assert [node.name for node in document.nodes] == ["Image"]
+
+def test_snapshot_same_length_edit(tmp_path, png_data):
+    store = SnapshotStore(str(tmp_path / "notes.snapshots"))
+    # Saved twice within the same second, with texts of the same length
+    build_document(tmp_path / "notes.ctb", png_data, "first", store)
+    build_document(tmp_path / "notes.ctb", png_data, "FIRST", store)
+    history = list(store.iter_node_history(2))
+    assert [node.version_id for node in history] == [1, 2]
+    assert "FIRST" in history[1].txt
+
+def test_restore_bookmarks_and_shared_nodes(tmp_path, png_data):
+    build_document(tmp_path / "notes.ctb", png_data, "first")
+    con = sqlite3.connect(str(tmp_path / "notes.ctb"))
+    con.execute("INSERT INTO bookmark VALUES (3, 1)")
+    con.execute("UPDATE children SET master_id=2 WHERE node_id=3")
+    con.commit()
+
+    store = SnapshotStore(str(tmp_path / "notes.snapshots"))
+    store.snapshot(str(tmp_path / "notes.ctb"))
+    store.restore(1, str(tmp_path / "restored.ctb"))
+    con = sqlite3.connect(str(tmp_path / "restored.ctb"))
+    assert con.execute("SELECT node_id, sequence FROM bookmark").fetchall() == [(3, 1)]
+    assert con.execute("SELECT master_id FROM children WHERE node_id=3").fetchone()[0] == 2
+
+def test_snapshot_rejects_ctd(tmp_path):
+    store = SnapshotStore(str(tmp_path / "notes.snapshots"))
+    with pytest.raises(ValueError):
+        CherryTree().save(str(tmp_path / "notes.ctd"), snapshot=store)
+    assert not (tmp_path / "notes.ctd").exists()
+
+def test_failed_snapshot_is_rolled_back(tmp_path, png_data, monkeypatch):
+    build_document(tmp_path / "notes.ctb", png_data, "first")
+    store = SnapshotStore(str(tmp_path / "notes.snapshots"))
+    calls = []
+    store_content = SnapshotStore._store_content
+    def failing_store_content(self, *args):
+        calls.append(args)
+        if len(calls) == 2:
+            raise OSError("disk full")
+        return store_content(self, *args)
+    monkeypatch.setattr(SnapshotStore, "_store_content", failing_store_content)
+    with pytest.raises(OSError):
+        store.snapshot(str(tmp_path / "notes.ctb"))
+    assert list(store.iter_versions()) == []
+
+    monkeypatch.undo()
+    assert store.snapshot(str(tmp_path / "notes.ctb")) == 1
+    assert [version.nodes for version in store.iter_versions()] == [3]
+
+def test_failed_restore_removes_destination(tmp_path, png_data, monkeypatch):
+    store = SnapshotStore(str(tmp_path / "notes.snapshots"))
+    build_document(tmp_path / "notes.ctb", png_data, "first", store)
+    def failing_restore(self, version_id, node_id):
+        raise OSError("disk full")
+    monkeypatch.setattr(SnapshotStore, "_restore", failing_restore)
+    with pytest.raises(OSError):
+        store.restore(1, str(tmp_path / "restored.ctb"))
+    assert not (tmp_path / "restored.ctb").exists()
@@ -0,0 +1,31 @@
+from ctb_writer import CherryTree, CherryTreeNodeBuilder
+from ctb_writer.cherry_tree_link import CherryTreeLink
+
+def build_document():
+    document = CherryTree()
+    for name, tags in (("web", ["cve", "http"]), ("ssh", ["cve"]), ("dns", ["info"]), ("empty", [])):
+        node = CherryTreeNodeBuilder(name).get_node()
+        node.tags = tags
+        document.add_child(node)
+    return document
+
+QUERIES = [
+    ({"all": ["cve"]}, [1, 2]),
+    ({"all": ["cve"], "none": ["http"]}, [2]),
+    ({"any": ["http", "info"]}, [1, 3]),
+    ({"none": ["cve"]}, [3, 4]),
+    ({"all": ["cv"]}, []),
+]
+
+def test_find_by_tags_in_memory():
+    document = build_document()
+    for query, node_ids in QUERIES:
+        assert document.find_by_tags(**query) == node_ids
+    assert document.get_tag_index().get_counts() == {"cve": 2, "http": 1, "info": 1}
+
+def test_find_by_tags_in_sql(tmp_path):
+    build_document().save(str(tmp_path / "notes.ctb"))
+    link = CherryTreeLink(str(tmp_path / "notes.ctb"))
+    for query, node_ids in QUERIES:
+        assert list(link.find_by_tags(**query)) == node_ids
+    assert [node.name for node in link.find_by_tags(all=["cve"], nodes=True)] == ["web", "ssh"]
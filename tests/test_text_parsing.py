@@ -1,6 +1,7 @@
 import pytest
 from ctb_writer import CherryTreeNodeBuilder
-from ctb_writer.beautify import parse
+from ctb_writer.beautify import parse, iter_parse, compile_markup, resolve_style
+from ctb_writer.beautify import plain_text, iter_runs, iter_plain_texts, OBJECT_REPLACEMENT
 from ctb_writer.beautify.text_parser import Tokenizer
 
 DEFAULT_TEXT = """
@@ -46,3 +47,47 @@ def test_plaintext():
 
     assert node.get_text() == "Test\n"
 
+
+def test_compiled_markup():
+    template = compile_markup("[(bold|underline|italic)]{title}[/] {{kept}} {count:03d}")
+    assert template.render_runs(title="test", count=7) == [('bold|underline|italic', 'test'),
+                                                         ('', ' {kept} 007')]
+
+    node = CherryTreeNodeBuilder("test").texts(template, title="test", count=1).get_node()
+    xml_content = "\n".join(node.get_text().split("\n")[1:])
+    assert xml_content.startswith(XML_BOLD_UNDERLINE_ITALIC[:-len("</node>")])
+
+def test_compiled_markup_values_not_parsed():
+    template = compile_markup("[(size:small|fg:green)]{value}[/]")
+    node = CherryTreeNodeBuilder("test").texts(template, value="[(bold)]test[/]").get_node()
+
+    xml_content = "\n".join(node.get_text().split("\n")[1:])
+    assert xml_content == XML_SMALL_GREEN.replace(">test<", ">[(bold)]test[/]<")
+
+def test_incremental_parse():
+    chunks = [DEFAULT_TEXT[i:i + 5] for i in range(0, len(DEFAULT_TEXT), 5)]
+    assert list(iter_parse(chunks)) == parse(DEFAULT_TEXT)
+
+def test_texts_from_file(tmp_path):
+    markup = tmp_path / "markup.txt"
+    markup.write_text("[(size:small|fg:green)]te\nst[/]")
+    node = CherryTreeNodeBuilder("test").texts_from_file(markup).get_node()
+
+    xml_content = "\n".join(node.get_text().split("\n")[1:])
+    assert xml_content == XML_SMALL_GREEN.replace("test", "te\nst")
+
+def test_styles_are_shared():
+    assert resolve_style("bold|fg:green") is resolve_style("bold|fg:green")
+    assert dict(resolve_style("bold|fg:green")) == {"weight": "heavy", "foreground": "#008000"}
+    with pytest.raises(TypeError):
+        resolve_style("bold")["weight"] = "normal"
+
+def test_plain_text():
+    node = CherryTreeNodeBuilder("Node").texts("[(bold)]Title[/] & text\n")\
+                                       .codebox("code", "sh", position=5).get_node()
+    txt = node.get_text()
+    assert list(iter_runs(txt))[0] == ({"weight": "heavy"}, "Title")
+    assert plain_text(txt) == "Title & text\n"
+    assert plain_text(txt, [5, (20, "[image]")]) == f"Title{OBJECT_REPLACEMENT} & text\n[image]"
+    assert node.plain_text() == f"Title{OBJECT_REPLACEMENT} & text\n"
+    assert list(iter_plain_texts([(txt, [5])] * 3, workers=2, batch_size=2)) == [node.plain_text()] * 3